@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+# Filename: bench_dispatch.py
+# Compares the old if/elif chain of __processData with ResponseDispatcher
+import re
+import time
+from gsmHat.gsmHat import ResponseDispatcher
+
+regexGetSingleValue = r'([+][a-zA-Z\ ]+(:\ ))([\d]+)'
+regexGetAllValues = r'([+][a-zA-Z:\s]+)([\w\",\s+-\/:.]+)'
+
+LINES = [
+    'OK',
+    '+CPMS: 1,30,1,30,1,30',
+    '+CMTI: "SM",3',
+    '+SAPBR: 1,1,"10.45.1.2"',
+    '+HTTPACTION: 0,200,12',
+    '+CMS ERROR: 500',
+    '+CGNSINF: 1,1,20201021120000.000,52.266949,10.524822,75.300,0.00,0.0,1,,0.9,1.2,0.8,,11,8,,,42,,',
+    'RING',
+]
+
+def oldChain(line):
+    if 'OK' in line:
+        pass
+    if 'ERROR' in line:
+        pass
+    elif '+CME ERROR:' in line:
+        re.findall(regexGetSingleValue, line)
+    elif '+CMS ERROR:' in line:
+        re.findall(regexGetSingleValue, line)
+    elif '+CPMS:' in line:
+        re.findall(regexGetAllValues, line)[0][1].split(',')
+    elif '+CMGR:' in line:
+        re.findall(regexGetAllValues, line)[0][1].split('","')
+    elif '+SAPBR:' in line:
+        re.findall(regexGetAllValues, line)[0][1].split(',')
+    elif '+HTTPREAD:' in line:
+        pass
+    elif '+HTTPACTION:' in line:
+        re.findall(regexGetAllValues, line)[0][1].split(',')
+    elif '+CMTI:' in line:
+        re.findall(regexGetAllValues, line)[0][1].split(',')
+    elif '+CGNSINF:' in line:
+        re.findall(regexGetAllValues, line)[0][1].split(',')
+
+def buildDispatcher():
+    dispatcher = ResponseDispatcher()
+    split = lambda values: values.split(',')
+    for prefix in ('OK', 'ERROR', '+CME ERROR', '+CMS ERROR', '+HTTPREAD'):
+        dispatcher.Register(prefix, lambda values: None)
+    for prefix in ('+CPMS', '+SAPBR', '+HTTPACTION', '+CMTI', '+CGNSINF'):
+        dispatcher.Register(prefix, split)
+    dispatcher.Register('+CMGR', lambda values: values.split('","'))
+    return dispatcher
+
+def run(name, function, lines):
+    start = time.perf_counter()
+    for line in lines:
+        function(line)
+    duration = time.perf_counter() - start
+    print('%-8s %12.0f lines/s' % (name, len(lines) / duration))
+
+if __name__ == '__main__':
+    lines = LINES * 50000
+    run('before', oldChain, lines)
+    run('after', buildDispatcher().Dispatch, lines)
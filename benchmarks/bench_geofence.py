@@ -0,0 +1,41 @@
+#!/usr/bin/python3
+# Filename: bench_geofence.py
+# Time per GeofenceRegistry.Update() with thousands of fences and distance throughput
+import random
+import time
+from gsmHat.gsmHat import GPS
+from gsmHat.geofence import GeofenceRegistry, CalculateDistances, numpy
+
+if __name__ == '__main__':
+    random.seed(1)
+    registry = GeofenceRegistry()
+    for i in range(5000):
+        registry.Add('fence%d' % i, random.uniform(47.0, 55.0), random.uniform(6.0, 15.0), random.uniform(50.0, 5000.0))
+
+    positions = []
+    for i in range(20000):
+        position = GPS()
+        position.Latitude = random.uniform(47.0, 55.0)
+        position.Longitude = random.uniform(6.0, 15.0)
+        positions.append(position)
+
+    events = 0
+    start = time.perf_counter()
+    for position in positions:
+        events += len(registry.Update(position))
+    duration = time.perf_counter() - start
+    print('%d fences: %.1f us per update, %d events' % (len(registry), duration / len(positions) * 1e6, events))
+
+    latitudes = [position.Latitude for position in positions]
+    longitudes = [position.Longitude for position in positions]
+    start = time.perf_counter()
+    for position in positions[:50]:
+        [GPS.CalculateDeltaP(position, other) for other in positions]
+    loop = time.perf_counter() - start
+    start = time.perf_counter()
+    for position in positions[:50]:
+        CalculateDistances(position.Latitude, position.Longitude, latitudes, longitudes)
+    batch = time.perf_counter() - start
+    count = 50 * len(positions)
+    print('CalculateDeltaP loop: %12.0f distances/s' % (count / loop))
+    print('CalculateDistances:   %12.0f distances/s (numpy %s)' % (count / batch, 'used' if numpy is not None else 'not installed'))
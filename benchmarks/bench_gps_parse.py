@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+# Filename: bench_gps_parse.py
+# +CGNSINF fixes parsed per second and memory per fix, old parser against parseCGNSINF
+import logging
+import time
+import tracemalloc
+from datetime import datetime
+from gsmHat.gsmHat import parseCGNSINF
+
+VALUES = '1,1,20201021120000.000,52.266949,10.524822,75.300,0.00,0.0,1,,0.9,1.2,0.8,,11,8,,,42,,'
+NOFIX = '1,0,20201021120000.000,,,,0.00,0.0,0,,,,,,11,0,,,,,'
+
+class OldGPS:
+    def __init__(self):
+        self.GNSS_status = 0
+        self.Fix_status = 0
+        self.UTC = ''
+        self.Latitude = 0.0
+        self.Longitude = 0.0
+        self.Altitude = 0.0
+        self.Speed = 0.0
+        self.Course = 0.0
+        self.HDOP = 0.0
+        self.PDOP = 0.0
+        self.VDOP = 0.0
+        self.GPS_satellites = 0
+        self.GNSS_satellites = 0
+        self.Signal = 0.0
+
+def oldParse(values, logger=logging.getLogger('bench')):
+    # Condensed copy of the former if/try chain in __processData
+    rawData = values.split(',')
+    newGPS = OldGPS()
+    goodPosition = True
+    for index, name, converter, check in ((0, 'GNSS_status', int, False), (1, 'Fix_status', int, True),
+                                          (3, 'Latitude', float, True), (4, 'Longitude', float, True),
+                                          (5, 'Altitude', float, True), (6, 'Speed', float, False),
+                                          (7, 'Course', float, False), (10, 'HDOP', float, False),
+                                          (11, 'PDOP', float, True), (12, 'VDOP', float, False),
+                                          (14, 'GPS_satellites', int, False), (15, 'GNSS_satellites', int, False)):
+        try:
+            setattr(newGPS, name, converter(rawData[index]))
+            if check and getattr(newGPS, name) == 0:
+                goodPosition = False
+        except:
+            logger.debug(name + ': Could not convert ' + rawData[index] + ' to ' + converter.__name__ + '.')
+    try:
+        newGPS.UTC = datetime.strptime(rawData[2][:-4], '%Y%m%d%H%M%S')
+    except:
+        logger.debug('UTC: Could not convert ' + rawData[2][:-4] + ' to int.')
+    try:
+        newGPS.Signal = float(rawData[18]) / 55.0
+    except:
+        logger.debug('Signal: Could not convert ' + rawData[18] + ' to float.')
+    return newGPS if goodPosition else None
+
+def rate(name, parser, values, count=50000):
+    start = time.perf_counter()
+    for i in range(count):
+        parser(values)
+    return count / (time.perf_counter() - start)
+
+def memoryPerFix(parser, count=10000):
+    tracemalloc.start()
+    fixes = [parser(VALUES) for i in range(count)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / len(fixes)
+
+if __name__ == '__main__':
+    for name, parser in (('before', oldParse), ('after', parseCGNSINF)):
+        print('%-8s %10.0f fixes/s %10.0f no-fix lines/s %6.0f bytes/fix' % (
+            name, rate(name, parser, VALUES), rate(name, parser, NOFIX), memoryPerFix(parser)))
@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# Filename: bench_journal.py
+# Durable SMS jobs: one sqlite transaction per message, one fsync per message and the
+# group commit of Journal. Time the application is blocked per message and fsyncs per message.
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from gsmHat.journal import Journal
+
+def message(i):
+    return {'Receiver': '+4916012345%02d' % (i % 100), 'Message': 'Position %d: 52.266949,10.524822' % i}
+
+def result(name, count, blocked, durable, fsyncs):
+    print('%-12s %8.1f us blocked/message %8.1f us until durable/message %6.3f fsyncs/message' % (
+        name, blocked / count * 1e6, durable / count * 1e6, fsyncs / float(count)))
+
+def submitters(threads, count, submit):
+    # Like several parts of an application writing SMS at the same time, returns the blocked time
+    blocked = [0.0] * threads
+
+    def run(index):
+        for i in range(index, count, threads):
+            begin = time.perf_counter()
+            submit(i)
+            blocked[index] += time.perf_counter() - begin
+
+    workers = [threading.Thread(target=run, args=(index,)) for index in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sum(blocked)
+
+def benchSqlite(directory, count, threads):
+    path = os.path.join(directory, 'outbox.db')
+    database = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    database.execute('PRAGMA synchronous=FULL')
+    database.execute('CREATE TABLE outbox (id INTEGER PRIMARY KEY, receiver TEXT, message TEXT)')
+    lock = threading.Lock()
+
+    def submit(i):
+        job = message(i)
+        with lock:
+            database.execute('INSERT INTO outbox (receiver, message) VALUES (?, ?)', (job['Receiver'], job['Message']))
+
+    begin = time.perf_counter()
+    blocked = submitters(threads, count, submit)
+    result('sqlite', count, blocked, time.perf_counter() - begin, count)
+    database.close()
+
+def benchFsync(directory, count, threads):
+    journalFile = open(os.path.join(directory, 'outbox.fsync'), 'a')
+    lock = threading.Lock()
+
+    def submit(i):
+        with lock:
+            journalFile.write('%r\n' % (message(i),))
+            journalFile.flush()
+            os.fsync(journalFile.fileno())
+
+    begin = time.perf_counter()
+    blocked = submitters(threads, count, submit)
+    result('fsync', count, blocked, time.perf_counter() - begin, count)
+    journalFile.close()
+
+def benchJournal(directory, count, threads, commitInterval):
+    journal = Journal(os.path.join(directory, 'outbox.journal'), CommitInterval=commitInterval)
+    begin = time.perf_counter()
+    blocked = submitters(threads, count, lambda i: journal.Append('SMS', message(i)))
+    journal.Flush()
+    durable = time.perf_counter() - begin
+    result('journal %.0fms' % (commitInterval * 1000), count, blocked, durable, journal.Counters['Commits'])
+    journal.Close()
+
+def benchCompaction(directory, count):
+    path = os.path.join(directory, 'outbox.compact')
+    journal = Journal(path, CommitInterval=0.01, CompactAfter=1000)
+    for i in range(count):
+        journal.Complete(journal.Append('SMS', message(i)))
+    journal.Flush()
+    print('compaction   %d jobs, %d compactions, %d bytes left in the file' % (
+        count, journal.Counters['Compactions'], os.path.getsize(path)))
+    journal.Close()
+
+if __name__ == '__main__':
+    count = 2000
+    for threads in (1, 4):
+        print('%d submitting threads' % threads)
+        for bench in (benchSqlite, benchFsync):
+            with tempfile.TemporaryDirectory() as directory:
+                bench(directory, count, threads)
+        for commitInterval in (0.0, 0.05):
+            with tempfile.TemporaryDirectory() as directory:
+                benchJournal(directory, count, threads, commitInterval)
+    with tempfile.TemporaryDirectory() as directory:
+        benchCompaction(directory, 5000)
@@ -0,0 +1,33 @@
+#!/usr/bin/python3
+# Filename: bench_latency.py
+# Measures the round trip time per AT command against the modem simulator
+import os
+import time
+import tempfile
+from gsmHat.gsmHat import GSMHat
+from gsmHat.simulator import ModemSimulator
+
+if __name__ == '__main__':
+    modem = ModemSimulator()
+    gsm = GSMHat(modem.Port, 115200, os.path.join(tempfile.gettempdir(), 'bench_latency.log'))
+    time.sleep(1.0)     # let the init sequence pass
+
+    count = 50
+    start = time.perf_counter()
+    futures = [gsm.SMS_write('+491601234567', 'Message %d' % i) for i in range(count)]
+    for future in futures:
+        future.result(10)
+    duration = time.perf_counter() - start
+    stats = gsm.GetStats()
+    gsm.close()
+    modem.close()
+
+    print('%d SMS sent in %.3f s' % (count, duration))
+    print('Round trip per AT+CMGS: %.2f ms' % (duration / count * 1000.0))
+    sendTimes = [t for t, line in modem.Commands if line.startswith('AT+CMGS')]
+    gaps = [b - a for a, b in zip(sendTimes, sendTimes[1:])]
+    if gaps:
+        print('Gap between commands: min %.2f ms, max %.2f ms' % (min(gaps) * 1000.0, max(gaps) * 1000.0))
+    for name, histogram in sorted(stats['Commands'].items()):
+        print('GetStats() %-10s %4d x, mean %.2f ms, max %.2f ms' % (name, histogram['Count'], histogram['Mean'] * 1000.0, histogram['Max'] * 1000.0))
+    print('GetStats() SMS queue wait: mean %.2f ms' % (stats['QueueWaits']['SMS']['Mean'] * 1000.0))
@@ -0,0 +1,272 @@
+#!/usr/bin/python3
+# Filename: bench_modem.py
+# End to end benchmarks against the modem simulator: SMS send and receive throughput,
+# HTTP request latency, HTTP download and upload rate, TCP/UDP echo throughput, GPS position rate
+# and CPU time of gsmHat per message, the inbox and a download with NMEA sentences between the lines
+import os
+import socketserver
+import tempfile
+import threading
+import time
+from gsmHat.gsmHat import GSMHat
+from gsmHat.simulator import ModemSimulator
+
+class Measurement:
+    """Wall clock and CPU time of this process without the simulator thread"""
+
+    def __init__(self, modem):
+        self.modem = modem
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time() - modem.CPUTime
+
+    def result(self, count):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.modem.CPUTime - self.cpu
+        return count / wall, cpu / count * 1000.0
+
+def start(modem):
+    gsm = GSMHat(modem.Port, 115200, os.path.join(tempfile.gettempdir(), 'bench_modem.log'),
+                 os.path.join(tempfile.gettempdir(), 'bench_modem_trace.log'))
+    time.sleep(0.5)     # let the init sequence pass
+    return gsm
+
+def benchSMSsend(count=1000):
+    modem = ModemSimulator()
+    gsm = start(modem)
+    measurement = Measurement(modem)
+    futures = [gsm.SMS_write('+491601234567', 'Message %d' % i) for i in range(count)]
+    for future in futures:
+        future.result(30)
+    rate, cpu = measurement.result(count)
+    gsm.close()
+    modem.close()
+    print('SMS send:     %8.0f messages/s %8.3f ms CPU per message' % (rate, cpu))
+
+def benchSMSreceive(count=1000):
+    modem = ModemSimulator()
+    gsm = start(modem)
+
+    def deliver():
+        for i in range(count):
+            while modem.ReceiveSMS('+491601234567', 'Message %d' % i) == 0:
+                time.sleep(0.001)   # SIM card is full
+    measurement = Measurement(modem)
+    threading.Thread(target=deliver, daemon=True).start()
+    received = 0
+    while received < count and gsm.SMS_read(Timeout=10) != None:
+        received += 1
+    rate, cpu = measurement.result(received)
+    gsm.close()
+    modem.close()
+    print('SMS receive:  %8.0f messages/s %8.3f ms CPU per message (%d received)' % (rate, cpu, received))
+
+def benchHTTP(count=200, httpLatency=0.0):
+    modem = ModemSimulator(HttpLatency=httpLatency)
+    modem.DefaultHttpResponse = (200, 'x' * 200)
+    GSMHat.cGPRSstatusWaittime = 100
+    gsm = start(modem)
+    gsm.SetGPRSconnection('internet', 'user', 'password')
+    gsm.CallUrl('example.com/warmup').result(30)      # opens the bearer
+
+    latencies = []
+    measurement = Measurement(modem)
+    for i in range(count):
+        begin = time.perf_counter()
+        gsm.CallUrl('example.com/%d' % i).result(30)
+        latencies.append(time.perf_counter() - begin)
+    rate, cpu = measurement.result(count)
+    gsm.close()
+    modem.close()
+    GSMHat.cGPRSstatusWaittime = 5000
+    latencies.sort()
+    print('HTTP:         %8.0f requests/s %8.3f ms CPU per request, latency median %.2f ms, p95 %.2f ms' % (
+        rate, cpu, latencies[len(latencies) // 2] * 1000.0, latencies[int(len(latencies) * 0.95)] * 1000.0))
+
+def benchHTTPqueued(count=200):
+    # Queued calls share one initialized HTTP service
+    modem = ModemSimulator()
+    GSMHat.cGPRSstatusWaittime = 100
+    gsm = start(modem)
+    gsm.SetGPRSconnection('internet', 'user', 'password')
+    gsm.CallUrl('example.com/warmup').result(30)
+
+    commands = len(modem.Commands)
+    measurement = Measurement(modem)
+    futures = [gsm.CallUrl('example.com/%d' % i) for i in range(count)]
+    for future in futures:
+        future.result(30)
+    rate, cpu = measurement.result(count)
+    stats = gsm.GetStats()['Counters']
+    gsm.close()
+    modem.close()
+    GSMHat.cGPRSstatusWaittime = 5000
+    httpCommands = len([command for t, command in modem.Commands[commands:] if command.startswith('AT+HTTP')])
+    print('HTTP queued:  %8.0f requests/s %8.3f ms CPU per request, %.2f HTTP commands per request, %d round trips saved' % (
+        rate, cpu, httpCommands / float(count), stats['SavedRoundTrips']))
+
+def benchHTTPtransfer(size=256 * 1024, count=5):
+    # Binary download into UrlResponse.Content and into a file, POST upload
+    modem = ModemSimulator()
+    modem.HttpResponses['example.com/blob'] = (200, os.urandom(size))
+    GSMHat.cGPRSstatusWaittime = 100
+    gsm = start(modem)
+    gsm.SetGPRSconnection('internet', 'user', 'password')
+    gsm.CallUrl('example.com/warmup').result(30)
+
+    measurement = Measurement(modem)
+    for i in range(count):
+        gsm.CallUrl('example.com/blob').result(60)
+    rate, cpu = measurement.result(count * size / 1024.0)
+    print('HTTP GET:     %8.0f KiB/s %12.3f ms CPU per KiB (into Content)' % (rate, cpu))
+
+    with tempfile.TemporaryFile() as file:
+        measurement = Measurement(modem)
+        for i in range(count):
+            gsm.CallUrl('example.com/blob', Sink=file).result(60)
+        rate, cpu = measurement.result(count * size / 1024.0)
+    print('HTTP GET:     %8.0f KiB/s %12.3f ms CPU per KiB (into a file)' % (rate, cpu))
+
+    data = os.urandom(size)
+    measurement = Measurement(modem)
+    for i in range(count):
+        gsm.CallUrl('example.com/upload', 'POST', data, 'application/octet-stream').result(60)
+    rate, cpu = measurement.result(count * size / 1024.0)
+    print('HTTP POST:    %8.0f KiB/s %12.3f ms CPU per KiB' % (rate, cpu))
+    gsm.close()
+    modem.close()
+    GSMHat.cGPRSstatusWaittime = 5000
+
+class EchoHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        data = self.request.recv(4096)
+        while data:
+            self.request.sendall(data)
+            data = self.request.recv(4096)
+
+class DatagramEchoHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        data, server = self.request
+        server.sendto(data, self.client_address)
+
+def startEchoServer(serverClass, handler):
+    # Local echo server, the simulator connects to it for AT+CIPSTART
+    server = serverClass(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def benchSocketEcho(count=5000, size=32, pingCount=200):
+    server = startEchoServer(socketserver.ThreadingTCPServer, EchoHandler)
+    modem = ModemSimulator()
+    gsm = start(modem)
+    gsm.SetGPRSconnection('internet', 'user', 'password')
+    sock = gsm.OpenSocket('127.0.0.1', server.server_address[1], 'TCP')
+    sock.Connected.result(10)
+
+    # Ping pong: one message on the wire at a time
+    latencies = []
+    for i in range(pingCount):
+        begin = time.perf_counter()
+        sock.Send(b'x' * size)
+        received = 0
+        while received < size:
+            received += len(sock.Receive(10))
+        latencies.append(time.perf_counter() - begin)
+    latencies.sort()
+
+    # Streaming: queued messages share AT+CIPSEND
+    sends = gsm.GetStats()['Counters']['SocketSends']
+    measurement = Measurement(modem)
+    for i in range(count):
+        sock.Send(b'x' * size)
+    received = 0
+    while received < count * size:
+        received += len(sock.Receive(10))
+    rate, cpu = measurement.result(count)
+    sends = gsm.GetStats()['Counters']['SocketSends'] - sends
+    sock.Close()
+    gsm.close()
+    modem.close()
+    server.shutdown()
+    print('TCP echo:     %8.0f messages/s %8.3f ms CPU per message, %.1f messages per AT+CIPSEND, '
+          'ping pong median %.2f ms' % (rate, cpu, count / float(sends), latencies[len(latencies) // 2] * 1000.0))
+
+def benchDatagramEcho(count=2000, size=32):
+    server = startEchoServer(socketserver.ThreadingUDPServer, DatagramEchoHandler)
+    modem = ModemSimulator()
+    gsm = start(modem)
+    gsm.SetGPRSconnection('internet', 'user', 'password')
+    sock = gsm.OpenSocket('127.0.0.1', server.server_address[1], 'UDP')
+    sock.Connected.result(10)
+
+    measurement = Measurement(modem)
+    for i in range(count):
+        sock.Send(b'x' * size)
+    received = 0
+    while received < count and sock.Receive(2) != None:
+        received += 1
+    rate, cpu = measurement.result(count)
+    gsm.close()
+    modem.close()
+    server.shutdown()
+    print('UDP echo:     %8.0f datagrams/s %7.3f ms CPU per datagram (%d of %d echoed)' % (rate, cpu, received, count))
+
+def benchGPS(duration=2.0):
+    modem = ModemSimulator()
+    modem.NMEAInterval = 0.0005
+    modem.SetPosition(52.266949, 10.524822, 75.3, 18.5, 45.0)
+    gsm = start(modem)
+    positions = []
+    gsm.AddGPSListener(positions.append)
+    gsm.SetGPSstreaming(True)
+    time.sleep(0.5)
+
+    count = len(positions)
+    measurement = Measurement(modem)
+    time.sleep(duration)
+    rate, cpu = measurement.result(len(positions) - count)
+    gsm.close()
+    modem.close()
+    print('GPS (NMEA):   %8.0f positions/s %7.3f ms CPU per position' % (rate, cpu))
+
+def benchGPSinterleaved(count=200, downloads=10, size=16 * 1024):
+    # NMEA sentences between the lines of the answers, which come in chunks of 16 bytes
+    modem = ModemSimulator()
+    modem.NMEAInterval = 0.005
+    modem.InterleaveNMEA = True
+    modem.ChunkSize = 16
+    modem.HttpResponses['example.com/blob'] = (200, os.urandom(size))
+    modem.SetPosition(52.266949, 10.524822, 75.3, 18.5, 45.0)
+    GSMHat.cGPRSstatusWaittime = 100
+    gsm = start(modem)
+    gsm.SetGPRSconnection('internet', 'user', 'password')
+    positions = []
+    gsm.AddGPSListener(positions.append)
+    gsm.SetGPSstreaming(True)
+    time.sleep(0.5)
+
+    measurement = Measurement(modem)
+    for i in range(count):
+        while modem.ReceiveSMS('+491601234567', 'Message %d' % i) == 0:
+            time.sleep(0.001)
+    received = [gsm.SMS_read(Timeout=10) for i in range(count)]
+    intact = len(set(sms.Message for sms in received if sms != None) & set('Message %d' % i for i in range(count)))
+    downloads = [gsm.CallUrl('example.com/blob').result(60).Content for i in range(downloads)]
+    rate, cpu = measurement.result(count)
+    gsm.close()
+    modem.close()
+    GSMHat.cGPRSstatusWaittime = 5000
+    blob = modem.HttpResponses['example.com/blob'][1]
+    print('GPS + inbox:  %8.0f messages/s %7.3f ms CPU per message, %d of %d SMS and %d of %d downloads intact, '
+          '%d positions' % (rate, cpu, intact, count, downloads.count(blob), len(downloads), len(positions)))
+
+if __name__ == '__main__':
+    benchSMSsend()
+    benchSMSreceive()
+    benchHTTP()
+    benchHTTPqueued()
+    benchHTTPtransfer()
+    benchSocketEcho()
+    benchDatagramEcho()
+    benchGPS()
+    benchGPSinterleaved()
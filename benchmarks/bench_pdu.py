@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+# Filename: bench_pdu.py
+# Long alerts against the modem simulator (AT+CMGS takes 100 ms): split by the application into
+# 160 character SMS in text mode against one multipart SMS in PDU mode, a Cyrillic alert
+# (not possible in text mode), the inbox with 10 long messages and the codec itself.
+import time
+from gsmHat.gsmHat import GSMHat
+from gsmHat.pdu import EncodeSubmit, EncodeDeliver, DecodePDU, Reassembler
+from gsmHat.simulator import ModemSimulator
+
+Alert = 'ALARM pump station 3: water level 2.41 m above normal, pumps 1 and 2 running at full load. ' * 6
+Cyrillic = 'ТРЕВОГА насосная станция 3: уровень воды на 2,41 м выше нормы. ' * 5
+
+def start(pduMode):
+    GSMHat.SMSpduMode = pduMode
+    modem = ModemSimulator(Latency=0.002)
+    modem.Latencies['AT+CMGS'] = 0.1
+    gsm = GSMHat(modem.Port, 115200, None, None)
+    gsm.SMS_write('+491601234567', 'Warmup').result(30)
+    return modem, gsm
+
+def send(name, modem, gsm, texts):
+    sent = len(modem.SentSMS)
+    begin = time.perf_counter()
+    for future in [gsm.SMS_write('+491601234567', text) for text in texts]:
+        future.result(60)
+    duration = time.perf_counter() - begin
+    print('%-28s %4d characters in %5.2f s, %d AT+CMGS' % (
+        name, sum(len(text) for text in texts), duration, len(modem.SentSMS) - sent))
+
+def inbox(modem, gsm, count):
+    begin = time.perf_counter()
+    for i in range(count):
+        modem.ReceiveSMS('+491607654321', Alert[:400])
+    received = [gsm.SMS_read(Timeout=30) for i in range(count)]
+    duration = time.perf_counter() - begin
+    complete = len([sms for sms in received if sms != None and sms.Message == Alert[:400]])
+    print('%-28s %d of %d messages of 3 parts complete after %.2f s' % ('inbox', complete, count, duration))
+
+if __name__ == '__main__':
+    GSMHat.cSMSwaittime = 200
+    modem, gsm = start(False)
+    send('text mode, split by the app', modem, gsm, [Alert[i:i + 160] for i in range(0, len(Alert), 160)])
+    gsm.close()
+    modem.close()
+
+    modem, gsm = start(True)
+    send('PDU mode, one long SMS', modem, gsm, [Alert])
+    send('PDU mode, Cyrillic (UCS2)', modem, gsm, [Cyrillic])
+    inbox(modem, gsm, 10)
+    gsm.close()
+    modem.close()
+
+    count = 2000
+    begin = time.perf_counter()
+    pdus = [EncodeSubmit('+491601234567', Alert, i % 256) for i in range(count)]
+    encoded = time.perf_counter() - begin
+    delivered = [pdu for length, pdu in EncodeDeliver('+491601234567', Alert)] * count
+    reassembler = Reassembler()
+    begin = time.perf_counter()
+    messages = [reassembler.Add(DecodePDU(pdu)) for pdu in delivered]
+    decoded = time.perf_counter() - begin
+    print('codec: encode %.1f us, decode and reassemble %.1f us per part' % (
+        encoded / (count * len(pdus[0])) * 1e6, decoded / len(delivered) * 1e6))
@@ -0,0 +1,62 @@
+#!/usr/bin/python3
+# Filename: bench_pool.py
+# SMS throughput of a GSMHatPool with 1, 2 and 4 modem simulators (AT+CMGS takes 100 ms),
+# one modem slower than the others, and one modem that needs AT+CFUN=1,1 in the middle of a burst.
+import time
+from gsmHat.gsmHat import GSMHat
+from gsmHat.pool import GSMHatPool
+from gsmHat.simulator import ModemSimulator
+
+def createPool(cmgsLatencies):
+    modems = []
+    for latency in cmgsLatencies:
+        modem = ModemSimulator(Latency=0.002)
+        modem.Latencies['AT+CMGS'] = latency
+        modem.RebootTime = 1.0
+        modems.append(modem)
+    pool = GSMHatPool([GSMHat(modem.Port, 115200, None, None) for modem in modems])
+    # Until the init of the hats is done
+    for future in [pool.SMS_write('+491601234567', 'Warmup %d' % i) for i in range(2 * len(modems))]:
+        future.result(30)
+    return modems, pool
+
+def burst(name, modems, pool, count, lostAnswers=0):
+    begin = time.perf_counter()
+    futures = [pool.SMS_write('+491601234567', 'Message %d' % i) for i in range(count)]
+    if lostAnswers > 0:
+        time.sleep(0.3)
+        modems[0].InjectError(None, None, lostAnswers)
+    for future in futures:
+        future.result(120)
+    duration = time.perf_counter() - begin
+    for i, modem in enumerate(modems):
+        modem.ReceiveSMS('+49160765432%d' % i, 'Incoming')
+    received = [pool.SMS_read(Timeout=10) for modem in modems]
+    stats = pool.GetStats()
+    perModem = '/'.join(str(len([sms for sms in modem.SentSMS if sms[1].startswith('Message')])) for modem in modems)
+    print('%-22s %d SMS in %5.2f s, %5.1f SMS/s, per modem %s, %d failovers, %d rebalanced, inbox %d of %d' % (
+        name, count, duration, count / duration, perModem, stats['Counters']['Failovers'], pool.Counters['Rebalanced'],
+        len([sms for sms in received if sms != None]), len(modems)))
+
+def close(modems, pool):
+    pool.close()
+    for modem in modems:
+        modem.close()
+
+if __name__ == '__main__':
+    GSMHat.cGPRSstatusWaittime = 100
+    GSMHat.cSoftResetTime = 1500
+    # AT+CMGS takes 0.1 to 0.3 s here, its lost answer is noticed after 2 s instead of 30 s
+    GSMHat.cCommandTimeouts = dict(GSMHat.cCommandTimeouts, **{'AT+CMGS': 2})
+    for count in (1, 2, 4):
+        modems, pool = createPool([0.1] * count)
+        burst('%d modem%s' % (count, 's' if count > 1 else ''), modems, pool, 100)
+        close(modems, pool)
+
+    modems, pool = createPool([0.1, 0.1, 0.3])
+    burst('3 modems, one slow', modems, pool, 100)
+    close(modems, pool)
+
+    modems, pool = createPool([0.1, 0.1])
+    burst('2 modems, one reset', modems, pool, 100, 1 + GSMHat.cRecoveryProbes)
+    close(modems, pool)
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+# Filename: bench_reader.py
+# Compares the old byte by byte serial loop with SerialLineReader
+import time
+from gsmHat.gsmHat import SerialLineReader
+
+class FakeSerial:
+    """Delivers a fixed byte stream in chunks, like the UART buffer of the hat"""
+
+    def __init__(self, data, chunkSize):
+        self.data = data
+        self.pos = 0
+        self.chunkSize = chunkSize
+        self.available = 0
+
+    @property
+    def in_waiting(self):
+        if self.available == 0 and self.pos < len(self.data):
+            self.available = min(self.chunkSize, len(self.data) - self.pos)
+        return self.available
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def read(self, size=1):
+        size = min(size, self.in_waiting)
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += size
+        self.available -= size
+        return chunk
+
+def buildStream(repeat):
+    gps = b'+CGNSINF: 1,1,20201021120000.000,52.266949,10.524822,75.300,0.00,0.0,1,,0.9,1.2,0.8,,11,8,,,42,,\r\n\r\nOK\r\n'
+    sms = b'+CMGR: "REC UNREAD","+491601234567","","20/10/21,12:00:00+08"\r\nHello mobile world\r\n\r\nOK\r\n'
+    return (gps + sms) * repeat
+
+def oldReader(ser, lines):
+    serData = ''
+    while ser.inWaiting() > 0:
+        newChar = ser.read().decode('iso-8859-1')
+        if newChar == '\n':
+            lines.append(serData)
+            serData = ''
+        elif newChar != '\r':
+            serData += newChar
+
+def newReader(ser, lines):
+    reader = SerialLineReader(ser)
+    while ser.in_waiting > 0:
+        for line in reader.ReadLines(lambda: False):
+            lines.append(line)
+
+def run(name, reader, data, chunkSize):
+    ser = FakeSerial(data, chunkSize)
+    lines = []
+    start = time.perf_counter()
+    reader(ser, lines)
+    duration = time.perf_counter() - start
+    print('%-8s %8d lines %12.0f bytes/s' % (name, len(lines), len(data) / duration))
+    return lines
+
+if __name__ == '__main__':
+    data = buildStream(2000)
+    for chunkSize in (64, 4096):
+        print('Chunk size %d bytes:' % chunkSize)
+        before = run('before', oldReader, data, chunkSize)
+        after = run('after', newReader, data, chunkSize)
+        assert before == after
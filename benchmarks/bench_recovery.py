@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+# Filename: bench_recovery.py
+# The module stops answering during SMS and URL jobs: once (AT/ATE0 helps), until AT+CFUN=1,1
+# and until the power key. Time until it answers again and until all jobs are done.
+# Before, a timeout in state 2, 3 or 97 cost 14 s of power key plus the init, all other ones killed the worker.
+import os
+import tempfile
+import time
+from gsmHat.gsmHat import GSMHat
+from gsmHat.simulator import ModemSimulator
+
+def bench(name, lostAnswers):
+    modem = ModemSimulator(Latency=0.01)
+    modem.Latencies['AT+CMGS'] = 0.2
+    modem.RebootTime = 1.0
+    GSMHat.cGPRSstatusWaittime = 100
+    GSMHat.cSoftResetTime = 1500
+    GSMHat.cPowerKeyTime = 500
+    GSMHat.cPowerOnTime = 1000
+    # AT+CMGS takes 0.2 s here, its lost answer is noticed after 2 s instead of 30 s
+    GSMHat.cCommandTimeouts = dict(GSMHat.cCommandTimeouts, **{'AT+CMGS': 2})
+    gsm = GSMHat(modem.Port, 115200, os.path.join(tempfile.gettempdir(), 'bench_recovery.log'),
+                 os.path.join(tempfile.gettempdir(), 'bench_recovery_trace.log'))
+    gsm.SetGPRSconnection('internet', 'user', 'password')
+    gsm.CallUrl('example.com/warmup').result(30)
+    for future in [gsm.SMS_write('+491601234567', 'Warmup %d' % i) for i in range(5)]:
+        future.result(30)
+
+    begin = time.perf_counter()
+    futures = [gsm.SMS_write('+491601234567', 'Message %d' % i) for i in range(10)]
+    futures += [gsm.CallUrl('example.com/report?n=%d' % i) for i in range(10)]
+    time.sleep(0.3)
+    # Every command gets no answer, until lostAnswers are lost
+    modem.InjectError(None, None, lostAnswers)
+    done = 0
+    for future in futures:
+        try:
+            future.result(60)
+            done += 1
+        except Exception as e:
+            print('  job failed: %r' % e)
+    duration = time.perf_counter() - begin
+    stats = gsm.GetStats()
+    recoveries = ', '.join('%s %.2f s' % (step, histogram['Max']) for step, histogram in stats['Recoveries'].items())
+    print('%-14s recovered by %s, %d of %d jobs done after %.1f s, %d timeouts, %d soft resets, %d power key' % (
+        name, recoveries, done, len(futures), duration, stats['Counters']['Timeouts'],
+        stats['Counters']['SoftResets'], stats['Counters']['Restarts']))
+    gsm.close()
+    modem.close()
+
+if __name__ == '__main__':
+    bench('lost answer', 1)
+    bench('needs reset', 1 + GSMHat.cRecoveryProbes)
+    bench('needs power', 2 + 2 * GSMHat.cRecoveryProbes)     # AT+CFUN=1,1 gets lost as well
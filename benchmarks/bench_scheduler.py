@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+# Filename: bench_scheduler.py
+# A burst of SMS against the modem simulator (AT+CMGS takes 100 ms): the old fixed order of
+# the idle state against the default schedule. Gaps between GPS polls, inbox and URL latency.
+import os
+import tempfile
+import time
+from gsmHat.gsmHat import GSMHat
+from gsmHat.simulator import ModemSimulator
+
+# The order of the idle state before the scheduler, without deadlines
+FixedChain = ('SMS', 'Call', 'Inbox', 'URL', 'HTTP response', 'GPS setup', 'GPS', 'Inbox poll', 'GPRS status', 'Sockets')
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else float('nan')
+
+def bench(name, fixedChain, count=200):
+    modem = ModemSimulator(Latency=0.002)
+    modem.Latencies['AT+CMGS'] = 0.1
+    GSMHat.cGPRSstatusWaittime = 100
+    gsm = GSMHat(modem.Port, 115200, os.path.join(tempfile.gettempdir(), 'bench_scheduler.log'),
+                 os.path.join(tempfile.gettempdir(), 'bench_scheduler_trace.log'))
+    if fixedChain:
+        for priority, jobClass in enumerate(FixedChain):
+            gsm.SetSchedule(jobClass, Priority=priority, Weight=1.0, Deadline=None)
+    time.sleep(0.5)
+    gsm.SetGPRSconnection('internet', 'user', 'password')
+    gsm.CallUrl('example.com/warmup').result(30)
+
+    begin = time.perf_counter()
+    futures = [gsm.SMS_write('+491601234567', 'Message %d' % i) for i in range(count)]
+    inbox = []
+    urls = []
+    while not all(future.done() for future in futures):
+        # Every 2 s a message comes in and the application calls an URL
+        received = time.perf_counter()
+        modem.ReceiveSMS('+491607654321', 'Incoming')
+        url = gsm.CallUrl('example.com/report')
+        while gsm.SMS_read(Timeout=0.005) == None and time.perf_counter() - received < 60:
+            pass
+        inbox.append(time.perf_counter() - received)
+        url.result(120)
+        urls.append(time.perf_counter() - received)
+        time.sleep(max(0.0, 2.0 - (time.perf_counter() - received)))
+    duration = time.perf_counter() - begin
+
+    polls = [t for t, command in modem.Commands if command.startswith('AT+CGNSINF') and begin < t < begin + duration]
+    gaps = [b - a for a, b in zip([begin] + polls, polls + [begin + duration])]
+    print('%-12s %d SMS in %.1f s, GPS poll gap max %.2f s, inbox p50 %.2f s max %.2f s, URL p50 %.2f s max %.2f s' % (
+        name, count, duration, max(gaps), percentile(inbox, 0.5), max(inbox), percentile(urls, 0.5), max(urls)))
+    gsm.close()
+    modem.close()
+
+if __name__ == '__main__':
+    bench('fixed order', True)
+    bench('scheduler', False)
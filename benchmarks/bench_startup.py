@@ -0,0 +1,39 @@
+#!/usr/bin/python3
+# Filename: bench_startup.py
+# Restart of the application with a module, that is configured from the last run (text mode,
+# GPS power, bearer): cold start (every step of the init) against the warm start.
+# Time from GSMHat() until the first SMS and the first URL call are done, commands sent until then.
+import os
+import tempfile
+import time
+from gsmHat.gsmHat import GSMHat
+from gsmHat.simulator import ModemSimulator
+
+def start(modem, warmStart):
+    GSMHat.cWarmStart = warmStart
+    commands = len(modem.Commands)
+    begin = time.perf_counter()
+    gsm = GSMHat(modem.Port, 115200, None, os.path.join(tempfile.gettempdir(), 'bench_startup_trace.log'))
+    gsm.SetGPRSconnection('internet', 'user', 'password')
+    sms = gsm.SMS_write('+491601234567', 'Back again')
+    url = gsm.CallUrl('example.com/started')
+    sms.result(30)
+    smsDone = time.perf_counter() - begin
+    url.result(30)
+    urlDone = time.perf_counter() - begin
+    sent = [command for t, command in modem.Commands[commands:]]
+    # A service is stopped when it is idle, not in the middle of a command
+    time.sleep(0.5)
+    gsm.close()
+    return smsDone, urlDone, sent
+
+if __name__ == '__main__':
+    # AT+SAPBR=1,1 needs some seconds with a real network
+    modem = ModemSimulator(Latency=0.02)
+    start(modem, False)
+    for name, warmStart in (('cold start', False), ('warm start', True)):
+        smsDone, urlDone, sent = start(modem, warmStart)
+        init = [command for command in sent if not command.startswith(('AT+CMGS', 'AT+HTTP'))]
+        print('%-10s first SMS after %4.0f ms, first URL call after %4.0f ms, %2d init commands: %s' % (
+            name, smsDone * 1000.0, urlDone * 1000.0, len(init), ' '.join(init)))
+    modem.close()
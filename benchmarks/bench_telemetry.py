@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+# Filename: bench_telemetry.py
+# Position reports through the modem simulator: one URL call per fix (README step 9)
+# against TelemetryUploader batches. Bytes sent to the modem, AT commands and modem time per fix.
+import math
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from gsmHat.gsmHat import GSMHat, GPS
+from gsmHat.simulator import ModemSimulator
+from gsmHat.telemetry import TelemetryUploader, DecodeBatch
+
+def drive(count, seed=1):
+    # 1 Hz fixes of a car with GPS noise
+    rng = random.Random(seed)
+    start = datetime(2020, 10, 21, 12, 0, 0)
+    latitude, longitude, course, speed = 52.266949, 10.524822, 45.0, 50.0
+    fixes = []
+    for i in range(count):
+        course = (course + rng.gauss(0, 3)) % 360
+        speed = min(max(speed + rng.gauss(0, 2), 0.0), 130.0)
+        meters = speed / 3.6
+        latitude += meters * math.cos(math.radians(course)) / 111195.0
+        longitude += meters * math.sin(math.radians(course)) / (111195.0 * math.cos(math.radians(latitude)))
+        fix = GPS()
+        fix.UTC = start + timedelta(seconds=i)
+        fix.Latitude = round(latitude + rng.gauss(0, 0.00002), 6)
+        fix.Longitude = round(longitude + rng.gauss(0, 0.00002), 6)
+        fix.Altitude = round(75.0 + rng.gauss(0, 1.5), 1)
+        fix.Speed = round(speed, 2)
+        fix.Course = round(course, 1)
+        fixes.append(fix)
+    return fixes
+
+def reportUrl(fix):
+    url = 'www.someserver.de/myscript.php'
+    url += '?time=' + str(int((fix.UTC - datetime(1970, 1, 1)).total_seconds()))
+    url += '&lat=' + str(fix.Latitude)
+    url += '&lon=' + str(fix.Longitude)
+    url += '&alt=' + str(fix.Altitude)
+    return url
+
+def start(httpLatency):
+    modem = ModemSimulator(HttpLatency=httpLatency)
+    modem.DefaultHttpResponse = (200, 'OK 1')
+    GSMHat.cGPRSstatusWaittime = 100
+    gsm = GSMHat(modem.Port, 115200, os.path.join(tempfile.gettempdir(), 'bench_telemetry.log'),
+                 os.path.join(tempfile.gettempdir(), 'bench_telemetry_trace.log'))
+    time.sleep(0.5)
+    gsm.SetGPRSconnection('internet', 'user', 'password')
+    gsm.CallUrl('example.com/warmup').result(30)
+    return modem, gsm
+
+def result(name, modem, gsm, commands, bytesOut, wall, count, payload):
+    stats = gsm.GetStats()
+    httpCommands = len([command for t, command in modem.Commands[commands:] if command.startswith('AT+HTTP')])
+    print('%-10s %8.1f payload bytes/fix %8.1f bytes to the modem/fix %6.2f HTTP commands/fix %8.2f ms modem time/fix' % (
+        name, payload / float(count), (stats['Counters']['BytesOut'] - bytesOut) / float(count),
+        httpCommands / float(count), wall / count * 1000.0))
+
+def benchPerFix(fixes, httpLatency):
+    modem, gsm = start(httpLatency)
+    commands = len(modem.Commands)
+    bytesOut = gsm.GetStats()['Counters']['BytesOut']
+    begin = time.perf_counter()
+    payload = 0
+    for fix in fixes:
+        url = reportUrl(fix)
+        payload += len(url)
+        gsm.CallUrl(url).result(30)
+    wall = time.perf_counter() - begin
+    result('per fix', modem, gsm, commands, bytesOut, wall, len(fixes), payload)
+    gsm.close()
+    modem.close()
+
+def benchBatched(fixes, httpLatency, maxFixes=60):
+    modem, gsm = start(httpLatency)
+    # Batches by count only, so every chunk of fixes below is one batch
+    uploader = TelemetryUploader(gsm, 'www.someserver.de/telemetry', MaxFixes=maxFixes, MaxDistance=float('inf'))
+    commands = len(modem.Commands)
+    bytesOut = gsm.GetStats()['Counters']['BytesOut']
+    wall = 0.0
+    for first in range(0, len(fixes), maxFixes):
+        # At 1 Hz a batch is uploaded long before the next one is complete, the time in between is not counted
+        begin = time.perf_counter()
+        for fix in fixes[first:first + maxFixes]:
+            uploader.Add(fix)
+        while uploader.Counters['Sent'] < min(first + maxFixes, len(fixes)) and time.perf_counter() - begin < 30:
+            time.sleep(0.001)
+        wall += time.perf_counter() - begin
+    uploader.Close()
+    result('batched', modem, gsm, commands, bytesOut, wall, len(fixes), uploader.Counters['PayloadBytes'])
+    decoded = sum(len(DecodeBatch(upload[2])) for upload in modem.Uploads)
+    print('           %d batches, %d of %d fixes decoded' % (uploader.Counters['Batches'], decoded, len(fixes)))
+    gsm.close()
+    modem.close()
+
+if __name__ == '__main__':
+    fixes = drive(3600)
+    # The modem time includes a simulated server round trip of 50 ms
+    benchPerFix(fixes[:300], 0.05)
+    benchBatched(fixes, 0.05)
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+# Filename: bench_timeouts.py
+# Learned timeouts per AT command against the modem simulator and the time until a command,
+# that the module does not answer anymore, is detected (before: 5 s). Commands that wait for the
+# network (AT+CMGS, AT+SAPBR, ...) keep at least their default timeout. A long inbox list on a slow
+# line must not time out, after AT+CMGL learned its timeout from short lists.
+import os
+import tempfile
+import time
+from gsmHat.gsmHat import GSMHat
+from gsmHat.simulator import ModemSimulator
+
+def benchLongList(count=30):
+    modem = ModemSimulator(Latency=0.002)
+    GSMHat.cSMSwaittime = 100
+    gsm = GSMHat(modem.Port, 115200, None, None)
+    for i in range(4):
+        modem.ReceiveSMS('+491607654321', 'Short %d' % i)
+        gsm.SMS_read(Timeout=10)
+    time.sleep(1.0)     # until the read ones are deleted
+    timeout = gsm.GetStats()['CommandTimeouts']['AT+CMGL']
+
+    # 64 bytes every 10 ms, about 6 kB/s
+    modem.ChunkSize = 64
+    modem.ChunkDelay = 0.01
+    for i in range(count):
+        modem.ReceiveSMS('+491607654321', 'Message %d of a long inbox, read in one AT+CMGL' % i)
+    begin = time.perf_counter()
+    received = []
+    newSMS = gsm.SMS_read(Timeout=10)
+    while newSMS != None:
+        received.append(newSMS.Message)
+        newSMS = gsm.SMS_read(Timeout=3)
+    duration = time.perf_counter() - begin - 3
+    stats = gsm.GetStats()
+    gsm.close()
+    modem.close()
+    print('Long AT+CMGL (learned timeout %.2f s): %d messages in %.2f s, %d delivered, %d timeouts' % (
+        timeout, count, duration, len(received), stats['Counters']['Timeouts']))
+
+if __name__ == '__main__':
+    modem = ModemSimulator(Latency=0.01)
+    modem.Latencies['AT+CMGS'] = 1.0
+    GSMHat.cSMSwaittime = 200
+    gsm = GSMHat(modem.Port, 115200, os.path.join(tempfile.gettempdir(), 'bench_timeouts.log'),
+                 os.path.join(tempfile.gettempdir(), 'bench_timeouts_trace.log'))
+    for future in [gsm.SMS_write('+491601234567', 'Message %d' % i) for i in range(5)]:
+        future.result(60)
+    time.sleep(2.0)
+
+    stats = gsm.GetStats()
+    for verb, timeout in sorted(stats['CommandTimeouts'].items()):
+        if verb in stats['Commands']:
+            print('%-12s round trip mean %7.1f ms, max %7.1f ms, timeout %6.2f s' % (
+                verb, stats['Commands'][verb]['Mean'] * 1000.0, stats['Commands'][verb]['Max'] * 1000.0, timeout))
+
+    # The module hangs on the next inbox poll (AT+CPMS), it is sent again after a timeout
+    modem.Latencies['AT+CPMS'] = 60.0
+    begin = time.perf_counter()
+    while gsm.GetStats()['Counters']['Timeouts'] == 0 and time.perf_counter() - begin < 30:
+        time.sleep(0.001)
+    detected = time.perf_counter()
+    sent = [t for t, command in modem.Commands if command.startswith('AT+CPMS') and t < detected]
+    print('Hanging AT+CPMS detected after %.0f ms' % ((detected - sent[-1]) * 1000.0))
+    gsm.close()
+    modem.close()
+
+    benchLongList()
@@ -0,0 +1,38 @@
+#!/usr/bin/python3
+# Filename: bench_trace.py
+# Cost per line of the former DEBUG file logging against the wire trace (off and on)
+import logging
+import os
+import tempfile
+import time
+from gsmHat.trace import WireTrace, TraceOff, TraceResponses
+
+LINES = ['+CGNSINF: 1,1,20201021120000.000,52.266949,10.524822,75.300,0.00,0.0,1,,0.9,1.2,0.8,,11,8,,,42,,\r\n', 'OK\r\n']
+
+def perLine(function, count=100000):
+    start = time.perf_counter()
+    for i in range(count):
+        function(LINES[i & 1])
+    return (time.perf_counter() - start) / count * 1e6
+
+if __name__ == '__main__':
+    directory = tempfile.mkdtemp()
+    logger = logging.getLogger('bench')
+    logger.setLevel(logging.DEBUG)
+    handler = logging.FileHandler(os.path.join(directory, 'debug.log'))
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logger.addHandler(handler)
+    logger.propagate = False
+    print('DEBUG file logging: %6.2f us per line' % perLine(lambda line: logger.debug('Received Data: %s' % line)))
+    handler.close()
+
+    trace = WireTrace(1000, os.path.join(directory, 'trace.log'))
+    def record(line):
+        if trace.Enabled:
+            trace.Record('GPS', TraceResponses, '<', line)
+    print('Trace off:          %6.2f us per line' % perLine(record))
+    trace.SetLevel(None, TraceResponses)
+    print('Trace on:           %6.2f us per line' % perLine(record))
+    start = time.perf_counter()
+    count = trace.Dump()
+    print('Dump:               %6.2f ms for %d entries' % ((time.perf_counter() - start) * 1e3, count))
@@ -1 +1,5 @@
-from gsmHat.gsmHat import GSMHat, SMS, GPS
\ No newline at end of file
+from .gsmHat import GSMHat, SMS, GPS, UrlRequest, UrlResponse, Socket, CommandError, GPIOPowerKey
+from .track import GPSTrack
+from .asyncHat import AsyncGSMHat
+from .pool import GSMHatPool
+from .trace import TraceOff, TraceCommands, TraceResponses, TraceData
@@ -0,0 +1,479 @@
+#!/usr/bin/python3
+# Filename: asyncHat.py
+import asyncio
+import logging
+import os
+import serial
+from .gsmHat import (GPS, CommandError, ResponseDispatcher, ResponseBody, SerialLineReader, UrlRequest, UrlResponse,
+                     parseCGNSINF, parseSMSHeader)
+from .trace import WireTrace, commandCategory, responseCategories, TraceCommands, TraceResponses, TraceData
+
+class AsyncGSMHat:
+    """asyncio front end for the GSM Hat. The AT commands are sent from the event loop,
+    so many coroutines can share one modem without extra threads or polling."""
+
+    timeoutSerial = 5               # seconds
+    timeoutSMS = 60                 # seconds
+    timeoutHTTP = 120               # seconds until +HTTPACTION arrives
+    cSMSwaittime = 2500             # milliseconds
+    cGPSwaittime = 2000             # milliseconds
+    cTraceSize = 1000               # entries kept by the wire trace
+    cHTTPreadWindow = 8192          # bytes read with one AT+HTTPREAD
+    cResyncAttempts = 3             # AT commands sent after a timeout, until the hat answers one
+    cResyncQuiet = 0.2              # seconds waited for a second answer after the first one
+    cGPSqueueSize = 100             # positions kept per GPS_stream(), the oldest is dropped
+
+    def __init__(self, SerialPort, Baudrate, TracePath='gsmHatTrace.log'):
+        self.__port = SerialPort
+        self.__baudrate = Baudrate
+        self.__logger = logging.getLogger(__name__)
+        self.__trace = WireTrace(self.cTraceSize, TracePath)
+        self.__traceCategory = 'STATE'
+        self.__ser = None
+        self.__writeBuffer = bytearray()
+        self.__tasks = []
+
+        self.__readRAW = 0
+        self.__smsToBuild = None
+        self.__smsListed = 0            # entries of the last AT+CMGL, stored (sent/unsent) ones too
+        self.__smsReceived = 0          # received ones of them
+        self.__smsKept = -1             # messages left in the storage after the last AT+CMGL, -1 = unknown
+        self.__response = None
+        self.__responseCommand = ''
+        self.__responseLines = []
+        self.__httpAction = None
+        self.__httpBody = None
+        self.__httpBodyError = None
+        self.__httpBytesToRead = 0
+        self.__httpUpload = b''
+        self.__hangUpHandle = None
+
+        self.__GPSactualData = GPS()
+        self.__GPSsubscribers = []
+        self.__GPRSuserAPN = None
+        self.__GPRSuserUSER = None
+        self.__GPRSuserPWD = None
+
+        self.__dispatcher = ResponseDispatcher()
+        self.__dispatcher.Register('OK', self.__onOK)
+        self.__dispatcher.Register('ERROR', self.__onError)
+        self.__dispatcher.Register('+CME ERROR', self.__onCMEError)
+        self.__dispatcher.Register('+CMS ERROR', self.__onCMSError)
+        self.__dispatcher.Register('+CMGL', self.__onCMGL)
+        self.__dispatcher.Register('+CMTI', self.__onCMTI)
+        self.__dispatcher.Register('+HTTPACTION', self.__onHTTPACTION)
+        self.__dispatcher.Register('+HTTPREAD', self.__onHTTPREAD)
+        self.__dispatcher.Register('DOWNLOAD', self.__onDOWNLOAD)
+
+    async def open(self):
+        self.__loop = asyncio.get_event_loop()
+        self.__commandLock = asyncio.Lock()
+        self.__httpLock = asyncio.Lock()
+        self.__newSMS = asyncio.Event()
+        self.__smsQueue = asyncio.Queue()
+
+        self.__ser = serial.Serial(self.__port, self.__baudrate, timeout=0)
+        self.__ser.flushInput()
+        self.__serReader = SerialLineReader(self.__ser)
+        self.__loop.add_reader(self.__ser.fileno(), self.__onReadable)
+        self.__logger.info('Serial connection to %s established', self.__port)
+
+        await self.__command('AT+CMGF=1')
+        await self.__command('AT+CGNSPWR=1')
+        await self.__command('AT+CGNSTST=0')
+
+        self.__tasks.append(self.__loop.create_task(self.__inboxWorker()))
+        self.__tasks.append(self.__loop.create_task(self.__GPSworker()))
+        return self
+
+    async def close(self):
+        for task in self.__tasks:
+            task.cancel()
+        for task in self.__tasks:
+            # wait_for() before Python 3.12 loses the cancellation, if its future completes at the same time
+            while not task.done():
+                await asyncio.wait([task], timeout=0.1)
+                task.cancel()
+        self.__tasks = []
+
+        if self.__hangUpHandle != None:
+            self.__hangUpHandle.cancel()
+        if self.__ser != None:
+            self.__loop.remove_reader(self.__ser.fileno())
+            self.__loop.remove_writer(self.__ser.fileno())
+            self.__writeBuffer = bytearray()
+            self.__ser.close()
+            self.__ser = None
+            self.__logger.info('Serial connection to %s closed', self.__port)
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def SetTraceLevel(self, Category, Level):
+        # Same as GSMHat.SetTraceLevel()
+        self.__trace.SetLevel(Category, Level)
+
+    def DumpTrace(self, Path=None):
+        # Appends the wire trace to the trace file (or Path), returns the number of entries
+        return self.__trace.Dump('request', Path)
+
+    def __dumpTrace(self, reason):
+        if self.__trace.Enabled:
+            try:
+                self.__trace.Dump(reason)
+            except OSError:
+                self.__logger.exception('Could not write the wire trace')
+
+    def RegisterHandler(self, Prefix, Handler):
+        """Handler(Values) is called on the event loop for every line starting with Prefix"""
+        self.__dispatcher.Register(Prefix, Handler)
+
+    def UnregisterHandler(self, Prefix, Handler):
+        self.__dispatcher.Unregister(Prefix, Handler)
+
+    def SetGPRSconnection(self, APN, Username, Password):
+        self.__GPRSuserAPN = APN
+        self.__GPRSuserUSER = Username
+        self.__GPRSuserPWD = Password
+
+    def GetActualGPS(self):
+        return self.__GPSactualData
+
+    async def SMS_write(self, NumberReceiver, Message):
+        # Returns the message reference of the sent SMS
+        lines = await self.__command('AT+CMGS="' + NumberReceiver + '"\n' + Message + '\x1A', '+CMGS', self.timeoutSMS)
+        self.__logger.info('Message to %s successfully sent', NumberReceiver)
+        return int(lines[0]) if lines else None
+
+    async def SMS_read(self):
+        return await self.__smsQueue.get()
+
+    async def SMS_stream(self):
+        # async for newSMS in hat.SMS_stream(): ...
+        while True:
+            yield await self.__smsQueue.get()
+
+    async def GPS_stream(self):
+        # async for newGPS in hat.GPS_stream(): ... yields every good position,
+        # a slow consumer misses the oldest ones
+        queue = asyncio.Queue(self.cGPSqueueSize)
+        self.__GPSsubscribers.append(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.__GPSsubscribers.remove(queue)
+
+    async def Call(self, Number, Timeout=15):
+        # Hangs up automatically after Timeout seconds
+        await self.__command('ATD' + str(Number) + ';')
+        if self.__hangUpHandle != None:
+            self.__hangUpHandle.cancel()
+        self.__hangUpHandle = self.__loop.call_later(Timeout, lambda: self.__loop.create_task(self.HangUp()))
+
+    async def HangUp(self):
+        if self.__hangUpHandle != None:
+            self.__hangUpHandle.cancel()
+            self.__hangUpHandle = None
+        await self.__command('AT+CHUP')
+
+    async def CallUrl(self, url, Method='GET', Data=None, ContentType=None, Sink=None):
+        # Returns an UrlResponse object, the arguments are the same as for GSMHat.CallUrl()
+        request = UrlRequest(url, Method, Data, ContentType, Sink)
+        async with self.__httpLock:
+            await self.__connectGPRS()
+            try:
+                await self.__command('AT+HTTPINIT')
+            except CommandError:
+                # HTTP service is still running from an earlier request
+                await self.__command('AT+HTTPTERM')
+                await self.__command('AT+HTTPINIT')
+
+            try:
+                await self.__command('AT+HTTPPARA="CID",1')
+                await self.__command('AT+HTTPPARA="URL","' + url + '"')
+                if request.ContentType != None:
+                    await self.__command('AT+HTTPPARA="CONTENT","' + request.ContentType + '"')
+                if request.Data != None:
+                    # The body is sent by __onDOWNLOAD()
+                    self.__httpUpload = request.Data
+                    seconds = self.__transferSeconds(len(request.Data)) + self.timeoutSerial
+                    await self.__command('AT+HTTPDATA=%d,%d' % (len(request.Data), min(120000, seconds * 1000)),
+                                         Timeout=seconds)
+                self.__httpAction = self.__loop.create_future()
+                await self.__command('AT+HTTPACTION=%d' % UrlRequest.Methods[Method])
+                method, httpStatus, length = await asyncio.wait_for(self.__httpAction, self.timeoutHTTP)
+
+                response = UrlResponse()
+                response.Url = url
+                response.Status = httpStatus
+                response.Length = length
+                if Sink == None:
+                    response.Content = bytearray()
+                if httpStatus == 200 and length > 0 and Method != 'HEAD':
+                    await self.__readBody(ResponseBody(length, Sink), response)
+                return response
+            finally:
+                self.__httpAction = None
+                self.__httpBody = None
+                self.__httpUpload = b''
+                await self.__command('AT+HTTPTERM')
+
+    async def __readBody(self, body, response):
+        # Reads the response window by window, other commands may run in between
+        self.__httpBody = body
+        self.__httpBodyError = None
+        while body.Remaining() > 0:
+            offset = body.Offset
+            size = min(self.cHTTPreadWindow, body.Remaining())
+            await self.__command('AT+HTTPREAD=%d,%d' % (offset, size),
+                                 Timeout=self.timeoutSerial + self.__transferSeconds(size))
+            if self.__httpBodyError != None:
+                raise self.__httpBodyError
+            if body.Offset == offset:
+                # The server sent less than announced
+                break
+        body.Finish()
+        response.Content = body.Content
+
+    def __transferSeconds(self, length):
+        # Time the serial line needs for length bytes (10 bits per byte), at least one second
+        return length * 10 // self.__baudrate + 1
+
+    async def __connectGPRS(self):
+        lines = await self.__command('AT+SAPBR=2,1', '+SAPBR')
+        if lines and lines[0].split(',')[2].replace('"', '') != '0.0.0.0':
+            return
+
+        if self.__GPRSuserAPN == None or self.__GPRSuserUSER == None or self.__GPRSuserPWD == None:
+            raise CommandError('AT+SAPBR=2,1', 'No GPRS connection')
+
+        await self.__command('AT+SAPBR=3,1,"Contype","GPRS"')
+        await self.__command('AT+SAPBR=3,1,"APN","' + self.__GPRSuserAPN + '"')
+        await self.__command('AT+SAPBR=3,1,"USER","' + self.__GPRSuserUSER + '"')
+        await self.__command('AT+SAPBR=3,1,"PWD","' + self.__GPRSuserPWD + '"')
+        await self.__command('AT+SAPBR=1,1', Timeout=85)
+
+    async def __command(self, command, Prefix=None, Timeout=None):
+        # Sends the command and waits for OK. Returns the values of all lines starting with Prefix
+        if Timeout == None:
+            Timeout = self.timeoutSerial
+
+        async with self.__commandLock:
+            self.__response = self.__loop.create_future()
+            self.__responseCommand = command.split('\n')[0]
+            self.__responseLines = []
+            self.__write((command + '\n').encode('iso-8859-1'))
+            if self.__trace.Enabled:
+                self.__traceCategory = commandCategory(command)
+                self.__trace.Record(self.__traceCategory, TraceCommands, '>', command)
+            try:
+                lines = await asyncio.wait_for(self.__response, Timeout)
+            except asyncio.TimeoutError:
+                self.__dumpTrace('Timeout after %s' % self.__responseCommand)
+                await self.__resync()
+                raise
+            finally:
+                self.__response = None
+                self.__readRAW = 0
+                self.__httpBytesToRead = 0
+
+        if Prefix == None:
+            return lines
+        return [line[len(Prefix) + 1:].strip() for line in lines if ResponseDispatcher.GetPrefix(line) == Prefix]
+
+    async def __resync(self):
+        # The answer of the command that timed out may still come and must not complete the next
+        # command. The hat answers one command after the other: AT is sent and the answers are
+        # consumed up to its OK, that is the first one, or a second one shortly after it.
+        self.__readRAW = 0
+        self.__httpBytesToRead = 0
+        for attempt in range(self.cResyncAttempts):
+            self.__response = self.__loop.create_future()
+            self.__responseCommand = 'AT'
+            self.__responseLines = []
+            self.__write(b'AT\n')
+            if self.__trace.Enabled:
+                self.__trace.Record(self.__traceCategory, TraceCommands, '>', 'AT')
+            try:
+                await asyncio.wait_for(self.__response, self.timeoutSerial)
+            except asyncio.TimeoutError:
+                continue
+            except CommandError:
+                pass
+            self.__response = self.__loop.create_future()
+            try:
+                await asyncio.wait_for(self.__response, self.cResyncQuiet)
+            except (asyncio.TimeoutError, CommandError):
+                pass
+            return
+        self.__logger.error('No answer from the hat after %d attempts', self.cResyncAttempts)
+
+    def __write(self, data):
+        # The port is non-blocking: what the UART does not take now is written when it is writable,
+        # the event loop never waits for the serial line
+        self.__writeBuffer += data
+        if len(self.__writeBuffer) == len(data):
+            self.__onWritable()
+
+    def __onWritable(self):
+        try:
+            written = os.write(self.__ser.fileno(), self.__writeBuffer)
+        except BlockingIOError:
+            written = 0
+        del self.__writeBuffer[:written]
+        if self.__writeBuffer:
+            self.__loop.add_writer(self.__ser.fileno(), self.__onWritable)
+        else:
+            self.__loop.remove_writer(self.__ser.fileno())
+
+    def __finishCommand(self, exception=None):
+        if self.__response != None and not self.__response.done():
+            if exception != None:
+                self.__dumpTrace(str(exception))
+                self.__response.set_exception(exception)
+            else:
+                self.__response.set_result(self.__responseLines)
+
+    def __isReadingRaw(self):
+        return self.__readRAW > 0
+
+    def __getBytesToRead(self):
+        return self.__httpBytesToRead
+
+    def __onReadable(self):
+        for line in self.__serReader.ReadLines(self.__isReadingRaw, self.__getBytesToRead):
+            if type(line) is bytes:
+                self.__processBytes(line)
+            elif self.__readRAW > 0:
+                if self.__trace.Enabled:
+                    self.__trace.Record(self.__traceCategory, TraceData, '<', line)
+                self.__processRaw(line)
+            elif line != '':
+                if self.__trace.Enabled:
+                    category = responseCategories.get(ResponseDispatcher.GetPrefix(line), self.__traceCategory)
+                    self.__trace.Record(category, TraceResponses, '<', line)
+                if not self.__dispatcher.Dispatch(line):
+                    self.__responseLines.append(line)
+
+    def __processRaw(self, line):
+        if self.__readRAW == 1:
+            # SMS list, every entry starts with its own +CMGL header
+            if line == 'OK\r\n':
+                self.__finishListEntry()
+                self.__readRAW = 0
+                self.__finishCommand()
+            elif line.startswith('+CMGL: '):
+                self.__finishListEntry()
+                self.__startListEntry(line[7:].rstrip('\r\n'))
+            elif self.__smsToBuild != None:
+                self.__smsToBuild.Message = self.__smsToBuild.Message + line
+
+    def __processBytes(self, data):
+        # HTTP content announced by +HTTPREAD
+        self.__httpBytesToRead -= len(data)
+        if self.__trace.Enabled:
+            self.__trace.Record(self.__traceCategory, TraceData, '<', '%d bytes', len(data))
+        if self.__httpBody != None and self.__httpBodyError == None:
+            try:
+                self.__httpBody.Write(data)
+            except Exception as e:
+                # Raised by CallUrl() after the window was read
+                self.__httpBodyError = e
+
+    def __onOK(self, values):
+        self.__finishCommand()
+
+    def __onError(self, values):
+        self.__finishCommand(CommandError(self.__responseCommand))
+
+    def __onCMEError(self, values):
+        self.__finishCommand(CommandError(self.__responseCommand, '+CME ERROR', ResponseDispatcher.GetErrorCode(values)))
+
+    def __onCMSError(self, values):
+        self.__finishCommand(CommandError(self.__responseCommand, '+CMS ERROR', ResponseDispatcher.GetErrorCode(values)))
+
+    def __onCMGL(self, values):
+        self.__readRAW = 1
+        self.__startListEntry(values)
+
+    def __startListEntry(self, values):
+        # Stored (sent/unsent) messages are skipped
+        self.__smsListed += 1
+        if ',"REC ' in values:
+            self.__smsToBuild = parseSMSHeader(values)
+        else:
+            self.__smsToBuild = None
+
+    def __finishListEntry(self):
+        if self.__smsToBuild != None:
+            self.__smsToBuild.Message = self.__smsToBuild.Message.rstrip('\r\n')
+            self.__logger.info('New Message from %s was received', self.__smsToBuild.Sender)
+            self.__smsQueue.put_nowait(self.__smsToBuild)
+            self.__smsReceived += 1
+            self.__smsToBuild = None
+
+    def __onCMTI(self, values):
+        self.__logger.info('Received new SMS')
+        self.__newSMS.set()
+
+    def __onHTTPACTION(self, values):
+        # Return value looks like: +HTTPACTION: 0,200,0
+        rawData = values.split(',')
+        if self.__httpAction != None and not self.__httpAction.done():
+            if len(rawData) == 3:
+                self.__httpAction.set_result((int(rawData[0]), int(rawData[1]), int(rawData[2])))
+            else:
+                self.__httpAction.set_exception(CommandError('AT+HTTPACTION', 'Unexpected +HTTPACTION: ' + values))
+
+    def __onHTTPREAD(self, values):
+        self.__httpBytesToRead = int(values)
+
+    def __onDOWNLOAD(self, values):
+        # AT+HTTPDATA waits for the request body
+        self.__write(self.__httpUpload)
+        if self.__trace.Enabled:
+            self.__trace.Record(self.__traceCategory, TraceData, '>', '%d bytes', len(self.__httpUpload))
+
+    async def __inboxWorker(self):
+        # Reads all new SMS at once, when the hat announces one (+CMTI) or the number of messages
+        # changed. Stored (sent/unsent) messages stay in the storage, they are not listed again and again.
+        while True:
+            try:
+                await asyncio.wait_for(self.__newSMS.wait(), self.cSMSwaittime / 1000.0)
+                announced = True
+            except asyncio.TimeoutError:
+                announced = False
+            self.__newSMS.clear()
+
+            try:
+                lines = await self.__command('AT+CPMS="SM"', '+CPMS')
+                count = int(lines[0].split(',')[0]) if lines else 0
+                if count > 0 and (announced or count != self.__smsKept):
+                    self.__smsListed = 0
+                    self.__smsReceived = 0
+                    await self.__command('AT+CMGL="ALL"')
+                    # The received ones are deleted, the stored ones stay
+                    self.__smsKept = self.__smsListed - self.__smsReceived
+                    if self.__smsReceived > 0:
+                        await self.__command('AT+CMGD=1,1')
+            except (CommandError, asyncio.TimeoutError) as e:
+                self.__logger.info('Reading SMS failed: %s', e)
+
+    async def __GPSworker(self):
+        while True:
+            try:
+                lines = await self.__command('AT+CGNSINF', '+CGNSINF')
+                newGPS = parseCGNSINF(lines[0]) if lines else None
+                if newGPS != None:
+                    self.__GPSactualData = newGPS
+                    for queue in self.__GPSsubscribers:
+                        if queue.full():
+                            queue.get_nowait()
+                        queue.put_nowait(newGPS)
+            except (CommandError, asyncio.TimeoutError) as e:
+                self.__logger.info('Reading GPS failed: %s', e)
+            await asyncio.sleep(self.cGPSwaittime / 1000.0)
@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+# Filename: geofence.py
+import math
+import threading
+from .gsmHat import GPS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MetersPerDegree = GPS.EarthRadius * math.pi / 180.0
+
+def CalculateDistances(Latitude, Longitude, Latitudes, Longitudes):
+    """Distances in meters from one point to many points (same formula as GPS.CalculateDeltaP).
+    Uses numpy, if it is installed, and returns a list otherwise."""
+    if numpy is not None:
+        return CalculateDistancesPairwise(numpy.full(len(Latitudes), Latitude), numpy.full(len(Longitudes), Longitude),
+                                          Latitudes, Longitudes)
+
+    phi1 = math.radians(Latitude)
+    cosPhi1 = math.cos(phi1)
+    distances = []
+    for latitude, longitude in zip(Latitudes, Longitudes):
+        phi2 = math.radians(latitude)
+        a = math.sin((phi2 - phi1) / 2) ** 2 + cosPhi1 * math.cos(phi2) * math.sin(math.radians(longitude - Longitude) / 2) ** 2
+        distances.append(2 * GPS.EarthRadius * math.atan2(math.sqrt(a), math.sqrt(1 - a)))
+    return distances
+
+def CalculateDistancesPairwise(Latitudes1, Longitudes1, Latitudes2, Longitudes2):
+    # Distances in meters between Latitudes1[i]/Longitudes1[i] and Latitudes2[i]/Longitudes2[i]
+    if numpy is None:
+        return [GPS.EarthRadius * _centralAngle(lat1, lon1, lat2, lon2)
+                for lat1, lon1, lat2, lon2 in zip(Latitudes1, Longitudes1, Latitudes2, Longitudes2)]
+
+    phi1 = numpy.radians(numpy.asarray(Latitudes1, dtype=numpy.float64))
+    phi2 = numpy.radians(numpy.asarray(Latitudes2, dtype=numpy.float64))
+    deltaLambda = numpy.radians(numpy.asarray(Longitudes2, dtype=numpy.float64) - numpy.asarray(Longitudes1, dtype=numpy.float64))
+    a = numpy.sin((phi2 - phi1) / 2) ** 2 + numpy.cos(phi1) * numpy.cos(phi2) * numpy.sin(deltaLambda / 2) ** 2
+    return 2 * GPS.EarthRadius * numpy.arctan2(numpy.sqrt(a), numpy.sqrt(1 - a))
+
+def TrackLength(Latitudes, Longitudes):
+    # Length of a track in meters, e.g. with the columns of GPSTrack.Export()
+    if len(Latitudes) < 2:
+        return 0.0
+    distances = CalculateDistancesPairwise(Latitudes[:-1], Longitudes[:-1], Latitudes[1:], Longitudes[1:])
+    return float(sum(distances))
+
+def _centralAngle(lat1, lon1, lat2, lon2):
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+class Geofence:
+    def __init__(self, Name, Latitude, Longitude, Radius):
+        self.Name = Name
+        self.Latitude = Latitude
+        self.Longitude = Longitude
+        self.Radius = Radius        # meters
+
+class GeofenceRegistry:
+    """Circular geofences with a grid index. Update() only checks the fences of the grid cell
+    the position is in, so thousands of fences cost no more than a few distance calculations.
+    Use it with gsm.AddGPSListener(registry.Update)."""
+
+    cMaxCellsPerFence = 64          # bigger fences are checked on every update
+
+    def __init__(self, CellSize=0.05):
+        self.CellSize = CellSize    # degrees
+        self.__lonCells = int(math.ceil(360.0 / CellSize))
+        self.__fences = {}
+        self.__grid = {}
+        self.__largeFences = set()
+        self.__inside = set()
+        self.__listeners = []
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__fences)
+
+    def AddListener(self, Listener):
+        # Listener(Name, Entered, Position) is called for every enter (Entered = True) and exit event
+        self.__listeners.append(Listener)
+
+    def RemoveListener(self, Listener):
+        self.__listeners.remove(Listener)
+
+    def Add(self, Name, Latitude, Longitude, Radius):
+        fence = Geofence(Name, Latitude, Longitude, Radius)
+        with self.__lock:
+            if Name in self.__fences:
+                self.__remove(Name)
+            self.__fences[Name] = fence
+            cells = self.__cellsOf(fence)
+            if cells == None:
+                self.__largeFences.add(Name)
+            else:
+                for cell in cells:
+                    self.__grid.setdefault(cell, set()).add(Name)
+        return fence
+
+    def Remove(self, Name):
+        with self.__lock:
+            self.__remove(Name)
+
+    def __remove(self, name):
+        fence = self.__fences.pop(name, None)
+        if fence == None:
+            return
+        self.__largeFences.discard(name)
+        self.__inside.discard(name)
+        for cell in self.__cellsOf(fence) or ():
+            names = self.__grid.get(cell)
+            if names != None:
+                names.discard(name)
+                if not names:
+                    del self.__grid[cell]
+
+    def __cell(self, latitude, longitude):
+        return (int(math.floor(latitude / self.CellSize)), int(math.floor(longitude / self.CellSize)) % self.__lonCells)
+
+    def __cellsOf(self, fence):
+        # All grid cells touched by the bounding box of the fence, None if there are too many
+        deltaLat = fence.Radius / MetersPerDegree
+        cosLat = math.cos(math.radians(min(abs(fence.Latitude) + deltaLat, 89.9)))
+        deltaLon = min(fence.Radius / (MetersPerDegree * cosLat), 180.0)
+        latFrom, lonFrom = self.__cell(fence.Latitude - deltaLat, fence.Longitude - deltaLon)
+        latTo = int(math.floor((fence.Latitude + deltaLat) / self.CellSize))
+        lonCount = int(math.floor((fence.Longitude + deltaLon) / self.CellSize)) - int(math.floor((fence.Longitude - deltaLon) / self.CellSize)) + 1
+        if (latTo - latFrom + 1) * lonCount > self.cMaxCellsPerFence:
+            return None
+        return [(lat, (lonFrom + lon) % self.__lonCells) for lat in range(latFrom, latTo + 1) for lon in range(lonCount)]
+
+    def Inside(self):
+        # Names of all fences the last position was in
+        with self.__lock:
+            return set(self.__inside)
+
+    def Check(self, Latitude, Longitude):
+        # Names of all fences containing the point
+        with self.__lock:
+            return self.__check(Latitude, Longitude)
+
+    def __check(self, latitude, longitude):
+        candidates = list(self.__grid.get(self.__cell(latitude, longitude), ())) + list(self.__largeFences)
+        if not candidates:
+            return set()
+        fences = [self.__fences[name] for name in candidates]
+        if len(fences) < 16:
+            distances = [GPS.EarthRadius * _centralAngle(latitude, longitude, fence.Latitude, fence.Longitude) for fence in fences]
+        else:
+            distances = CalculateDistances(latitude, longitude, [fence.Latitude for fence in fences], [fence.Longitude for fence in fences])
+        return set(fence.Name for fence, distance in zip(fences, distances) if distance <= fence.Radius)
+
+    def Update(self, Position):
+        """Checks a new GPS position, calls the listeners and returns the events as list of (Name, Entered)"""
+        with self.__lock:
+            inside = self.__check(Position.Latitude, Position.Longitude)
+            events = [(name, True) for name in inside - self.__inside] + [(name, False) for name in self.__inside - inside]
+            self.__inside = inside
+
+        for name, entered in events:
+            for listener in self.__listeners:
+                listener(name, entered, Position)
+        return events
@@ -1,776 +1,2376 @@
-#!/usr/bin/python3
-# Filename: gsmHat.py
-import logging
-import serial
-import threading
-import time
-import math
-import re
-from datetime import datetime
-import RPi.GPIO as GPIO
-
-class SMS:
-    def __init__(self):
-        self.Message = ''
-        self.Sender = ''
-        self.Receiver = ''
-        self.Date = ''
-
-class GPS:
-    EarthRadius = 6371e3         # meters
-
-    @staticmethod
-    def CalculateDeltaP(Position1, Position2):
-        phi1 = Position1.Latitude * math.pi / 180.0
-        phi2 = Position2.Latitude * math.pi / 180.0
-        deltaPhi = (Position2.Latitude - Position1.Latitude) * math.pi / 180.0
-        deltaLambda = (Position2.Longitude - Position1.Longitude) * math.pi / 180.0
-
-        a = math.sin(deltaPhi / 2) * math.sin(deltaPhi / 2) + math.cos(phi1) * math.cos(phi2) * math.sin(deltaLambda / 2) * math.sin(deltaLambda / 2)
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-        d = GPS.EarthRadius * c    # in meters
-
-        return d
-
-    def __init__(self):
-        self.GNSS_status = 0
-        self.Fix_status = 0
-        self.UTC = ''           # yyyyMMddhhmmss.sss
-        self.Latitude = 0.0     # ±dd.dddddd            [-90.000000,90.000000]
-        self.Longitude = 0.0    # ±ddd.dddddd           [-180.000000,180.000000]
-        self.Altitude = 0.0     # in meters
-        self.Speed = 0.0        # km/h [0,999.99]
-        self.Course = 0.0       # degrees [0,360.00]
-        self.HDOP = 0.0         # [0,99.9]
-        self.PDOP = 0.0         # [0,99.9]
-        self.VDOP = 0.0         # [0,99.9]
-        self.GPS_satellites = 0 # [0,99]
-        self.GNSS_satellites = 0    # [0,99]
-        self.Signal = 0.0         # %      max = 55 dBHz
-
-class GSMHat:
-    """GSM Hat Backend with SMS Functionality (for now)"""
-    
-    regexGetSingleValue = r'([+][a-zA-Z\ ]+(:\ ))([\d]+)'
-    regexGetAllValues = r'([+][a-zA-Z:\s]+)([\w\",\s+-\/:.]+)'
-    timeoutSerial = 5
-    timeoutGPSActive = 1
-    timeoutGPSInactive = 2000
-    cSMSwaittime = 2500             # milliseconds
-    cGPRSstatusWaittime = 5000      # milliseconds
-
-    def __init__(self, SerialPort, Baudrate, Logpath='gmsHat.log'):
-        self.__baudrate = Baudrate
-        self.__port = SerialPort
-
-        self.__logger = logging.getLogger(__name__)
-        self.__logger.setLevel(logging.DEBUG)
-        self.__loggerFileHandle = logging.FileHandler(Logpath)
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        self.__loggerFileHandle.setFormatter(formatter)
-        self.__loggerFileHandle.setLevel(logging.DEBUG)
-        self.__logger.addHandler(self.__loggerFileHandle)
-
-        self.__connect()
-        self.__startWorking()
-    
-    def __connect(self):
-        self.__ser = serial.Serial(self.__port, self.__baudrate)
-        self.__ser.flushInput()
-        self.__serData = ''
-        self.__writeLock = False
-        self.__logger.info('Serial connection to '+self.__port+' established')
-
-    def __disconnect(self):
-        self.__ser.close()
-    
-    def __startWorking(self):
-        self.__working = True
-        self.__state = 1
-        self.__nextState = 0
-        self.__smsToRead = 0
-        self.__retryAfterTimeout = False
-        self.__retryAfterTimeoutCount = 0
-        self.__init = False
-        self.__lastCommandSentString = ''
-        self.__readRAW = 0
-        self.__smsToBuild = None
-        self.__smsList = []
-        self.__smsSendList = []
-        self.__SMSwaittime = 0
-        self.__numberToCall = ''
-        self.__sendHangUp = False
-        self.__startGPS = False
-        self.__GPRSwaittimeStatus = 0
-        self.__GPRSIPaddress = ''
-        self.__GPRSready = False
-        self.__GPRSuserAPN = None
-        self.__GPRSuserUSER = None
-        self.__GPRSuserPWD = None
-        self.__GPRScallUrlList = []
-        self.__GPRSdataReceived = []
-        self.__GPRSwaitForData = False
-        self.__GPSstarted = False
-        self.__GPSstartSending = False
-        self.__GPSstopSending = False
-        self.__GPScollectData = False
-        self.__GPSactualData = GPS()
-        self.__GPStimeout = self.timeoutGPSInactive
-        self.__GPSwaittime = 0
-        self.__workerThread = threading.Thread(target=self.__workerThread, daemon=True)
-        self.__workerThread.start()
-
-    def __stopWorking(self):
-        self.__working = False
-        self.__workerThread.join(10.0)  # Timeout = 10.0 Seconds
-
-    def __sendToHat(self, string):
-        if self.__writeLock == False:
-            self.__lastCommandSentString = string
-            string = string + '\n'
-            self.__ser.write(string.encode('iso-8859-1'))
-            self.__writeLock = True
-            self.__sentTimeout = int(round(time.time())) + self.timeoutSerial
-            self.__logger.debug('Sent to hat: %s' % string)
-            return True
-        else:
-            self.__logger.debug('Wait for Lock...   state: ' + str(self.__state) + ' senddata: ' + string)
-            time.sleep(1)
-            return False
-    
-    def __pressPowerKey(self):
-        GPIO.setmode(GPIO.BOARD)
-        GPIO.setup(7, GPIO.OUT)
-        while True:
-            GPIO.output(7, GPIO.LOW)
-            time.sleep(4)
-            GPIO.output(7, GPIO.HIGH)
-            break
-        GPIO.cleanup()
-        time.sleep(10)
-
-    def SMS_available(self):
-        return len(self.__smsList)
-        
-    def SMS_read(self):
-        if self.SMS_available() > 0:
-            retSMS = self.__smsList[0]
-            del self.__smsList[0]
-            return retSMS
-
-        return None
-
-    def SMS_write(self, NumberReceiver, Message):
-        newSMS = SMS()
-        newSMS.Receiver = NumberReceiver
-        newSMS.Message = Message
-        self.__smsSendList.append(newSMS)
-
-    def Call(self, Number, Timeout = 15):
-        if self.__numberToCall == '':
-            self.__numberToCall = str(Number)
-            self.__callTimeout = Timeout
-            return True
-
-        return False
-
-    def HangUp(self):
-        self.__sendHangUp = True
-
-    def GetActualGPS(self):
-        return self.__GPSactualData
-
-    def UrlResponse_available(self):
-        return len(self.__GPRSdataReceived)
-
-    def UrlResponse_read(self):
-        if self.UrlResponse_available() > 0:
-            retResponse = self.__GPRSdataReceived[0]
-            del self.__GPRSdataReceived[0]
-            return retResponse
-
-        return None
-
-    def CallUrl(self, url):
-        self.__GPRScallUrlList.append(url)
-        self.__logger.debug('Got new URL call')
-
-    def PendingUrlCalls(self):
-        return len(self.__GPRScallUrlList)
-
-    def SetGPRSconnection(self, APN, Username, Password):
-        self.__GPRSuserAPN = APN
-        self.__GPRSuserUSER = Username
-        self.__GPRSuserPWD = Password
-
-    def __startGPSUnit(self):
-        self.__startGPS = True
-    
-    def __startGPSsending(self):
-        self.__GPSstartSending = True
-
-    def __stopGPSsending(self):
-        self.__GPSstopSending = True
-    
-    def __collectGPSData(self):
-        self.__GPScollectData = True
-
-    def ColData(self):
-        self.__collectGPSData()
-
-    def close(self):
-        self.__disconnect()
-        self.__logger.info('Serial connection to '+self.__port+' closed')
-        self.__stopWorking()
-    
-    def __processData(self):
-        if self.__serData != '':
-            if self.__readRAW > 0:
-                self.__logger.debug('Received Raw Data: %s' % self.__serData)
-                if self.__readRAW == 1:
-                    # Handle SMS
-                    if self.__serData == 'OK\r\n':
-                        self.__smsToBuild.Message = self.__smsToBuild.Message.rstrip('\r\n')
-                        self.__smsList.append(self.__smsToBuild)
-                        self.__readRAW = 0
-                        self.__writeLock = False
-                    else:
-                        self.__smsToBuild.Message = self.__smsToBuild.Message + self.__serData
-                elif self.__readRAW == 2:
-                    # Handle HTTP Response
-                    if self.__serData == 'OK\r\n':
-                        self.__readRAW = 0
-                        self.__writeLock = False
-                        self.__GPRSdataToBuild = self.__GPRSdataToBuild.rstrip('\r\n')
-                        self.__GPRSdataReceived.append(self.__GPRSdataToBuild)
-                    else:
-                        self.__GPRSdataToBuild = self.__GPRSdataToBuild + self.__serData
-            else:
-                self.__logger.debug('Received Data: %s' % self.__serData)
-
-                if 'OK' in self.__serData:
-                    self.__writeLock = False
-                    self.__logger.debug('Lock Off')
-                if 'ERROR' in self.__serData:
-                    # ERROR Handling here
-                    if self.__state == 71:
-                        # Error after sending AT+HTTPINIT
-                        # Lets terminate request before starting new one
-                        self.__logger.info('Error after starting new HTTP Request.')
-                        self.__writeLock = False
-                        self.__state = 75
-                elif '+CME ERROR:' in self.__serData:
-                    self.__writeLock = False
-
-                    match = re.findall(self.regexGetSingleValue, self.__serData)
-                    self.__cmeErr = int(match[0][1])
-
-                    self.__logger.info('Got CME ERROR: %s' % match[0][1])
-                elif '+CMS ERROR:' in self.__serData:
-                    self.__writeLock = False
-
-                    match = re.findall(self.regexGetSingleValue, self.__serData)
-                    self.__cmsErr = int(match[0][1])
-
-                    self.__logger.info('Got CMS ERROR: %s' % match[0][1])
-                elif '+CPMS:' in self.__serData:
-                    match = re.findall(self.regexGetAllValues, self.__serData)
-                    rawData = match[0][1].split(',')
-                    self.__masSMSSpace = int(rawData[1])
-                    numSMS = int(rawData[0])
-                    if numSMS > 0:
-                        self.__smsToRead = 1
-                    
-                elif '+CMGR:' in self.__serData:
-                    # read SMS content
-                    match = re.findall(self.regexGetAllValues, self.__serData)
-                    rawData = match[0][1].split('","')
-                    self.__readRAW = 1
-                    self.__smsToBuild = SMS()
-                    #self.__smsToBuild.Sender = bytearray.fromhex(rawData[1]).decode()
-                    self.__smsToBuild.Sender = rawData[1]
-                    self.__smsToBuild.Date = rawData[3].replace('"', '')
-                    self.__smsToBuild.Date = datetime.strptime(rawData[3].replace('"', '')[:-3], '%y/%m/%d,%H:%M:%S')
-                    self.__smsToBuild.Message = ''
-
-                elif '+SAPBR:' in self.__serData:
-                    # check if IP is valid
-                    # Return value looks like: +SAPBR: 1,3,"0.0.0.0"
-                    match = re.findall(self.regexGetAllValues, self.__serData)
-                    rawData = match[0][1].split(',')
-                    self.__GPRSIPaddress = rawData[2].replace('"', '')
-
-                    if self.__GPRSIPaddress != '0.0.0.0':
-                        self.__GPRSready = True
-                    else:
-                        self.__GPRSready = False
-
-                elif '+HTTPREAD:' in self.__serData:
-                    # read HTTP content
-                    self.__GPRSdataToBuild = ''
-                    self.__readRAW = 2
-
-                elif '+HTTPACTION:' in self.__serData:
-                    # Return value looks like: +HTTPACTION: 0,200,0
-                    match = re.findall(self.regexGetAllValues, self.__serData)
-                    rawData = match[0][1].split(',')
-                    self.__GPRSgotHttpResponse = True
-                    if len(rawData) == 3:
-                        requestMethod = int(rawData[0])
-                        httpStatus = int(rawData[1])
-                        recvDataLength = int(rawData[2])
-                        if httpStatus == 200:  # Successful request
-                            self.__GPRSnewDataReceived = True
-                        elif httpStatus == 601:  # Successful request
-                            self.__logger.info('HTTPACTION Network Error ' + str(httpStatus))
-                        else:
-                            self.__logger.info('HTTPACTION Unhandled Error ' + str(httpStatus))
-
-                    else:
-                        self.__logger.info('HTTPACTION return value is not expected: ' + match[0][1])
-
-                # unannounced data reception below (e.g. new SMS oder phone call)
-                elif '+CMTI:' in self.__serData:
-                    self.__logger.info('Received new SMS')
-                    match = re.findall(self.regexGetAllValues, self.__serData)
-                    rawData = match[0][1].split(',')
-                    storage = rawData[0]
-                    numSMS = int(rawData[1])
-                    self.__logger.debug('New SMS in memory ' + storage + ' at position ' + str(numSMS))
-                    self.__smsToRead = numSMS
-                
-                # GPS Data coming here
-                elif '+CGNSINF:' in self.__serData:
-                    self.__logger.debug('New GPS Data:')
-                    match = re.findall(self.regexGetAllValues, self.__serData)
-                    rawData = match[0][1].split(',')
-                    if len(rawData) >= 21:                    
-                        newGPS = GPS()
-                        goodPosition = True
-
-                        try:
-                            newGPS.GNSS_status = int(rawData[0])
-                        except:
-                            self.__logger.debug('GNSS_status: Could not convert ' + rawData[0] + ' to int.')
-
-                        try:
-                            # Fix_status: GPS connection
-                            newGPS.Fix_status = int(rawData[1])
-                            if newGPS.Fix_status == 0:
-                                goodPosition = False
-                        except:
-                            self.__logger.debug('Fix_status: Could not convert ' + rawData[1] + ' to int.')
-
-                        try:
-                            newGPS.UTC = datetime.strptime(rawData[2][:-4], '%Y%m%d%H%M%S')
-                        except:
-                            self.__logger.debug('UTC: Could not convert ' + rawData[2][:-4] + ' to int.')
-
-                        try:
-                            newGPS.Latitude = float(rawData[3])
-                            if newGPS.Latitude == 0.0:
-                                goodPosition = False
-                        except:
-                            self.__logger.debug('Latitude: Could not convert ' + rawData[3] + ' to float.')
-
-                        try:
-                            newGPS.Longitude = float(rawData[4])
-                            if newGPS.Longitude == 0.0:
-                                goodPosition = False
-                        except:
-                            self.__logger.debug('Longitude: Could not convert ' + rawData[4] + ' to float.')
-
-                        try:
-                            newGPS.Altitude = float(rawData[5])
-                            if newGPS.Altitude == 0.0:
-                                goodPosition = False
-                        except:
-                            self.__logger.debug('Altitude: Could not convert ' + rawData[5] + ' to float.')
-
-                        try:
-                            newGPS.Speed = float(rawData[6])
-                        except:
-                            self.__logger.debug('Speed: Could not convert ' + rawData[6] + ' to float.')
-
-                        try:
-                            newGPS.Course = float(rawData[7])
-                        except:
-                            self.__logger.debug('Course: Could not convert ' + rawData[7] + ' to float.')
-
-                        try:
-                            newGPS.HDOP = float(rawData[10])
-                        except:
-                            self.__logger.debug('HDOP: Could not convert ' + rawData[10] + ' to float.')
-
-                        try:
-                            newGPS.PDOP = float(rawData[11])
-                            if newGPS.PDOP == 0.0:
-                                goodPosition = False
-                        except:
-                            self.__logger.debug('PDOP: Could not convert ' + rawData[11] + ' to float.')
-
-                        try:
-                            newGPS.VDOP = float(rawData[12])
-                        except:
-                            self.__logger.debug('VDOP: Could not convert ' + rawData[12] + ' to float.')
-
-                        try:
-                            newGPS.GPS_satellites = int(rawData[14])
-                        except:
-                            self.__logger.debug('GPS_satellites: Could not convert ' + rawData[14] + ' to int.')
-
-                        try:
-                            newGPS.GNSS_satellites = int(rawData[15])
-                        except:
-                            self.__logger.debug('GNSS_satellites: Could not convert ' + rawData[15] + ' to int.')
-
-                        try:
-                            newGPS.Signal = float(rawData[18])/55.0
-                        except:
-                            self.__logger.debug('Signal: Could not convert ' + rawData[18] + ' to float.')
-                        
-                        if goodPosition:
-                            self.__GPSactualData = newGPS
-
-
-            self.__serData = ''
-
-    def __restartProcedure(self):
-        self.__logger.error('Try to restart gsm module')
-        self.__pressPowerKey()
-        self.__state = 1
-        self.__writeLock = False
-        self.__retryAfterTimeout = False
-        self.__sentTimeout = 0
-
-    def __waitForUnlock(self):
-        actTime = int(round(time.time()))
-        if self.__sentTimeout > 0 and actTime > self.__sentTimeout:
-            # Timeout
-            self.__logger.error('Timeout during data reception')
-            self.__logger.info('Command sent: ' + self.__lastCommandSentString)
-            self.__logger.info('Actual state of programme: ' + str(self.__state))
-
-            if self.__state == 2 or self.__state == 97:
-                # It might be that the gsm module is not powered on
-                # So let's try to restart
-                self.__restartProcedure()
-                return False
-            elif  self.__state == 3:
-                # Tried to check for new SMS
-                # Retry 3 times
-                if self.__retryAfterTimeout:
-                    if self.__retryAfterTimeoutCount > 0:
-                        self.__retryAfterTimeoutCount -= 1
-                    else:
-                        self.__restartProcedure()
-                        return False
-                else:
-                    self.__retryAfterTimeout = True
-                    self.__retryAfterTimeoutCount = 3
-
-                self.__state = 2
-                self.__writeLock = False
-                self.__sentTimeout = 0
-                return False
-            else:
-                self.__logger.critical('Exception: Unhandled timeout during data reception')
-                raise 'Unhandled timeout during data reception'
-
-        if self.__writeLock:
-            return False
-        else:
-            self.__sentTimeout = 0
-            return True
-
-    def __workerThread(self):
-        self.__logger.info('Worker started')
-        self.__waitTime = 0
-
-        while self.__working:
-            # Check for incoming chars
-            while self.__ser.inWaiting() > 0:
-                newChar = self.__ser.read().decode('iso-8859-1')
-
-                if newChar == '\n':
-                    if self.__readRAW > 0:
-                        self.__serData += newChar
-                    self.__processData()
-                else:
-                    if newChar == '\r':
-                        if self.__readRAW > 0:
-                            self.__serData += newChar
-                    else:
-                        self.__serData += newChar
-
-            # Statemachine
-            actTime = int(round(time.time() * 1000))
-            if self.__state == 1:
-                if self.__sendToHat('AT+CMGF=1'):
-                    self.__startGPSUnit()
-                    self.__stopGPSsending()
-                    self.__state = 2
-            elif self.__state == 2:
-                if self.__waitForUnlock():
-                    if self.__sendToHat('AT+CPMS="SM"'):
-                        self.__state = 3
-            elif self.__state == 3:
-                if self.__waitForUnlock():
-                    self.__state = 97
-            elif self.__state == 20:
-                # Read SMS
-                if self.__sendToHat('AT+CMGR='+str(self.__smsToRead)):
-                    self.__state = 21
-            elif self.__state == 21:
-                if self.__waitForUnlock():
-                    if self.__smsToBuild == None:
-                        # An der Stelle self.__smsToRead gab es keine SMS zu lesen
-                        pass
-                    else:
-                        # Es gab eine neue SMS
-                        self.__logger.info('New Message from ' + self.__smsToBuild.Sender + ' was received')
-                        self.__smsToBuild = None                        
-
-                    # Lösche die behandelte SMS an der Stelle
-                    if self.__sendToHat('AT+CMGD='+str(self.__smsToRead)):
-                        self.__state = 22
-
-            elif self.__state == 22:
-                if self.__waitForUnlock():
-                    if(self.__smsToRead == 20):
-                        self.__smsToRead = 0
-                    else:
-                        self.__smsToRead = self.__smsToRead + 1
-
-                    self.__state = 97
-            
-            elif self.__state == 30:
-                # SMS versenden
-                retSMS = self.__smsSendList[0]
-                messageString = 'AT+CMGS="' + retSMS.Receiver + '"\n' + retSMS.Message + '\x1A'
-                self.timeoutSerial = 30
-                if self.__sendToHat(messageString):
-                    self.__state = 31
-
-            elif self.__state == 31:
-                if self.__waitForUnlock():
-                    retSMS = self.__smsSendList[0]
-                    self.__logger.info('Message to ' + retSMS.Receiver + ' successfully sent')
-                    del self.__smsSendList[0]
-                    self.timeoutSerial = 5
-
-                    self.__state = 97
-
-            elif self.__state == 40:
-                if self.__sendToHat('ATD' + self.__numberToCall + ';'):
-                    self.__state = 41
-
-            elif self.__state == 41:
-                if self.__waitForUnlock():
-                    self.__waitTime = actTime + self.__callTimeout * 1000
-                    self.__state = 42
-
-            elif self.__state == 42:
-                    # Wait x Seconds
-                if actTime > self.__waitTime or self.__sendHangUp == True:
-                    self.__numberToCall = ''
-                    self.__sendHangUp = True
-                    self.__state = 97
-            
-            elif self.__state == 43:
-                if self.__sendToHat('AT+CHUP'):
-                    self.__state = 44
-
-            elif self.__state == 44:
-                if self.__waitForUnlock():
-                    self.__sendHangUp = False
-                    self.__state = 97
-
-            elif self.__state == 50:
-                if self.__sendToHat('AT+CGNSPWR=1'):
-                    self.__state = 51
-
-            elif self.__state == 51:
-                if self.__waitForUnlock():
-                    self.__logger.debug('GPS powered on')
-                    self.__startGPS = False
-                    self.__state = 97
-                
-            elif self.__state == 52:
-                if self.__sendToHat('AT+CGNSTST=1'):
-                    self.__state = 55
-                    self.__logger.debug('GPS start sending')
-                    self.__GPSstartSending = False
-
-            elif self.__state == 53:
-                if self.__sendToHat('AT+CGNSTST=0'):
-                    self.__state = 55
-                    self.__GPSstopSending = False
-
-            elif self.__state == 54:
-                if self.__sendToHat('AT+CGNSINF'):
-                    self.__state = 55
-                    self.__GPScollectData = False
-
-            elif self.__state == 55:
-                if self.__waitForUnlock():
-                    self.__state = 97
-            
-            elif self.__state == 60:
-                if self.__sendToHat('AT+SAPBR=2,1'):
-                    self.__state = 61
-
-            elif self.__state == 61:
-                if self.__waitForUnlock():
-                    tempState = 97
-                    if self.__GPRSready == True:
-                        pass
-                    else:
-                        if self.__GPRSuserAPN != None and self.__GPRSuserUSER != None and self.__GPRSuserPWD != None:
-                            # try to connect
-                            tempState = 62
-
-                    self.__state = tempState
-
-            elif self.__state == 62:
-                if self.__sendToHat('AT+SAPBR=3,1,"Contype","GPRS"'):
-                    self.__state = self.__state + 1
-
-            elif self.__state == 63:
-                if self.__waitForUnlock():
-                    if self.__sendToHat('AT+SAPBR=3,1,"APN","' + self.__GPRSuserAPN + '"'):
-                        self.__state = self.__state + 1
-            
-            elif self.__state == 64:
-                if self.__waitForUnlock():
-                    if self.__sendToHat('AT+SAPBR=3,1,"USER","' + self.__GPRSuserUSER + '"'):
-                        self.__state = self.__state + 1
-            
-            elif self.__state == 65:
-                if self.__waitForUnlock():
-                    if self.__sendToHat('AT+SAPBR=3,1,"PWD","' + self.__GPRSuserPWD + '"'):
-                        self.__state = self.__state + 1
-            
-            elif self.__state == 66:
-                if self.__waitForUnlock():
-                    if self.__sendToHat('AT+SAPBR=1,1'):
-                        self.__state = self.__state + 1
-            
-            elif self.__state == 67:
-                if self.__waitForUnlock():
-                    self.__state = 97
-
-            elif self.__state == 70:
-                # Call the first URL in List
-                if self.__sendToHat('AT+HTTPINIT'):
-                    self.__state = self.__state + 1
-
-            elif self.__state == 71:
-                if self.__waitForUnlock():
-                    if self.__sendToHat('AT+HTTPPARA="CID",1'):
-                        self.__state = self.__state + 1
-
-            elif self.__state == 72:
-                if self.__waitForUnlock():
-                    getUrl = self.__GPRScallUrlList[0]
-                    if self.__sendToHat('AT+HTTPPARA="URL","' + getUrl + '"'):
-                        del self.__GPRScallUrlList[0]
-                        self.__GPRSwaitForData = True
-                        self.__GPRSnewDataReceived = False
-                        self.__GPRSgotHttpResponse = False
-                        self.__state = self.__state + 1
-            
-            elif self.__state == 73:
-                if self.__waitForUnlock():
-                    if self.__sendToHat('AT+HTTPACTION=0'):
-                        self.__state = 97
-                        #self.__state = self.__state + 1
-            
-            elif self.__state == 74:
-                if self.__waitForUnlock():
-                    if self.__sendToHat('AT+HTTPREAD'):
-                        self.__state = self.__state + 1
-            
-            elif self.__state == 75:
-                # Close HTTP Request
-                if self.__waitForUnlock():
-                    if self.__sendToHat('AT+HTTPTERM'):
-                        self.__state = 97
-                        self.__GPRSwaitForData = False
-                        self.__GPRSnewDataReceived = False
-
-            elif self.__state == 97:
-                # Check if new SMS to send is there        
-                if len(self.__smsSendList) > 0:
-                    self.__state = 30
-                
-                # Check if we have to Call somebody
-                elif self.__numberToCall != '':
-                    self.__state = 40
-
-                # Should I Hang Up ?
-                elif self.__sendHangUp:
-                    self.__state = 43
-
-                # Check if new SMS is there
-                elif self.__smsToRead > 0:
-                    self.__state = 20
-
-                # Check if we should call some Urls
-                elif len(self.__GPRScallUrlList) > 0 and self.__GPRSready and self.__GPRSwaitForData == False:
-                    self.__state = 70
-                
-                elif self.__GPRSwaitForData and self.__GPRSgotHttpResponse:
-                    if self.__GPRSnewDataReceived:
-                        self.__state = 74
-                    else:
-                        self.__state = 75
-
-                # Check if GPS Unit should start
-                elif self.__startGPS:
-                    self.__state = 50
-
-                # Check if GPS Unit should start send
-                elif self.__GPSstartSending:
-                    self.__state = 52
-
-                # Check if GPS Unit should stop send
-                elif self.__GPSstopSending:
-                    self.__state = 53
-
-                # Check if Single GPS Data should be collected
-                elif self.__GPScollectData:
-                    self.__state = 54
-
-                elif actTime > self.__GPSwaittime:
-                    self.__GPScollectData = True
-                    self.__GPSwaittime = actTime + self.__GPStimeout
-                
-                elif actTime > self.__SMSwaittime:
-                    self.__state = 2
-                    self.__SMSwaittime = actTime + self.cSMSwaittime
-                
-                elif actTime > self.__GPRSwaittimeStatus:
-                    self.__state = 60
-                    self.__GPRSwaittimeStatus = actTime + self.cGPRSstatusWaittime
-
-                # Wait x Seconds
-                elif actTime > self.__waitTime:
-                    if self.__nextState > 0:
-                        self.__state = self.__nextState
-                        self.__nextState = 0
-            elif self.__state == 98:
-                #Check if alive
-                self.__logger.debug('Check if alive 98')
-                if self.__sendToHat('AT'):
-                    self.__state = 99
-            elif self.__state == 99:
-                #Check if alive
-                if self.__waitForUnlock():
-                    self.__state = 97
-                    self.__nextState = 98
-                    self.__waitTime = actTime + 5000
-
-            # Let other Threads also do their job
-            time.sleep(0.1)
-        self.__logger.info('Worker ended')
+#!/usr/bin/python3
+# Filename: gsmHat.py
+import base64
+import collections
+import concurrent.futures
+import logging
+import os
+import queue
+import select
+import serial
+import threading
+import time
+import math
+import re
+from datetime import datetime
+from .track import GPSTrack
+from .stats import Statistics, TimeoutEstimator, commandVerb
+from .journal import Journal
+from .scheduler import Scheduler
+from .pdu import EncodeSubmit, DecodePDU, Reassembler
+from .trace import WireTrace, commandCategory, responseCategories, TraceCommands, TraceResponses, TraceData
+
+class SMS:
+    __slots__ = ('Message', 'Sender', 'Receiver', 'Date')
+
+    def __init__(self):
+        self.Message = ''
+        self.Sender = ''
+        self.Receiver = ''
+        self.Date = ''
+
+class UrlResponse:
+    __slots__ = ('Url', 'Status', 'Length', 'Content')
+
+    def __init__(self):
+        self.Url = ''
+        self.Status = 0         # HTTP status, e.g. 200 or 601 (network error)
+        self.Length = 0         # length of the response in bytes
+        self.Content = None     # bytearray with the response, None if it went to a sink
+
+    @property
+    def Data(self):
+        # Content as text
+        if self.Content == None:
+            return ''
+        return self.Content.decode('iso-8859-1')
+
+    @Data.setter
+    def Data(self, Value):
+        self.Content = bytearray(Value.encode('iso-8859-1'))
+
+class UrlRequest:
+    """URL call for CallUrl(). Data is uploaded with AT+HTTPDATA, the response goes to Sink:
+    None (UrlResponse.Content), a file like object with write() or a callable(Chunk)."""
+    __slots__ = ('Url', 'Method', 'Data', 'ContentType', 'Sink')
+
+    Methods = {'GET': 0, 'POST': 1, 'HEAD': 2}     # AT+HTTPACTION knows no PUT
+    MaxDataSize = 319488                            # limit of AT+HTTPDATA
+
+    def __init__(self, Url, Method='GET', Data=None, ContentType=None, Sink=None):
+        if Method not in self.Methods:
+            raise ValueError('HTTP method %s is not supported by the hat' % Method)
+        if isinstance(Data, str):
+            Data = Data.encode('utf-8')
+        if Data != None and len(Data) > self.MaxDataSize:
+            raise ValueError('HTTP data is larger than %d bytes' % self.MaxDataSize)
+        self.Url = Url
+        self.Method = Method
+        self.Data = Data
+        self.ContentType = ContentType
+        self.Sink = Sink
+
+class ResponseBody:
+    """Collects the response of an URL call window by window, without copying it around"""
+
+    def __init__(self, Length, Sink=None):
+        self.Length = Length
+        self.Offset = 0
+        self.Content = bytearray(Length) if Sink == None else None
+        self.__sink = Sink
+
+    def Remaining(self):
+        return max(self.Length - self.Offset, 0)
+
+    def Write(self, Chunk):
+        end = self.Offset + len(Chunk)
+        if self.Content != None:
+            if end > len(self.Content):
+                self.Content.extend(bytes(end - len(self.Content)))
+            self.Content[self.Offset:end] = Chunk
+        elif hasattr(self.__sink, 'write'):
+            self.__sink.write(Chunk)
+        else:
+            self.__sink(Chunk)
+        self.Offset = end
+
+    def Finish(self):
+        # The server might have sent less than announced
+        if self.Content != None and self.Offset < len(self.Content):
+            del self.Content[self.Offset:]
+
+class GPS:
+    __slots__ = ('GNSS_status', 'Fix_status', 'UTC', 'Latitude', 'Longitude', 'Altitude', 'Speed', 'Course',
+                 'HDOP', 'PDOP', 'VDOP', 'GPS_satellites', 'GNSS_satellites', 'Signal')
+
+    EarthRadius = 6371e3         # meters
+
+    @staticmethod
+    def CalculateDeltaP(Position1, Position2):
+        phi1 = Position1.Latitude * math.pi / 180.0
+        phi2 = Position2.Latitude * math.pi / 180.0
+        deltaPhi = (Position2.Latitude - Position1.Latitude) * math.pi / 180.0
+        deltaLambda = (Position2.Longitude - Position1.Longitude) * math.pi / 180.0
+
+        a = math.sin(deltaPhi / 2) * math.sin(deltaPhi / 2) + math.cos(phi1) * math.cos(phi2) * math.sin(deltaLambda / 2) * math.sin(deltaLambda / 2)
+        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+        d = GPS.EarthRadius * c    # in meters
+
+        return d
+
+    def __init__(self):
+        self.GNSS_status = 0
+        self.Fix_status = 0
+        self.UTC = ''           # yyyyMMddhhmmss.sss
+        self.Latitude = 0.0     # ±dd.dddddd            [-90.000000,90.000000]
+        self.Longitude = 0.0    # ±ddd.dddddd           [-180.000000,180.000000]
+        self.Altitude = 0.0     # in meters
+        self.Speed = 0.0        # km/h [0,999.99]
+        self.Course = 0.0       # degrees [0,360.00]
+        self.HDOP = 0.0         # [0,99.9]
+        self.PDOP = 0.0         # [0,99.9]
+        self.VDOP = 0.0         # [0,99.9]
+        self.GPS_satellites = 0 # [0,99]
+        self.GNSS_satellites = 0    # [0,99]
+        self.Signal = 0.0         # %      max = 55 dBHz
+
+class CommandError(Exception):
+    """The hat answered a command with ERROR, +CME ERROR or +CMS ERROR"""
+
+    def __init__(self, Command, Kind='ERROR', Code=None):
+        self.Command = Command
+        self.Kind = Kind
+        self.Code = Code
+        if Code is None:
+            Exception.__init__(self, '%s after %s' % (Kind, Command))
+        else:
+            Exception.__init__(self, '%s %s after %s' % (Kind, str(Code), Command))
+
+def parseSMSHeader(Values):
+    # Header of +CMGR/+CMGL looks like: "REC UNREAD","+491601234567","","20/10/21,12:00:00+08"
+    # (+CMGL has the index in front of it)
+    rawData = Values.split('","')
+    newSMS = SMS()
+    #newSMS.Sender = bytearray.fromhex(rawData[1]).decode()
+    newSMS.Sender = rawData[1]
+    newSMS.Date = datetime.strptime(rawData[3].replace('"', '')[:-3], '%y/%m/%d,%H:%M:%S')
+    newSMS.Message = ''
+    return newSMS
+
+def toSMS(Message):
+    # SMS object of a pdu.SMSPart
+    newSMS = SMS()
+    newSMS.Sender = Message.Number
+    newSMS.Date = Message.Date
+    newSMS.Message = Message.Message
+    return newSMS
+
+def parseUTC(Value):
+    # yyyyMMddhhmmss.sss -> datetime, without the slow strptime()
+    return datetime(int(Value[0:4]), int(Value[4:6]), int(Value[6:8]), int(Value[8:10]), int(Value[10:12]), int(Value[12:14]))
+
+def parseSignal(Value):
+    return float(Value) / 55.0
+
+def isNotZero(Value):
+    return Value != 0
+
+# +CGNSINF field table: index, GPS attribute, converter, rule for a good position (None = no rule)
+CGNSINFfields = (
+    (1, 'Fix_status', int, isNotZero),
+    (3, 'Latitude', float, isNotZero),
+    (4, 'Longitude', float, isNotZero),
+    (5, 'Altitude', float, isNotZero),
+    (11, 'PDOP', float, isNotZero),
+    (0, 'GNSS_status', int, None),
+    (2, 'UTC', parseUTC, None),
+    (6, 'Speed', float, None),
+    (7, 'Course', float, None),
+    (10, 'HDOP', float, None),
+    (12, 'VDOP', float, None),
+    (14, 'GPS_satellites', int, None),
+    (15, 'GNSS_satellites', int, None),
+    (18, 'Signal', parseSignal, None),
+)
+
+def parseCGNSINF(Values):
+    # Values looks like: 1,1,20201021120000.000,52.266949,10.524822,75.300,0.00,0.0,1,,0.9,1.2,0.8,,11,8,,,42,,
+    # Returns a GPS object or None, if there is no good position.
+    # The fields with a rule come first in the table, so a position without fix is dropped early.
+    rawData = Values.split(',')
+    if len(rawData) < 21:
+        return None
+
+    newGPS = GPS()
+    for index, name, converter, rule in CGNSINFfields:
+        try:
+            value = converter(rawData[index])
+        except ValueError:
+            if rule != None:
+                return None
+            logging.getLogger(__name__).debug('%s: Could not convert %s', name, rawData[index])
+            continue
+        if rule != None and not rule(value):
+            return None
+        setattr(newGPS, name, value)
+
+    return newGPS
+
+class NMEAParser:
+    """Builds GPS objects from the NMEA sentences the hat sends after AT+CGNSTST=1.
+    GGA, GSA and GSV sentences update the pending position, RMC completes it."""
+
+    KnotsToKmh = 1.852
+
+    def __init__(self):
+        self.__pending = GPS()
+        self.ChecksumErrors = 0
+
+    @staticmethod
+    def CheckSum(Sentence):
+        # $GNRMC,...*hh -> True, if hh is the XOR of all characters between '$' and '*'
+        star = Sentence.rfind('*')
+        if Sentence[:1] != '$' or star < 0 or len(Sentence) < star + 3:
+            return False
+        checksum = 0
+        for char in Sentence[1:star].encode('ascii', 'replace'):
+            checksum ^= char
+        try:
+            return checksum == int(Sentence[star + 1:star + 3], 16)
+        except ValueError:
+            return False
+
+    @staticmethod
+    def ToDegrees(Value, Hemisphere):
+        # ddmm.mmmm / dddmm.mmmm -> ±dd.dddddd
+        dot = Value.find('.')
+        if dot < 0:
+            dot = len(Value)
+        degrees = float(Value[:dot - 2]) + float(Value[dot - 2:]) / 60.0
+        if Hemisphere in ('S', 'W'):
+            degrees = -degrees
+        return round(degrees, 6)
+
+    def Parse(self, Sentence):
+        """Returns a new GPS object, when the sentence completed a good position, otherwise None"""
+        if not self.CheckSum(Sentence):
+            self.ChecksumErrors += 1
+            return None
+
+        fields = Sentence[1:Sentence.rfind('*')].split(',')
+        sentenceType = fields[0][2:]
+        try:
+            if sentenceType == 'GGA':
+                self.__parseGGA(fields)
+            elif sentenceType == 'GSA':
+                self.__parseGSA(fields)
+            elif sentenceType == 'GSV':
+                self.__parseGSV(fields)
+            elif sentenceType == 'RMC':
+                return self.__parseRMC(fields)
+        except (ValueError, IndexError):
+            pass
+        return None
+
+    def __parseGGA(self, fields):
+        # $GNGGA,hhmmss.sss,ddmm.mmmm,N,dddmm.mmmm,E,quality,satellites,HDOP,altitude,M,...
+        if fields[9] != '':
+            self.__pending.Altitude = float(fields[9])
+        if fields[7] != '':
+            self.__pending.GNSS_satellites = int(fields[7])
+        if fields[8] != '':
+            self.__pending.HDOP = float(fields[8])
+
+    def __parseGSA(self, fields):
+        # $GNGSA,mode,fixType,12 x satellite,PDOP,HDOP,VDOP
+        if fields[15] != '':
+            self.__pending.PDOP = float(fields[15])
+        if fields[16] != '':
+            self.__pending.HDOP = float(fields[16])
+        if fields[17] != '':
+            self.__pending.VDOP = float(fields[17])
+
+    def __parseGSV(self, fields):
+        # $GPGSV,messages,number,satellites in view,...
+        if fields[0][:2] == 'GP' and fields[3] != '':
+            self.__pending.GPS_satellites = int(fields[3])
+
+    def __parseRMC(self, fields):
+        # $GNRMC,hhmmss.sss,A,ddmm.mmmm,N,dddmm.mmmm,E,knots,course,ddmmyy,...
+        newGPS = self.__pending
+        self.__pending = GPS()
+        # Values of the slower sentences are kept for the next position
+        for name in ('Altitude', 'HDOP', 'PDOP', 'VDOP', 'GPS_satellites', 'GNSS_satellites'):
+            setattr(self.__pending, name, getattr(newGPS, name))
+
+        if fields[2] != 'A' or fields[3] == '' or fields[5] == '':
+            return None
+
+        newGPS.GNSS_status = 1
+        newGPS.Fix_status = 1
+        newGPS.UTC = datetime.strptime(fields[9] + fields[1][:6], '%d%m%y%H%M%S')
+        newGPS.Latitude = self.ToDegrees(fields[3], fields[4])
+        newGPS.Longitude = self.ToDegrees(fields[5], fields[6])
+        if fields[7] != '':
+            newGPS.Speed = round(float(fields[7]) * self.KnotsToKmh, 2)
+        if fields[8] != '':
+            newGPS.Course = float(fields[8])
+
+        if newGPS.Latitude == 0.0 or newGPS.Longitude == 0.0:
+            return None
+        return newGPS
+
+class SerialLineReader:
+    """Reads everything the hat has sent so far in one go and splits it into lines"""
+
+    def __init__(self, Serial):
+        self.__ser = Serial
+        self.__buffer = bytearray()
+        self.BytesRead = 0
+
+    def ReadLines(self, RawMode, ByteCount=None, Prompt=None):
+        # RawMode() is asked before every line, because a line can switch the reception mode.
+        # Raw lines keep their line ending, all other lines are returned without '\r' and '\n'.
+        # While ByteCount() is > 0, up to that many bytes are returned as bytes object instead (e.g. after +HTTPREAD).
+        # While Prompt() is True, the prompt '> ' (without line ending, e.g. after AT+CIPSEND) is returned as '>'
+        waiting = self.__ser.in_waiting
+        if waiting > 0:
+            data = self.__ser.read(waiting)
+            self.BytesRead += len(data)
+            self.__buffer += data
+
+        buffer = self.__buffer
+        start = 0
+        try:
+            while True:
+                count = ByteCount() if ByteCount != None else 0
+                if count > 0:
+                    if start >= len(buffer):
+                        break
+                    chunk = bytes(buffer[start:start + count])
+                    start += len(chunk)
+                    yield chunk
+                    continue
+
+                if Prompt != None and Prompt() and buffer.startswith(b'> ', start):
+                    start += 2
+                    yield '>'
+                    continue
+
+                end = buffer.find(b'\n', start)
+                if end < 0:
+                    break
+                if RawMode():
+                    line = buffer[start:end + 1]
+                else:
+                    line = buffer[start:end].replace(b'\r', b'')
+                start = end + 1
+                yield line.decode('iso-8859-1')
+        finally:
+            del buffer[:start]
+
+class MessageQueue:
+    """Thread safe FIFO between the worker thread and the application.
+    MaxSize = 0 means unlimited. A full queue drops its oldest item (DropOldest=True)
+    or rejects the new one."""
+
+    def __init__(self, MaxSize=0, DropOldest=True):
+        self.MaxSize = MaxSize
+        self.Dropped = 0
+        self.__dropOldest = DropOldest
+        self.__items = collections.deque()
+        self.__condition = threading.Condition()
+        self.__closed = False
+
+    def __len__(self):
+        return len(self.__items)
+
+    def Full(self):
+        return self.MaxSize > 0 and len(self.__items) >= self.MaxSize
+
+    def Put(self, Item):
+        with self.__condition:
+            if self.Full():
+                self.Dropped += 1
+                if not self.__dropOldest:
+                    return False
+                self.__items.popleft()
+            self.__items.append(Item)
+            self.__condition.notify()
+        return True
+
+    def PutFront(self, Item):
+        # Puts an item back as the next one, e.g. a job that has to be started again
+        with self.__condition:
+            self.__items.appendleft(Item)
+            self.__condition.notify()
+
+    def Peek(self):
+        try:
+            return self.__items[0]
+        except IndexError:
+            return None
+
+    def Get(self, Timeout=0):
+        # Timeout in seconds, 0 returns immediately, None waits until an item arrives
+        with self.__condition:
+            if Timeout != 0:
+                self.__condition.wait_for(lambda: self.__items or self.__closed, Timeout)
+            if self.__items:
+                return self.__items.popleft()
+        return None
+
+    def Iterate(self, Timeout=None):
+        # Yields items as they arrive, ends after Timeout seconds without new item or when closed
+        while True:
+            item = self.Get(Timeout)
+            if item is None:
+                return
+            yield item
+
+    def Close(self):
+        # Wakes up all waiting readers
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+class Socket:
+    """TCP or UDP link over the TCP/IP stack of the hat, created by GSMHat.OpenSocket().
+    Send() only queues the data, the worker thread sends it. Small TCP messages are
+    combined into one AT+CIPSEND, UDP messages are sent as one datagram each."""
+
+    Protocols = ('TCP', 'UDP')
+    cMaxSendSize = 1460             # bytes per AT+CIPSEND
+
+    def __init__(self, Link, Protocol, Host, Port, WakeUp, SendQueueSize=0, ReceiveQueueSize=0):
+        self.Link = Link
+        self.Protocol = Protocol
+        self.Host = Host
+        self.Port = Port
+        self.State = 'OPENING'      # 'CONNECTING', 'CONNECTED', 'CLOSING', 'CLOSED'
+        self.Connected = concurrent.futures.Future()    # result is the Socket, fails with CommandError or ConnectionError
+        self.CloseRequested = False
+        self.BytesSent = 0
+        self.BytesReceived = 0
+        self.SendQueue = MessageQueue(SendQueueSize, DropOldest=False)
+        self.SendOffset = 0         # bytes of the first job in SendQueue that were sent already
+        self.ReceiveQueue = MessageQueue(ReceiveQueueSize)
+        self.__wakeUp = WakeUp
+
+    def Send(self, Data):
+        # Returns a concurrent.futures.Future with the number of bytes as result, when the hat sent them.
+        # It fails with ConnectionError or queue.Full.
+        if isinstance(Data, str):
+            Data = Data.encode('utf-8')
+        if self.Protocol == 'UDP' and len(Data) > self.cMaxSendSize:
+            raise ValueError('UDP datagram is larger than %d bytes' % self.cMaxSendSize)
+        future = concurrent.futures.Future()
+        if self.State == 'CLOSED' or self.CloseRequested:
+            future.set_exception(ConnectionError('Link %d is closed' % self.Link))
+        elif not self.SendQueue.Put((bytes(Data), future, time.monotonic())):
+            future.set_exception(queue.Full('Send queue of link %d is full' % self.Link))
+        else:
+            self.__wakeUp()
+        return future
+
+    def Available(self):
+        return len(self.ReceiveQueue)
+
+    def Receive(self, Timeout=0):
+        # Returns the data (bytes) of one +RECEIVE or None. Timeout in seconds, None waits until data arrives
+        return self.ReceiveQueue.Get(Timeout)
+
+    def Iterate(self, Timeout=None):
+        # Ends when the link was closed and all data was read
+        return self.ReceiveQueue.Iterate(Timeout)
+
+    def Close(self):
+        # Queued data is sent before the link is closed
+        self.CloseRequested = True
+        self.__wakeUp()
+
+class ResponseDispatcher:
+    """Calls the handlers registered for the prefix of a line received from the hat.
+    A handler that raises is logged to Logger, the other handlers and the worker go on."""
+
+    reErrorCode = re.compile(r'\d+')
+
+    def __init__(self, Logger=None):
+        self.__handlers = {}
+        self.__logger = Logger or logging.getLogger(__name__)
+
+    @staticmethod
+    def GetPrefix(Line):
+        # '+CMTI: "SM",3' -> '+CMTI', '+RECEIVE,0,5:' -> '+RECEIVE', NMEA sentences ('$GNRMC,...') -> '$',
+        # all other lines (e.g. 'OK', 'RING') are their own prefix
+        if Line[:1] == '+':
+            pos = Line.find(':')
+            if pos > 0:
+                comma = Line.find(',', 0, pos)
+                return Line[:comma] if comma > 0 else Line[:pos]
+        elif Line[:1] == '$':
+            return '$'
+        return Line
+
+    @staticmethod
+    def GetErrorCode(Values):
+        match = ResponseDispatcher.reErrorCode.search(Values)
+        if match:
+            return int(match.group())
+        return None
+
+    def Register(self, Prefix, Handler):
+        self.__handlers.setdefault(Prefix, []).append(Handler)
+
+    def Unregister(self, Prefix, Handler):
+        handlers = self.__handlers.get(Prefix)
+        if handlers and Handler in handlers:
+            handlers.remove(Handler)
+            if not handlers:
+                del self.__handlers[Prefix]
+
+    def Dispatch(self, Line):
+        prefix = self.GetPrefix(Line)
+        handlers = self.__handlers.get(prefix)
+        if handlers is None:
+            return False
+
+        if prefix == '$':
+            # NMEA handlers get the whole sentence
+            values = Line.strip()
+        else:
+            values = Line[len(prefix) + 1:].strip()
+        for handler in handlers:
+            try:
+                handler(values)
+            except Exception:
+                self.__logger.exception('Handler for %s failed on line %r', prefix, Line)
+        return True
+
+class GPIOPowerKey:
+    """Power key of the hat on a pin of the Raspberry Pi (board numbering). RPi.GPIO is only
+    imported when the key is pressed, so gsmHat runs on other hosts (e.g. with the simulator).
+    GSMHat(PowerKey=...) takes any object with Press() and Release()."""
+
+    def __init__(self, Pin=7):
+        self.Pin = Pin
+
+    def Press(self):
+        import RPi.GPIO as GPIO
+        GPIO.setmode(GPIO.BOARD)
+        GPIO.setup(self.Pin, GPIO.OUT)
+        GPIO.output(self.Pin, GPIO.LOW)
+
+    def Release(self):
+        import RPi.GPIO as GPIO
+        GPIO.output(self.Pin, GPIO.HIGH)
+        GPIO.cleanup()
+
+class GSMHat:
+    """GSM Hat Backend with SMS Functionality (for now)"""
+    
+    regexGetSingleValue = re.compile(r'([+][a-zA-Z\ ]+(:\ ))([\d]+)')
+    regexGetAllValues = re.compile(r'([+][a-zA-Z:\s]+)([\w\",\s+-\/:.]+)')
+    regexLinkStatus = re.compile(r'(\d), ([A-Z ]+)$')
+    regexIPaddress = re.compile(r'\d+\.\d+\.\d+\.\d+$')
+    timeoutSerial = 5               # seconds a command may take, until its round trips are known
+    timeoutGPSActive = 1
+    timeoutGPSInactive = 2000
+    cSMSwaittime = 2500             # milliseconds
+    cGPRSstatusWaittime = 5000      # milliseconds
+    cWorkerMaxIdletime = 1000       # milliseconds
+    cReceiveQueueSize = 0           # kept SMS and URL responses, 0 = unlimited, otherwise the oldest gets dropped
+    cSendQueueSize = 0              # queued SMS and URL calls, 0 = unlimited, otherwise new jobs get rejected
+    cGPStrackSize = 36000           # positions kept in the track (10 hours at 1 Hz), 0 keeps none
+    SMSbulkRead = True              # read the whole inbox with AT+CMGL instead of AT+CMGR slot by slot
+    SMSpduMode = False              # SMS as PDU (AT+CMGF=0): long messages are split and joined again, UCS2 for other characters
+    cConcatMaxAge = 3600            # seconds the parts of a long received message wait for the missing ones
+    cLogLevel = logging.INFO        # every line sent and received is recorded by the wire trace, not the log
+    cTraceSize = 1000               # entries kept by the wire trace
+    cHTTPreadWindow = 8192          # bytes read with one AT+HTTPREAD
+    cSocketLinks = 6                # links of the TCP/IP stack (AT+CIPMUX=1)
+    # Seconds, until their round trips are known. +HTTPACTION is the time until the server answered.
+    cCommandTimeouts = {'AT+CMGS': 30, 'AT+CIICR': 85, 'AT+SAPBR': 85, '+HTTPACTION': 120, 'AT': 1, 'ATE': 1}
+    # Commands that wait for the network, their learned timeout is never shorter than the one above
+    cNetworkCommands = ('AT+CMGS', 'AT+CIICR', 'AT+SAPBR', 'AT+HTTPACTION', 'AT+CIPSTART')
+    cCommandTimeoutMin = 0.5        # seconds, the learned timeout of a command is never shorter
+    cWarmStart = True               # ask the module what is configured already, instead of configuring everything
+    cRecoveryProbes = 3             # AT/ATE0 attempts after a timeout, before the next step of the recovery
+    cSoftResetTime = 10000          # milliseconds the module needs after AT+CFUN=1,1
+    cPowerKeyTime = 4000            # milliseconds the power key is pressed
+    cPowerOnTime = 10000            # milliseconds the module needs after the power key
+    cScheduler = Scheduler          # picks the next job in the idle state, see SetSchedule()
+    # Job classes of the idle state: (priority, weight, deadline in seconds or None), see Scheduler
+    cSchedule = {'Call': (0, 1.0, None),
+                 'HTTP response': (0, 1.0, None),
+                 'SMS': (1, 1.0, None),
+                 'Inbox': (1, 1.0, 5.0),
+                 'URL': (1, 1.0, None),
+                 'Sockets': (1, 1.0, None),
+                 'GPS setup': (1, 1.0, None),
+                 'GPS': (1, 1.0, 2.0),      # deadline from the last poll, not from ready
+                 'Inbox poll': (2, 1.0, 10.0),
+                 'GPRS status': (2, 1.0, 30.0)}
+
+    def __init__(self, SerialPort, Baudrate, Logpath='gmsHat.log', TracePath='gsmHatTrace.log', JournalPath=None,
+                 PowerKey=None):
+        self.__baudrate = Baudrate
+        self.__port = SerialPort
+        self.__powerKey = PowerKey if PowerKey != None else GPIOPowerKey()
+
+        # One logger per hat, so the log file of one hat does not get the messages of the others
+        self.__logger = logging.getLogger('%s.%s' % (__name__, SerialPort))
+        self.__logger.setLevel(self.cLogLevel)
+        self.__loggerFileHandle = None
+        if Logpath != None:
+            # delay: the log file is not opened (or created) before the first message
+            self.__loggerFileHandle = logging.FileHandler(Logpath, delay=True)
+            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            self.__loggerFileHandle.setFormatter(formatter)
+            self.__loggerFileHandle.setLevel(self.cLogLevel)
+            self.__logger.addHandler(self.__loggerFileHandle)
+        self.__trace = WireTrace(self.cTraceSize, TracePath)
+        self.__traceCategory = 'STATE'
+        self.__stats = Statistics()
+        self.__timeouts = TimeoutEstimator(self.timeoutSerial, self.cCommandTimeouts, self.cCommandTimeoutMin,
+                                           Floors=self.cNetworkCommands)
+        # SMS and URL calls, that were queued when the application stopped, are sent again
+        self.__journal = Journal(JournalPath) if JournalPath != None else None
+        self.__replayed = []
+
+        self.__registerResponseHandlers()
+        self.__connect()
+        self.__startWorking()
+        if self.__journal != None:
+            self.__replayJournal()
+    
+    def __connect(self):
+        self.__ser = serial.Serial(self.__port, self.__baudrate)
+        self.__ser.flushInput()
+        self.__serReader = SerialLineReader(self.__ser)
+        self.__serData = ''
+        self.__writeLock = False
+        self.__wakeupRead, self.__wakeupWrite = os.pipe()
+        os.set_blocking(self.__wakeupRead, False)
+        os.set_blocking(self.__wakeupWrite, False)
+        self.__logger.info('Serial connection to %s established', self.__port)
+
+    def __disconnect(self):
+        self.__ser.close()
+        os.close(self.__wakeupRead)
+        os.close(self.__wakeupWrite)
+    
+    def __startWorking(self):
+        self.__working = True
+        self.__state = 1
+        self.__nextState = 0
+        self.__smsToRead = 0
+        self.__smsReadSlot = 0
+        self.__recoveryStep = 0         # 0 = none, 1 = AT/ATE0, 2 = AT+CFUN=1,1, 3 = power key
+        self.__recoveryProbes = 0
+        self.__recoveryStartedAt = 0
+        self.__recoveryWaittime = 0
+        self.__init = False
+        self.__lastCommandSentString = ''
+        self.__commandError = None
+        self.__commandSentAt = 0
+        self.__commandSentVerb = ''
+        self.__commandDeadline = 0      # time.monotonic() when the command times out, 0 = none
+        self.__smsReference = None
+        self.__readRAW = 0
+        self.__smsToBuild = None
+        self.__smsBulkCount = 0
+        self.__smsListed = 0            # entries of the last AT+CMGL, stored (sent/unsent) ones too
+        self.__smsKept = -1             # messages left in the storage after the last AT+CMGL, -1 = unknown
+        self.__smsListSlot = ''
+        self.__smsListBuffer = []       # (key, SMS) of the running AT+CMGL, stored with its OK
+        self.__smsDelivered = set()     # keys of listed messages, that are not deleted yet
+        self.__smsParts = []            # (length, PDU) of the SMS being sent in PDU mode
+        self.__smsPartsJob = None
+        self.__smsReferences = []       # message references of the parts sent so far
+        self.__concatReference = 0
+        self.__concat = Reassembler(self.cConcatMaxAge)
+        self.__warmSMSformat = ''
+        self.__warmGPSpower = False
+        self.__smsList = MessageQueue(self.cReceiveQueueSize)
+        self.__smsSendList = MessageQueue(self.cSendQueueSize, DropOldest=False)
+        self.__SMSwaittime = 0
+        self.__numberToCall = ''
+        self.__sendHangUp = False
+        self.__startGPS = False
+        self.__GPRSwaittimeStatus = 0
+        self.__GPRSIPaddress = ''
+        self.__GPRSready = False
+        self.__GPRSuserAPN = None
+        self.__GPRSuserUSER = None
+        self.__GPRSuserPWD = None
+        self.__GPRScallUrlList = MessageQueue(self.cSendQueueSize, DropOldest=False)
+        self.__GPRSdataReceived = MessageQueue(self.cReceiveQueueSize)
+        self.__GPRSwaitForData = False
+        self.__GPRSactiveJob = None
+        self.__GPRShttpStatus = 0
+        self.__GPRShttpLength = 0
+        self.__GPRShttpActionAt = 0
+        self.__GPRShttpSession = False
+        self.__GPRSbody = None
+        self.__GPRSbytesToRead = 0
+        self.__GPRSreadOffset = 0
+        self.__CIPready = False
+        self.__CIPaddress = ''
+        self.__sockets = [None] * self.cSocketLinks
+        self.__socketLock = threading.Lock()
+        self.__socketNext = 0
+        self.__socketActive = None
+        self.__socketState = 0
+        self.__socketSending = None
+        self.__socketPrompt = False
+        self.__socketReceive = None
+        self.__GPSstarted = False
+        self.__GPSstartSending = False
+        self.__GPSstopSending = False
+        self.__GPScollectData = False
+        self.__GPSactualData = GPS()
+        self.__GPStimeout = self.timeoutGPSInactive
+        self.__GPSwaittime = 0
+        self.__GPSpollTime = 0.0
+        self.__GPSstreaming = False
+        self.__GPSpaused = False        # NMEA stream stopped while data is read by its byte count
+        self.__NMEAparser = NMEAParser()
+        self.__GPStrack = GPSTrack(self.cGPStrackSize)
+        self.__GPSlisteners = []
+        self.__actTime = 0
+        self.__createScheduler()
+        self.__workerThread = threading.Thread(target=self.__workerThread, daemon=True)
+        self.__workerThread.start()
+
+    def __stopWorking(self):
+        self.__working = False
+        self.__smsList.Close()
+        self.__GPRSdataReceived.Close()
+        self.__wakeUp()
+        self.__workerThread.join(10.0)  # Timeout = 10.0 Seconds
+        if self.__state == 96:
+            self.__releasePowerKey()
+
+        # Jobs that were not sent anymore, or did not get their answer, stay in the journal
+        closedError = ConnectionError('Connection to the hat was closed')
+        jobs = []
+        for jobList in (self.__smsSendList, self.__GPRScallUrlList):
+            job = jobList.Get()
+            while job != None:
+                jobs.append(job)
+                job = jobList.Get()
+        if self.__GPRSactiveJob != None:
+            jobs.append(self.__GPRSactiveJob)
+            self.__GPRSactiveJob = None
+        for job in jobs:
+            if job[1].cancelled():
+                self.__completeJob(job)
+            elif job[1].running():
+                # cancel() fails on a job that was started
+                job[1].set_exception(closedError)
+            else:
+                job[1].cancel()
+        self.__releaseSockets(closedError)
+
+    def __sendToHat(self, string):
+        if self.__writeLock == False:
+            self.__lastCommandSentString = string
+            self.__commandError = None
+            string = string + '\n'
+            data = string.encode('iso-8859-1')
+            self.__ser.write(data)
+            self.__stats.Count('BytesOut', len(data))
+            self.__commandSentAt = time.monotonic()
+            self.__commandSentVerb = commandVerb(string)
+            self.__writeLock = True
+            self.__commandDeadline = self.__commandSentAt + self.__timeouts.Get(self.__commandSentVerb)
+            if self.__trace.Enabled:
+                self.__traceCategory = commandCategory(string)
+                self.__trace.Record(self.__traceCategory, TraceCommands, '>', string)
+            return True
+        else:
+            return False
+
+    def __wakeUp(self):
+        # Lets the worker leave __waitForEvent() immediately, e.g. because there is a new job
+        try:
+            os.write(self.__wakeupWrite, b'\0')
+        except BlockingIOError:
+            # Pipe is full, so the worker will wake up anyway
+            pass
+
+    def __waitForEvent(self, timeout):
+        # Sleep until the hat sends something, a new job comes in or the timeout (seconds) expires
+        readable, _, _ = select.select([self.__ser.fileno(), self.__wakeupRead], [], [], timeout)
+        if self.__wakeupRead in readable:
+            try:
+                while os.read(self.__wakeupRead, 512):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def __getIdleTimeout(self, actTime):
+        # Time in seconds until the next timer of the statemachine expires
+        nextTime = actTime + self.cWorkerMaxIdletime
+        for waitTime in (self.__GPSwaittime, self.__SMSwaittime, self.__GPRSwaittimeStatus, self.__waitTime, self.__recoveryWaittime):
+            if actTime < waitTime < nextTime:
+                nextTime = waitTime
+        timeout = (nextTime - actTime) / 1000.0
+        if self.__writeLock and self.__commandDeadline > 0:
+            # Wake up right after the command timed out
+            timeout = min(timeout, max(self.__commandDeadline - time.monotonic(), 0.0) + 0.001)
+        return timeout
+    
+    def __pressPowerKey(self):
+        # Released by __releasePowerKey() after cPowerKeyTime, the worker does not sleep meanwhile
+        try:
+            self.__powerKey.Press()
+        except Exception:
+            self.__logger.exception('Could not press the power key')
+
+    def __releasePowerKey(self):
+        try:
+            self.__powerKey.Release()
+        except Exception:
+            self.__logger.exception('Could not release the power key')
+
+    def SMS_available(self):
+        return len(self.__smsList)
+        
+    def SMS_read(self, Timeout=0):
+        # Timeout in seconds, None waits until a SMS arrives
+        return self.__smsList.Get(Timeout)
+
+    def SMS_iter(self, Timeout=None):
+        # for newSMS in gsm.SMS_iter(): ... sleeps until the next SMS arrives
+        return self.__smsList.Iterate(Timeout)
+
+    def SMS_write(self, NumberReceiver, Message):
+        # Returns a concurrent.futures.Future with the message reference as result, a list of them
+        # for a long message in PDU mode (SMSpduMode). It fails with CommandError (e.g. +CMS ERROR),
+        # queue.Full or ValueError (PDU mode: no phone number or more than 255 parts).
+        newSMS = SMS()
+        newSMS.Receiver = NumberReceiver
+        newSMS.Message = Message
+        future = concurrent.futures.Future()
+        job = (newSMS, future, time.monotonic(), self.__journalAppend('SMS', newSMS))
+        if not self.__smsSendList.Put(job):
+            self.__logger.warning('SMS send queue is full, message to %s rejected', NumberReceiver)
+            self.__completeJob(job)
+            future.set_exception(queue.Full('SMS send queue is full'))
+            return future
+
+        self.__wakeUp()
+        return future
+
+    def Call(self, Number, Timeout = 15):
+        if self.__numberToCall == '':
+            self.__numberToCall = str(Number)
+            self.__callTimeout = Timeout
+            self.__wakeUp()
+            return True
+
+        return False
+
+    def HangUp(self):
+        self.__sendHangUp = True
+        self.__wakeUp()
+
+    def GetActualGPS(self):
+        return self.__GPSactualData
+
+    def GetGPSTrack(self):
+        # GPSTrack with the last cGPStrackSize good positions
+        return self.__GPStrack
+
+    def AddGPSListener(self, Listener):
+        # Listener(GPS) is called from the worker thread for every new good position
+        self.__GPSlisteners.append(Listener)
+
+    def RemoveGPSListener(self, Listener):
+        self.__GPSlisteners.remove(Listener)
+
+    def SetGPSstreaming(self, Enable):
+        # Enable: the hat sends NMEA sentences continuously (AT+CGNSTST=1) and every new
+        # position updates GetActualGPS() without polling AT+CGNSINF
+        self.__GPSstreaming = Enable
+        if Enable:
+            self.__GPSstopSending = False
+            self.__startGPSsending()
+        else:
+            self.__GPSstartSending = False
+            self.__stopGPSsending()
+        self.__wakeUp()
+
+    def UrlResponse_available(self):
+        return len(self.__GPRSdataReceived)
+
+    def UrlResponse_read(self, Timeout=0):
+        # Timeout in seconds, None waits until a response arrives
+        return self.__GPRSdataReceived.Get(Timeout)
+
+    def UrlResponse_iter(self, Timeout=None):
+        return self.__GPRSdataReceived.Iterate(Timeout)
+
+    def CallUrl(self, url, Method='GET', Data=None, ContentType=None, Sink=None):
+        # Returns a concurrent.futures.Future with an UrlResponse object as result.
+        # It fails with CommandError or queue.Full. Method is 'GET', 'POST' or 'HEAD',
+        # Data (str or bytes) is sent as request body and Sink gets the response (see UrlRequest).
+        # Calls with a Sink are not kept in the journal.
+        request = UrlRequest(url, Method, Data, ContentType, Sink)
+        future = concurrent.futures.Future()
+        job = (request, future, time.monotonic(), self.__journalAppend('URL', request) if Sink == None else None)
+        if not self.__GPRScallUrlList.Put(job):
+            self.__logger.warning('URL queue is full, call rejected')
+            self.__completeJob(job)
+            future.set_exception(queue.Full('URL queue is full'))
+            return future
+
+        self.__wakeUp()
+        return future
+
+    def PendingUrlCalls(self):
+        return len(self.__GPRScallUrlList)
+
+    def PendingSMS(self):
+        return len(self.__smsSendList)
+
+    def IsRecovering(self):
+        # True while the module does not answer and the worker tries to get it back (AT, AT+CFUN=1,1, power key)
+        return self.__recoveryStep != 0
+
+    def GetReplayedJobs(self):
+        # [(Kind, SMS or UrlRequest, Future), ...] of the jobs the journal queued again at the start
+        return list(self.__replayed)
+
+    def FlushJournal(self, Timeout=None):
+        # Waits until all jobs submitted so far are on the disk, returns False after Timeout seconds
+        if self.__journal == None:
+            return True
+        return self.__journal.Flush(Timeout)
+
+    def __journalAppend(self, kind, item):
+        # Returns the id of the job in the journal or None
+        if self.__journal == None:
+            return None
+        if kind == 'SMS':
+            payload = {'Receiver': item.Receiver, 'Message': item.Message}
+        else:
+            payload = {'Url': item.Url, 'Method': item.Method, 'ContentType': item.ContentType,
+                       'Data': base64.b64encode(item.Data).decode('ascii') if item.Data != None else None}
+        return self.__journal.Append(kind, payload)
+
+    def __completeJob(self, job):
+        # The job got its result (or was rejected or cancelled), it is not sent again after a restart
+        if job[3] != None:
+            self.__journal.Complete(job[3])
+
+    def __replayJournal(self):
+        for jobId, kind, payload in self.__journal.Pending():
+            if kind == 'SMS':
+                item = SMS()
+                item.Receiver = payload['Receiver']
+                item.Message = payload['Message']
+                jobList = self.__smsSendList
+            else:
+                data = base64.b64decode(payload['Data']) if payload['Data'] != None else None
+                item = UrlRequest(payload['Url'], payload['Method'], data, payload['ContentType'])
+                jobList = self.__GPRScallUrlList
+            future = concurrent.futures.Future()
+            if jobList.Put((item, future, time.monotonic(), jobId)):
+                self.__replayed.append((kind, item, future))
+            else:
+                # Stays in the journal for the next start
+                self.__logger.warning('%s queue is full, journal job %d not replayed', kind, jobId)
+        if self.__replayed:
+            self.__logger.info('%d jobs of the journal queued again', len(self.__replayed))
+            self.__wakeUp()
+
+    def OpenSocket(self, Host, Port, Protocol='TCP'):
+        # Returns a Socket right away, Socket.Connected tells when the link is up.
+        # Raises queue.Full when all links are in use. The APN of SetGPRSconnection() is used.
+        if Protocol not in Socket.Protocols:
+            raise ValueError('Unknown protocol %s' % Protocol)
+        with self.__socketLock:
+            for link, sock in enumerate(self.__sockets):
+                if sock == None:
+                    sock = Socket(link, Protocol, Host, Port, self.__wakeUp, self.cSendQueueSize, self.cReceiveQueueSize)
+                    self.__sockets[link] = sock
+                    break
+            else:
+                raise queue.Full('All %d links are in use' % len(self.__sockets))
+        self.__wakeUp()
+        return sock
+
+    def GetSockets(self):
+        return [sock for sock in self.__sockets if sock != None]
+
+    def SetGPRSconnection(self, APN, Username, Password):
+        self.__GPRSuserAPN = APN
+        self.__GPRSuserUSER = Username
+        self.__GPRSuserPWD = Password
+
+    def SetSchedule(self, Name, Priority=None, Weight=None, Deadline=-1):
+        """Changes a job class of the idle state (see GSMHat.cSchedule): lower Priority numbers go
+        first, classes of the same priority share the hat by Weight, a class waits at most Deadline
+        seconds (None for no limit, 'GPS' counts it from its last poll). E.g. SetSchedule('GPS', Deadline=3.0)"""
+        self.__scheduler.Configure(Name, Priority, Weight, Deadline)
+
+    def __createScheduler(self):
+        jobClasses = (('Call', lambda: self.__numberToCall != '' or self.__sendHangUp,
+                       lambda: 40 if self.__numberToCall != '' else 43),
+                      ('HTTP response', lambda: self.__GPRSwaitForData and (self.__GPRSgotHttpResponse or self.__httpResponseOverdue()),
+                       self.__startHttpResponse),
+                      ('SMS', lambda: len(self.__smsSendList) > 0, lambda: 30),
+                      ('Inbox', lambda: self.__smsToRead > 0, lambda: 23 if self.SMSbulkRead else 20),
+                      ('URL', lambda: len(self.__GPRScallUrlList) > 0 and self.__GPRSready and not self.__GPRSwaitForData,
+                       self.__startUrlCalls),
+                      ('Sockets', self.__nextSocketJob, self.__startSocketJob),
+                      ('GPS setup', lambda: (self.__startGPS or (self.__GPSstartSending and not self.__GPSpaused) or self.__GPSstopSending
+                                             or self.__GPScollectData or (self.__GPSpaused and not self.__byteCountReads())),
+                       self.__startGPSsetup),
+                      ('GPS', lambda: self.__actTime > self.__GPSwaittime and (not self.__GPSstreaming or self.__GPSpaused),
+                       self.__startGPSpoll),
+                      ('Inbox poll', lambda: self.__actTime > self.__SMSwaittime, self.__startInboxPoll),
+                      ('GPRS status', lambda: self.__actTime > self.__GPRSwaittimeStatus, self.__startGPRSstatus))
+        # The GPS deadline bounds the time between two polls, the class gets ready only after timeoutGPSInactive
+        since = {'GPS': lambda: self.__GPSpollTime}
+        self.__scheduler = self.cScheduler()
+        for name, ready, start in jobClasses:
+            priority, weight, deadline = self.cSchedule[name]
+            self.__scheduler.Register(name, ready, start, priority, weight, deadline, since.get(name))
+
+    def __httpResponseOverdue(self):
+        return self.__GPRShttpActionAt > 0 and time.monotonic() > self.__GPRShttpActionAt + self.__timeouts.Get('+HTTPACTION')
+
+    def __startHttpResponse(self):
+        if not self.__GPRSgotHttpResponse:
+            # +HTTPACTION did not come, the HTTP service is terminated
+            self.__logger.error('Timeout waiting for +HTTPACTION')
+            self.__stats.Count('Timeouts')
+            self.__timeouts.Backoff('+HTTPACTION')
+            self.__GPRShttpActionAt = 0
+            self.__failUrlJob(TimeoutError('The server did not answer'))
+            return 75
+        return 74 if self.__GPRSbody != None else 75
+
+    def __startUrlCalls(self):
+        if self.__GPRShttpSession:
+            # No AT+HTTPINIT, AT+HTTPPARA="CID" and AT+HTTPTERM for this call
+            self.__stats.Count('HttpReuses')
+            self.__stats.Count('SavedRoundTrips', 3)
+            return 72
+        return 70
+
+    def __startGPSsetup(self):
+        if self.__GPSpaused and not self.__byteCountReads():
+            # Resume the NMEA stream
+            self.__GPSpaused = False
+            if self.__GPSstreaming:
+                return 52
+        if self.__startGPS:
+            return 50
+        elif self.__GPSstartSending and not self.__GPSpaused:
+            return 52
+        elif self.__GPSstopSending:
+            return 53
+        return 54
+
+    def __byteCountReads(self):
+        # HTTP content or data of a link is expected, it is read by its byte count
+        return self.__GPRSbody != None or any(sock.State in ('CONNECTING', 'CONNECTED') for sock in self.GetSockets())
+
+    def __pauseGPSstream(self):
+        # NMEA sentences must not end up in data that is read by its byte count. Returns True, when
+        # the stream is stopped, otherwise AT+CGNSTST=0 is sent and the state has to wait for it.
+        if not self.__GPSstreaming or self.__GPSpaused:
+            return True
+        if self.__sendToHat('AT+CGNSTST=0'):
+            self.__GPSpaused = True
+        return False
+
+    def __startGPSpoll(self):
+        self.__GPSwaittime = self.__actTime + self.__GPStimeout
+        self.__GPSpollTime = time.monotonic()
+        return 54
+
+    def __startInboxPoll(self):
+        self.__SMSwaittime = self.__actTime + self.cSMSwaittime
+        return 2
+
+    def __startGPRSstatus(self):
+        self.__GPRSwaittimeStatus = self.__actTime + self.cGPRSstatusWaittime
+        return 60
+
+    def __configureGPS(self, powerOn):
+        # After the start of the worker, NMEA streaming is switched as the application wants it
+        if powerOn:
+            self.__startGPSUnit()
+        if self.__GPSstreaming:
+            self.__startGPSsending()
+        else:
+            self.__stopGPSsending()
+
+    def __startGPSUnit(self):
+        self.__startGPS = True
+    
+    def __startGPSsending(self):
+        self.__GPSstartSending = True
+
+    def __stopGPSsending(self):
+        self.__GPSstopSending = True
+    
+    def __collectGPSData(self):
+        self.__GPScollectData = True
+        self.__wakeUp()
+
+    def ColData(self):
+        self.__collectGPSData()
+
+    def GetStats(self):
+        """Returns a dict with round trip histograms per AT command ('Commands'), the time jobs
+        waited in the send queues ('QueueWaits'), the time job classes waited for the scheduler
+        ('ClassWaits'), the learned timeout per AT command ('CommandTimeouts'), the time until the
+        module answered again after a timeout ('Recoveries'), queue lengths, bytes, errors, timeouts and restarts.
+        gsmHat.stats.ToPrometheus() formats it for Prometheus."""
+        stats = self.__stats.Snapshot()
+        stats['Counters']['BytesIn'] = self.__serReader.BytesRead
+        queues = (('SMS', self.__smsSendList), ('URL', self.__GPRScallUrlList),
+                  ('SMS received', self.__smsList), ('URL responses', self.__GPRSdataReceived))
+        stats['Queues'] = dict((name, len(messageQueue)) for name, messageQueue in queues)
+        stats['Dropped'] = dict((name, messageQueue.Dropped) for name, messageQueue in queues)
+        for sock in self.GetSockets():
+            stats['Queues']['Link %d' % sock.Link] = len(sock.SendQueue)
+            stats['Dropped']['Link %d received' % sock.Link] = sock.ReceiveQueue.Dropped
+        stats['CommandTimeouts'] = self.__timeouts.Snapshot()
+        if self.__journal != None:
+            for name, value in self.__journal.Counters.items():
+                stats['Counters']['Journal' + name] = value
+        return stats
+
+    def SetTraceLevel(self, Category, Level):
+        """Level (TraceOff, TraceCommands, TraceResponses or TraceData) for one category of the
+        wire trace ('SMS', 'GPS', 'GPRS', 'CALL', 'STATE') or None for all of them"""
+        self.__trace.SetLevel(Category, Level)
+
+    def DumpTrace(self, Path=None):
+        # Appends the wire trace to the trace file (or Path), returns the number of entries
+        # The trace is dumped automatically after errors, timeouts and restarts
+        return self.__trace.Dump('request', Path)
+
+    def __dumpTrace(self, reason, args=None):
+        if self.__trace.Enabled:
+            try:
+                self.__trace.Dump(reason % args if args != None else reason)
+            except OSError:
+                self.__logger.exception('Could not write the wire trace')
+
+    def close(self):
+        self.__stopWorking()
+        self.__disconnect()
+        if self.__journal != None:
+            self.__journal.Close()
+        self.__logger.info('Serial connection to %s closed', self.__port)
+        if self.__loggerFileHandle != None:
+            self.__logger.removeHandler(self.__loggerFileHandle)
+            self.__loggerFileHandle.close()
+            self.__loggerFileHandle = None
+    
+    def __registerResponseHandlers(self):
+        self.__dispatcher = ResponseDispatcher(self.__logger)
+        self.__dispatcher.Register('OK', self.__onOK)
+        self.__dispatcher.Register('ERROR', self.__onError)
+        self.__dispatcher.Register('+CME ERROR', self.__onCMEError)
+        self.__dispatcher.Register('+CMS ERROR', self.__onCMSError)
+        self.__dispatcher.Register('+CPMS', self.__onCPMS)
+        self.__dispatcher.Register('+CMGR', self.__onCMGR)
+        self.__dispatcher.Register('+CMGL', self.__onCMGL)
+        self.__dispatcher.Register('+CMGS', self.__onCMGS)
+        self.__dispatcher.Register('+SAPBR', self.__onSAPBR)
+        self.__dispatcher.Register('+CMGF', self.__onCMGF)
+        self.__dispatcher.Register('+CGNSPWR', self.__onCGNSPWR)
+        self.__dispatcher.Register('+HTTPREAD', self.__onHTTPREAD)
+        self.__dispatcher.Register('+HTTPACTION', self.__onHTTPACTION)
+        self.__dispatcher.Register('DOWNLOAD', self.__onDOWNLOAD)
+        self.__dispatcher.Register('>', self.__onPrompt)
+        self.__dispatcher.Register('+RECEIVE', self.__onRECEIVE)
+        self.__dispatcher.Register('+PDP', self.__onPDP)
+        self.__dispatcher.Register('+CMTI', self.__onCMTI)
+        self.__dispatcher.Register('+CGNSINF', self.__onCGNSINF)
+        self.__dispatcher.Register('$', self.__onNMEA)
+
+    def RegisterHandler(self, Prefix, Handler):
+        """Handler(Values) is called from the worker thread for every line starting with Prefix,
+        e.g. 'RING', '+CLIP' or '+CSQ'. Values is the text behind the colon. Exceptions of
+        Handler are logged."""
+        self.__dispatcher.Register(Prefix, Handler)
+
+    def UnregisterHandler(self, Prefix, Handler):
+        self.__dispatcher.Unregister(Prefix, Handler)
+
+    def __unlock(self):
+        # The final answer of the last command arrived
+        self.__writeLock = False
+        if self.__commandSentAt > 0:
+            roundTrip = time.monotonic() - self.__commandSentAt
+            self.__stats.AddCommand(self.__commandSentVerb, roundTrip)
+            self.__timeouts.Add(self.__commandSentVerb, roundTrip)
+            self.__commandSentAt = 0
+
+    def __onOK(self, values):
+        self.__unlock()
+
+    def __onError(self, values):
+        self.__unlock()
+        self.__commandError = CommandError(self.__lastCommandSentString.split('\n')[0])
+        self.__stats.Count('Errors')
+        self.__dumpTrace('ERROR after %s', self.__commandError.Command)
+        if self.__state == 71:
+            # Error after sending AT+HTTPINIT
+            # Lets terminate request before starting new one
+            self.__logger.info('Error after starting new HTTP Request.')
+            self.__state = 75
+
+    def __onCMEError(self, values):
+        self.__unlock()
+        self.__cmeErr = ResponseDispatcher.GetErrorCode(values)
+        self.__commandError = CommandError(self.__lastCommandSentString.split('\n')[0], '+CME ERROR', self.__cmeErr)
+        self.__stats.Count('CMEErrors')
+        self.__logger.info('Got CME ERROR: %s', values)
+        self.__dumpTrace('+CME ERROR %s after %s', (values, self.__commandError.Command))
+
+    def __onCMSError(self, values):
+        self.__unlock()
+        self.__cmsErr = ResponseDispatcher.GetErrorCode(values)
+        self.__commandError = CommandError(self.__lastCommandSentString.split('\n')[0], '+CMS ERROR', self.__cmsErr)
+        self.__stats.Count('CMSErrors')
+        self.__logger.info('Got CMS ERROR: %s', values)
+        self.__dumpTrace('+CMS ERROR %s after %s', (values, self.__commandError.Command))
+
+    def __onCPMS(self, values):
+        rawData = values.split(',')
+        self.__masSMSSpace = int(rawData[1])
+        numSMS = int(rawData[0])
+        # Stored (sent/unsent) messages stay in the storage, they are not listed again and again
+        if numSMS > 0 and numSMS != self.__smsKept:
+            self.__smsToRead = 1
+
+    def __onCMGR(self, values):
+        # read SMS content, in PDU mode the line after +CMGR: 0,"",23
+        self.__readRAW = 1
+        self.__smsToBuild = SMS() if self.SMSpduMode else parseSMSHeader(values)
+
+    def __onCMGL(self, values):
+        # First entry of the inbox list, the following lines are read raw
+        self.__readRAW = 3
+        self.__startListEntry(values)
+
+    def __startListEntry(self, values):
+        # Entry looks like: 1,"REC UNREAD","+491601234567","","20/10/21,12:00:00+08"
+        # or in PDU mode: 1,0,"",23 (0 = received unread, 1 = received read), the PDU follows
+        # Stored (sent/unsent) messages are skipped
+        self.__smsListed += 1
+        self.__smsListSlot = values.split(',')[0]
+        if self.SMSpduMode:
+            self.__smsToBuild = SMS() if values.split(',')[1] in ('0', '1') else None
+        elif ',"REC ' in values:
+            self.__smsToBuild = parseSMSHeader(values)
+        else:
+            self.__smsToBuild = None
+
+    def __finishListEntry(self):
+        if self.__smsToBuild != None:
+            newSMS = self.__smsToBuild
+            newSMS.Message = newSMS.Message.rstrip('\r\n')
+            self.__smsListBuffer.append(((self.__smsListSlot, newSMS.Sender, str(newSMS.Date), newSMS.Message), newSMS))
+            self.__smsToBuild = None
+
+    def __finishList(self):
+        # The list is complete: the messages, that were not stored by an earlier list, which was
+        # interrupted before AT+CMGD=1,1, are stored now
+        entries = self.__smsListBuffer
+        self.__smsListBuffer = []
+        for key, newSMS in entries:
+            self.__smsBulkCount += 1
+            if key in self.__smsDelivered:
+                continue
+            self.__smsDelivered.add(key)
+            try:
+                self.__storeReceivedSMS(newSMS)
+            except Exception:
+                self.__logger.exception('Could not store the message from %s', newSMS.Sender)
+
+    def __onCMGS(self, values):
+        # Message reference of the sent SMS
+        self.__smsReference = int(values)
+
+    def __onCMGF(self, values):
+        # Answer of AT+CMGF? during the warm start, 0 is PDU mode, 1 text mode
+        self.__warmSMSformat = values.strip()
+
+    def __onCGNSPWR(self, values):
+        # Answer of AT+CGNSPWR? during the warm start
+        self.__warmGPSpower = values.strip() == '1'
+
+    def __onSAPBR(self, values):
+        # check if IP is valid
+        # Return value looks like: +SAPBR: 1,3,"0.0.0.0"
+        rawData = values.split(',')
+        self.__GPRSIPaddress = rawData[2].replace('"', '')
+
+        if self.__GPRSIPaddress != '0.0.0.0':
+            self.__GPRSready = True
+        else:
+            self.__GPRSready = False
+
+    def __onHTTPREAD(self, values):
+        # Number of content bytes following this line, they are passed to __processBytes()
+        self.__GPRSbytesToRead = int(values)
+
+    def __onDOWNLOAD(self, values):
+        # AT+HTTPDATA waits for the request body, OK follows when all bytes arrived
+        data = self.__GPRSactiveJob[0].Data if self.__GPRSactiveJob != None else b''
+        self.__ser.write(data)
+        self.__stats.Count('BytesOut', len(data))
+        if self.__trace.Enabled:
+            self.__trace.Record(self.__traceCategory, TraceData, '>', '%d bytes', len(data))
+        self.__extendDeadline(self.__transferSeconds(len(data)))
+
+    def __extendDeadline(self, seconds=0):
+        # The command is still running (data is sent or received), it gets its budget again
+        if self.__writeLock:
+            self.__commandDeadline = time.monotonic() + self.__timeouts.Get(self.__commandSentVerb) + seconds
+
+    def __transferSeconds(self, length):
+        # Time the serial line needs for length bytes (10 bits per byte), at least one second
+        return length * 10 // self.__baudrate + 1
+
+    def __onHTTPACTION(self, values):
+        # Return value looks like: +HTTPACTION: 0,200,0
+        rawData = values.split(',')
+        self.__GPRSgotHttpResponse = True
+        if self.__GPRShttpActionAt > 0:
+            # Time from AT+HTTPACTION until the server answered
+            elapsed = time.monotonic() - self.__GPRShttpActionAt
+            self.__stats.AddCommand('+HTTPACTION', elapsed)
+            self.__timeouts.Add('+HTTPACTION', elapsed)
+            self.__GPRShttpActionAt = 0
+        if len(rawData) == 3:
+            requestMethod = int(rawData[0])
+            httpStatus = int(rawData[1])
+            recvDataLength = int(rawData[2])
+            self.__GPRShttpStatus = httpStatus
+            self.__GPRShttpLength = recvDataLength
+            if httpStatus == 200:  # Successful request
+                self.__GPRSnewDataReceived = True
+                if recvDataLength > 0 and self.__GPRSactiveJob != None and self.__GPRSactiveJob[0].Method != 'HEAD':
+                    self.__GPRSbody = ResponseBody(recvDataLength, self.__GPRSactiveJob[0].Sink)
+            elif httpStatus == 601:  # Successful request
+                self.__logger.info('HTTPACTION Network Error %d', httpStatus)
+            else:
+                self.__logger.info('HTTPACTION Unhandled Error %d', httpStatus)
+
+        else:
+            self.__logger.info('HTTPACTION return value is not expected: %s', values)
+
+    def __onPrompt(self, values):
+        # AT+CIPSEND waits for the data, the final answer is '<link>, SEND OK'
+        self.__socketPrompt = False
+        if self.__socketSending != None:
+            data = self.__socketSending[1]
+            self.__ser.write(data)
+            self.__stats.Count('BytesOut', len(data))
+            if self.__trace.Enabled:
+                self.__trace.Record(self.__traceCategory, TraceData, '>', '%d bytes', len(data))
+            self.__extendDeadline(self.__transferSeconds(len(data)))
+
+    def __onOtherLine(self, line):
+        # Lines without prefix: status of a link (e.g. '0, CONNECT OK') and the answer of AT+CIFSR
+        match = self.regexLinkStatus.match(line)
+        if match:
+            self.__onLinkStatus(int(match.group(1)), match.group(2))
+        elif self.__writeLock and self.__lastCommandSentString == 'AT+CIFSR' and self.regexIPaddress.match(line):
+            self.__CIPaddress = line
+            self.__unlock()
+
+    def __onLinkStatus(self, link, status):
+        sock = self.__sockets[link] if link < len(self.__sockets) else None
+        if status in ('SEND OK', 'SEND FAIL'):
+            # Final answer of AT+CIPSEND
+            self.__unlock()
+            sending, self.__socketSending = self.__socketSending, None
+            if sending == None:
+                return
+            sock, data, jobs = sending
+            if status == 'SEND OK':
+                sock.BytesSent += len(data)
+                for future, length in jobs:
+                    future.set_result(length)
+            else:
+                self.__commandError = CommandError('AT+CIPSEND=%d,%d' % (link, len(data)), status)
+                for future, length in jobs:
+                    future.set_exception(self.__commandError)
+                # Parts of the next message might be sent already, so the link can not be used anymore
+                sock.CloseRequested = True
+        elif sock == None:
+            self.__logger.info('Status of unknown link %d: %s', link, status)
+        elif status in ('CONNECT OK', 'ALREADY CONNECT'):
+            if status == 'ALREADY CONNECT' and self.__state == 106:
+                # Comes instead of OK
+                self.__unlock()
+            sock.State = 'CONNECTED'
+            if not sock.Connected.done():
+                sock.Connected.set_result(sock)
+        elif status == 'CLOSE OK':
+            # Final answer of AT+CIPCLOSE
+            self.__unlock()
+            self.__releaseSocket(sock, ConnectionError('Link %d was closed' % link))
+        elif status in ('CONNECT FAIL', 'CLOSED'):
+            self.__releaseSocket(sock, ConnectionError('Link %d: %s' % (link, status)))
+        else:
+            self.__logger.info('Unknown status of link %d: %s', link, status)
+
+    def __onRECEIVE(self, values):
+        # Data of a link follows, the line looks like: +RECEIVE,0,5:
+        link, length = values.rstrip(':').split(',')
+        link = int(link)
+        sock = self.__sockets[link] if link < len(self.__sockets) else None
+        self.__socketReceive = (sock, bytearray())
+        self.__GPRSbytesToRead = int(length)
+
+    def __onPDP(self, values):
+        # +PDP: DEACT, the network closed the GPRS context of the TCP/IP stack
+        self.__logger.info('GPRS context deactivated')
+        self.__CIPready = False
+        self.__releaseSockets(ConnectionError('GPRS context deactivated'))
+
+    def __releaseSocket(self, sock, exception):
+        # The link is gone: the open and queued sends fail, received data can still be read
+        sock.State = 'CLOSED'
+        if not sock.Connected.done():
+            sock.Connected.set_exception(exception)
+        job = sock.SendQueue.Get()
+        while job != None:
+            if not job[1].done():
+                job[1].set_exception(exception)
+            job = sock.SendQueue.Get()
+        sock.SendOffset = 0
+        sock.ReceiveQueue.Close()
+        if self.__socketSending != None and self.__socketSending[0] is sock:
+            for future, length in self.__socketSending[2]:
+                future.set_exception(exception)
+            self.__socketSending = None
+        if self.__sockets[sock.Link] is sock:
+            self.__sockets[sock.Link] = None
+
+    def __releaseSockets(self, exception):
+        for sock in self.GetSockets():
+            self.__releaseSocket(sock, exception)
+
+    def __nextSocketJob(self):
+        # Finds the next socket job for the idle state, the links take turns
+        count = len(self.__sockets)
+        for i in range(count):
+            link = (self.__socketNext + i) % count
+            sock = self.__sockets[link]
+            if sock == None or sock.State == 'CLOSING':
+                continue
+            if sock.State == 'CONNECTED' and len(sock.SendQueue) > 0:
+                nextState = 107
+            elif sock.CloseRequested:
+                if sock.State == 'OPENING':
+                    self.__releaseSocket(sock, ConnectionError('Link %d was closed' % link))
+                    continue
+                nextState = 109
+            elif sock.State == 'OPENING':
+                nextState = 105 if self.__CIPready else 100
+            else:
+                continue
+            self.__socketActive = sock
+            self.__socketState = nextState
+            return True
+        return False
+
+    def __startSocketJob(self):
+        self.__socketNext = self.__socketActive.Link + 1
+        return self.__socketState
+
+    def __failOpeningSockets(self, exception):
+        for sock in self.GetSockets():
+            if sock.State == 'OPENING':
+                self.__releaseSocket(sock, exception)
+
+    def __buildSocketData(self, sock):
+        # Combines queued TCP messages up to Socket.cMaxSendSize, returns the data
+        # and the futures of the messages that are complete with it
+        data = bytearray()
+        jobs = []
+        while len(data) < sock.cMaxSendSize:
+            job = sock.SendQueue.Peek()
+            if job == None:
+                break
+            message, future = job[:2]
+            if sock.SendOffset == 0 and not future.set_running_or_notify_cancel():
+                sock.SendQueue.Get()
+                continue
+            part = message[sock.SendOffset:sock.SendOffset + sock.cMaxSendSize - len(data)]
+            data += part
+            sock.SendOffset += len(part)
+            if sock.SendOffset < len(message):
+                break
+            sock.SendQueue.Get()
+            sock.SendOffset = 0
+            jobs.append((future, len(message)))
+            if sock.Protocol == 'UDP':
+                break
+        return bytes(data), jobs
+
+    # unannounced data reception below (e.g. new SMS oder phone call)
+    def __onCMTI(self, values):
+        self.__logger.info('Received new SMS')
+        rawData = values.split(',')
+        storage = rawData[0]
+        numSMS = int(rawData[1])
+        self.__smsToRead = numSMS
+
+    # GPS Data coming here
+    def __onCGNSINF(self, values):
+        newGPS = parseCGNSINF(values)
+        if newGPS != None:
+            self.__newGPSPosition(newGPS)
+
+    def __finishUrlJob(self):
+        if self.__GPRSactiveJob != None:
+            request, future = self.__GPRSactiveJob[:2]
+            response = UrlResponse()
+            response.Url = request.Url
+            response.Status = self.__GPRShttpStatus
+            response.Length = self.__GPRShttpLength
+            if self.__GPRSbody != None:
+                self.__GPRSbody.Finish()
+                response.Content = self.__GPRSbody.Content
+            elif request.Sink == None:
+                response.Content = bytearray()
+            if self.__GPRSnewDataReceived and request.Sink == None:
+                # Successful responses are also kept for UrlResponse_read()
+                if self.__GPRSdataReceived.Full():
+                    self.__logger.warning('URL response queue is full, dropping the oldest response')
+                self.__GPRSdataReceived.Put(response.Data)
+            future.set_result(response)
+            self.__stats.Count('UrlCalls')
+            self.__completeJob(self.__GPRSactiveJob)
+            self.__GPRSactiveJob = None
+        self.__GPRSbody = None
+
+    def __failUrlJob(self, exception):
+        if self.__GPRSactiveJob != None:
+            self.__logger.info('URL call failed: %s', exception)
+            self.__GPRSactiveJob[1].set_exception(exception)
+            self.__stats.Count('UrlFailed')
+            self.__completeJob(self.__GPRSactiveJob)
+            self.__GPRSactiveJob = None
+        self.__GPRSbody = None
+
+    def __startJob(self, jobList, name):
+        # Returns the next job of the list, that was not cancelled by the application
+        job = jobList.Peek()
+        while job != None:
+            future = job[1]
+            if future.running():
+                return job
+            if future.set_running_or_notify_cancel():
+                self.__stats.AddWait(name, time.monotonic() - job[2])
+                return job
+            self.__completeJob(jobList.Get())
+            job = jobList.Peek()
+        return None
+
+    def __newGPSPosition(self, newGPS):
+        self.__GPSactualData = newGPS
+        self.__GPStrack.Append(newGPS)
+        for listener in self.__GPSlisteners:
+            try:
+                listener(newGPS)
+            except Exception:
+                self.__logger.exception('GPS listener failed')
+
+    def __onNMEA(self, sentence):
+        newGPS = self.__NMEAparser.Parse(sentence)
+        if newGPS != None:
+            self.__newGPSPosition(newGPS)
+
+    def __smsFormat(self):
+        # Value of AT+CMGF
+        return '0' if self.SMSpduMode else '1'
+
+    def __storeReceivedSMS(self, newSMS):
+        if self.SMSpduMode:
+            # Message is the PDU in hex, parts of a long message wait for the others
+            newSMS = self.__decodeReceivedPDU(newSMS.Message)
+            if newSMS == None:
+                return
+        self.__logger.info('New Message from %s was received', newSMS.Sender)
+        self.__stats.Count('SMSreceived')
+        if self.__smsList.Full():
+            self.__logger.warning('SMS queue is full, dropping the oldest message')
+        self.__smsList.Put(newSMS)
+
+    def __encodeSMS(self, job):
+        # PDUs of the SMS job in PDU mode, False if the message can not be sent
+        if job is self.__smsPartsJob:
+            # Started again after a recovery
+            return True
+        retSMS, future = job[:2]
+        try:
+            self.__smsParts = EncodeSubmit(retSMS.Receiver, retSMS.Message, self.__concatReference)
+        except ValueError as e:
+            self.__logger.info('Message to %s could not be encoded: %s', retSMS.Receiver, e)
+            self.__stats.Count('SMSfailed')
+            future.set_exception(e)
+            self.__completeJob(self.__smsSendList.Get())
+            return False
+        if len(self.__smsParts) > 1:
+            self.__concatReference = (self.__concatReference + 1) % 256
+        self.__smsPartsJob = job
+        self.__smsReferences = []
+        return True
+
+    def __finishSMS(self):
+        job = self.__smsSendList.Get()
+        retSMS, future = job[:2]
+        if self.__commandError != None:
+            # Parts of a long message, that went out already, can not be called back
+            self.__logger.info('Message to %s could not be sent: %s', retSMS.Receiver, self.__commandError)
+            self.__stats.Count('SMSfailed')
+            future.set_exception(self.__commandError)
+        else:
+            self.__logger.info('Message to %s successfully sent', retSMS.Receiver)
+            self.__stats.Count('SMSsent')
+            if self.SMSpduMode and len(self.__smsParts) > 1:
+                # Message references of all parts
+                self.__stats.Count('SMSparts')
+                future.set_result(list(self.__smsReferences))
+            else:
+                future.set_result(self.__smsReference)
+        self.__smsPartsJob = None
+        self.__completeJob(job)
+        self.__state = 97
+
+    def __decodeReceivedPDU(self, pdu):
+        # SMS object of the PDU, None for a broken PDU or a part of a message that is not complete
+        try:
+            part = DecodePDU(pdu)
+        except (ValueError, IndexError) as e:
+            self.__logger.warning('Received PDU could not be decoded (%s): %s', e, pdu)
+            return None
+        message = self.__concat.Add(part)
+        if message == None:
+            self.__logger.debug('Part %d of %d from %s was received', part.Part, part.Parts, part.Number)
+            return None
+        return toSMS(message)
+
+    def __storeExpiredParts(self):
+        # Long messages, whose missing parts did not come within cConcatMaxAge
+        for message in self.__concat.Expire():
+            self.__logger.warning('Only %d of %d parts of the message from %s were received',
+                                  message.Part, message.Parts, message.Number)
+            self.__smsList.Put(toSMS(message))
+            self.__stats.Count('SMSreceived')
+
+    def __processData(self):
+        if self.__serData != '':
+            if self.__readRAW > 0 and self.__serData[:1] == '$' and NMEAParser.CheckSum(self.__serData.rstrip('\r\n')):
+                # NMEA sentence of AT+CGNSTST=1 between the lines of a SMS
+                if self.__trace.Enabled:
+                    self.__trace.Record(responseCategories['$'], TraceResponses, '<', self.__serData)
+                self.__dispatcher.Dispatch(self.__serData)
+            elif self.__readRAW > 0:
+                if self.__trace.Enabled:
+                    self.__trace.Record(self.__traceCategory, TraceData, '<', self.__serData)
+                # A long list is still coming, every line gives the command its budget again
+                self.__extendDeadline()
+                try:
+                    self.__processRawLine()
+                except Exception:
+                    # A malformed entry is dropped, the command still ends with its OK
+                    self.__logger.exception('Could not handle the line %r', self.__serData)
+                    self.__smsToBuild = None
+                    if self.__serData == 'OK\r\n':
+                        if self.__readRAW == 3:
+                            self.__finishList()
+                        self.__readRAW = 0
+                        self.__unlock()
+            else:
+                if self.__trace.Enabled:
+                    category = responseCategories.get(ResponseDispatcher.GetPrefix(self.__serData), self.__traceCategory)
+                    self.__trace.Record(category, TraceResponses, '<', self.__serData)
+                if not self.__dispatcher.Dispatch(self.__serData):
+                    self.__onOtherLine(self.__serData)
+
+            self.__serData = ''
+
+    def __processRawLine(self):
+        # Lines of +CMGR (__readRAW 1) and +CMGL (__readRAW 3)
+        if self.__readRAW == 1:
+            # Handle SMS
+            if self.__serData == 'OK\r\n':
+                self.__smsToBuild.Message = self.__smsToBuild.Message.rstrip('\r\n')
+                self.__storeReceivedSMS(self.__smsToBuild)
+                self.__readRAW = 0
+                self.__unlock()
+            else:
+                self.__smsToBuild.Message = self.__smsToBuild.Message + self.__serData
+        elif self.__readRAW == 3:
+            # Handle SMS list, every entry starts with its own +CMGL header
+            if self.__serData == 'OK\r\n':
+                self.__finishListEntry()
+                self.__finishList()
+                self.__readRAW = 0
+                self.__unlock()
+            elif self.__serData.startswith('+CMGL: '):
+                self.__finishListEntry()
+                self.__startListEntry(self.__serData[7:].rstrip('\r\n'))
+            elif self.__smsToBuild != None:
+                self.__smsToBuild.Message = self.__smsToBuild.Message + self.__serData
+
+    def __processBytes(self, data):
+        # HTTP content announced by +HTTPREAD or data of a link announced by +RECEIVE
+        self.__GPRSbytesToRead -= len(data)
+        if self.__trace.Enabled:
+            self.__trace.Record(self.__traceCategory, TraceData, '<', '%d bytes', len(data))
+        if self.__socketReceive != None:
+            sock, received = self.__socketReceive
+            received += data
+            if self.__GPRSbytesToRead <= 0:
+                self.__socketReceive = None
+                if sock != None:
+                    sock.BytesReceived += len(received)
+                    self.__stats.Count('SocketReceives')
+                    if sock.ReceiveQueue.Full():
+                        self.__logger.warning('Receive queue of link %d is full, dropping the oldest data', sock.Link)
+                    sock.ReceiveQueue.Put(bytes(received))
+            return
+        if self.__GPRSbody != None:
+            try:
+                self.__GPRSbody.Write(data)
+            except Exception as e:
+                # The sink of the application failed, the rest of the window is ignored
+                self.__logger.exception('Writing the URL response failed')
+                self.__failUrlJob(e)
+        # Data is still coming, so the command did not time out
+        self.__extendDeadline()
+
+    def __recover(self):
+        # A command timed out: AT/ATE0 up to cRecoveryProbes times, then AT+CFUN=1,1 and then the power key
+        self.__writeLock = False
+        self.__commandDeadline = 0
+        if self.__recoveryStep == 0:
+            # Time to recovery counts from the command that got no answer
+            self.__recoveryStep = 1
+            self.__recoveryProbes = 0
+            self.__recoveryStartedAt = self.__commandSentAt if self.__commandSentAt > 0 else time.monotonic()
+            self.__interruptJobs()
+            self.__state = 90
+        elif self.__recoveryProbes < self.cRecoveryProbes:
+            self.__state = 90
+        elif self.__recoveryStep == 1:
+            self.__recoveryStep = 2
+            self.__state = 93
+        else:
+            self.__recoveryStep = 3
+            self.__state = 95
+        self.__commandSentAt = 0
+
+    def __interruptJobs(self):
+        # The answer of the running command is lost. Its SMS or URL job is started again after the
+        # recovery, socket data might be sent partly, so it fails.
+        if self.__GPRSactiveJob != None:
+            self.__GPRScallUrlList.PutFront(self.__GPRSactiveJob)
+            self.__GPRSactiveJob = None
+        self.__GPRSwaitForData = False
+        self.__GPRSgotHttpResponse = False
+        self.__GPRSbody = None
+        self.__GPRSbytesToRead = 0
+        self.__GPRShttpActionAt = 0
+        self.__GPRShttpSession = False
+        self.__readRAW = 0
+        self.__smsToBuild = None
+        if 20 <= self.__state <= 25:
+            # Read the inbox again
+            self.__smsToRead = max(self.__smsToRead, 1)
+        if 40 <= self.__state <= 42:
+            self.__numberToCall = ''
+        self.__socketPrompt = False
+        self.__socketReceive = None
+        if self.__socketSending != None:
+            sock, data, jobs = self.__socketSending
+            for future, length in jobs:
+                future.set_exception(TimeoutError('AT+CIPSEND=%d,%d timed out' % (sock.Link, len(data))))
+            sock.CloseRequested = True
+            self.__socketSending = None
+
+    def __resetModuleState(self, reason):
+        # The module starts from scratch after AT+CFUN=1,1 or the power key
+        self.__logger.error('%s of the gsm module', reason)
+        self.__dumpTrace('%s in state %d', (reason, self.__state))
+        self.__GPRSready = False
+        self.__GPRSwaittimeStatus = 0
+        self.__CIPready = False
+        self.__releaseSockets(ConnectionError('The module was restarted'))
+        self.__writeLock = False
+        self.__commandSentAt = 0
+        self.__commandDeadline = 0
+
+    def __waitForUnlock(self):
+        if self.__commandDeadline > 0 and time.monotonic() > self.__commandDeadline:
+            # Timeout
+            self.__logger.error('Timeout during data reception')
+            self.__stats.Count('Timeouts')
+            self.__timeouts.Backoff(self.__commandSentVerb)
+            self.__logger.info('Command sent: %s', self.__lastCommandSentString)
+            self.__logger.info('Actual state of programme: %d', self.__state)
+            self.__dumpTrace('Timeout after %s in state %d', (self.__lastCommandSentString, self.__state))
+
+            self.__recover()
+            return False
+
+        if self.__writeLock:
+            return False
+        else:
+            self.__commandDeadline = 0
+            return True
+
+    def __isReadingRaw(self):
+        return self.__readRAW > 0
+
+    def __httpBytesToRead(self):
+        return self.__GPRSbytesToRead
+
+    def __isPromptExpected(self):
+        return self.__socketPrompt
+
+    def __sendHttpAction(self):
+        if self.__sendToHat('AT+HTTPACTION=%d' % UrlRequest.Methods[self.__GPRSactiveJob[0].Method]):
+            self.__GPRShttpActionAt = self.__commandSentAt
+            self.__state = 76
+
+    def __workerThread(self):
+        self.__logger.info('Worker started')
+        self.__waitTime = 0
+
+        while self.__working:
+            # Check for incoming lines
+            for line in self.__serReader.ReadLines(self.__isReadingRaw, self.__httpBytesToRead, self.__isPromptExpected):
+                if type(line) is bytes:
+                    self.__processBytes(line)
+                else:
+                    self.__serData = line
+                    self.__processData()
+
+            # Statemachine
+            # Milliseconds of the monotonic clock, the timers of the states do not jump with the system time
+            actTime = int(round(time.monotonic() * 1000))
+            self.__actTime = actTime
+            lastState = self.__state
+            if self.__state == 1:
+                if self.cWarmStart:
+                    # One round trip tells, what the module kept from the last run
+                    self.__warmSMSformat = ''
+                    self.__warmGPSpower = False
+                    if self.__sendToHat('AT+CMGF?;+CPMS="SM";+CGNSPWR?;+SAPBR=2,1'):
+                        self.__state = 4
+                elif self.__sendToHat('AT+CMGF=' + self.__smsFormat()):
+                    self.__configureGPS(True)
+                    self.__state = 2
+            elif self.__state == 4:
+                if self.__waitForUnlock():
+                    if self.__commandError != None:
+                        # The module does not know one of the queries, so everything is configured
+                        if self.__sendToHat('AT+CMGF=' + self.__smsFormat()):
+                            self.__configureGPS(True)
+                            self.__state = 2
+                    else:
+                        self.__logger.info('Warm start: SMS format %s, GPS power %s, bearer %s',
+                                           self.__warmSMSformat, self.__warmGPSpower, self.__GPRSIPaddress or 'down')
+                        self.__configureGPS(not self.__warmGPSpower)
+                        # The inbox and the bearer were checked just now
+                        self.__SMSwaittime = actTime + self.cSMSwaittime
+                        self.__GPRSwaittimeStatus = actTime + self.cGPRSstatusWaittime
+                        if self.__warmSMSformat == self.__smsFormat():
+                            self.__state = 97
+                        elif self.__sendToHat('AT+CMGF=' + self.__smsFormat()):
+                            self.__state = 3
+            elif self.__state == 2:
+                if self.__waitForUnlock():
+                    if self.__sendToHat('AT+CPMS="SM"'):
+                        self.__state = 3
+            elif self.__state == 3:
+                if self.__waitForUnlock():
+                    self.__state = 97
+            elif self.__state == 20:
+                # Read SMS, +CMTI might change __smsToRead until it is deleted
+                self.__smsReadSlot = self.__smsToRead
+                if self.__sendToHat('AT+CMGR='+str(self.__smsReadSlot)):
+                    self.__state = 21
+            elif self.__state == 21:
+                if self.__waitForUnlock():
+                    if self.__smsToBuild == None:
+                        # An der Stelle self.__smsToRead gab es keine SMS zu lesen
+                        pass
+                    else:
+                        # Es gab eine neue SMS
+                        self.__smsToBuild = None                        
+
+                    # Lösche die behandelte SMS an der Stelle
+                    if self.__sendToHat('AT+CMGD='+str(self.__smsReadSlot)):
+                        self.__state = 22
+
+            elif self.__state == 22:
+                if self.__waitForUnlock():
+                    if(self.__smsToRead == 20):
+                        self.__smsToRead = 0
+                    else:
+                        self.__smsToRead = self.__smsToRead + 1
+
+                    self.__storeExpiredParts()
+                    self.__state = 97
+
+            elif self.__state == 23:
+                # Read all SMS at once
+                self.__smsBulkCount = 0
+                self.__smsListed = 0
+                self.__smsListBuffer = []
+                if self.__sendToHat('AT+CMGL=4' if self.SMSpduMode else 'AT+CMGL="ALL"'):
+                    # +CMTI arriving from now on need another read
+                    self.__smsToRead = 0
+                    self.__state = 24
+
+            elif self.__state == 24:
+                if self.__waitForUnlock():
+                    self.__storeExpiredParts()
+                    if self.__commandError == None:
+                        # The received ones are deleted, the stored ones stay
+                        self.__smsKept = self.__smsListed - self.__smsBulkCount
+                    if self.__smsBulkCount > 0:
+                        # Delete all read messages at once, unread ones received in the meantime stay
+                        if self.__sendToHat('AT+CMGD=1,1'):
+                            self.__state = 25
+                    else:
+                        self.__state = 97
+
+            elif self.__state == 25:
+                if self.__waitForUnlock():
+                    if self.__commandError == None:
+                        self.__logger.debug('%d messages read and deleted', self.__smsBulkCount)
+                        self.__smsDelivered.clear()
+                    self.__state = 97
+
+            elif self.__state == 30:
+                # SMS versenden
+                job = self.__startJob(self.__smsSendList, 'SMS')
+                if job == None:
+                    self.__state = 97
+                elif self.SMSpduMode and not self.__encodeSMS(job):
+                    self.__state = 97
+                else:
+                    retSMS = job[0]
+                    if self.SMSpduMode:
+                        # The parts of a long message go out one after the other, the ones sent
+                        # already are not sent again after a recovery
+                        length, pdu = self.__smsParts[len(self.__smsReferences)]
+                        messageString = 'AT+CMGS=%d\n%s\x1A' % (length, pdu)
+                    else:
+                        messageString = 'AT+CMGS="' + retSMS.Receiver + '"\n' + retSMS.Message + '\x1A'
+                    self.__smsReference = None
+                    if self.__sendToHat(messageString):
+                        self.__state = 31
+
+            elif self.__state == 31:
+                if self.__waitForUnlock():
+                    if self.SMSpduMode and self.__commandError == None:
+                        self.__smsReferences.append(self.__smsReference)
+                    if self.SMSpduMode and self.__commandError == None and len(self.__smsReferences) < len(self.__smsParts):
+                        # Next part without a round through the scheduler
+                        self.__stats.Count('SMSparts')
+                        self.__state = 30
+                    else:
+                        self.__finishSMS()
+
+            elif self.__state == 40:
+                if self.__sendToHat('ATD' + self.__numberToCall + ';'):
+                    self.__state = 41
+
+            elif self.__state == 41:
+                if self.__waitForUnlock():
+                    self.__waitTime = actTime + self.__callTimeout * 1000
+                    self.__state = 42
+
+            elif self.__state == 42:
+                    # Wait x Seconds
+                if actTime > self.__waitTime or self.__sendHangUp == True:
+                    self.__numberToCall = ''
+                    self.__sendHangUp = True
+                    self.__state = 97
+            
+            elif self.__state == 43:
+                if self.__sendToHat('AT+CHUP'):
+                    self.__state = 44
+
+            elif self.__state == 44:
+                if self.__waitForUnlock():
+                    self.__sendHangUp = False
+                    self.__state = 97
+
+            elif self.__state == 50:
+                if self.__sendToHat('AT+CGNSPWR=1'):
+                    self.__state = 51
+
+            elif self.__state == 51:
+                if self.__waitForUnlock():
+                    self.__logger.debug('GPS powered on')
+                    self.__startGPS = False
+                    self.__state = 97
+                
+            elif self.__state == 52:
+                if self.__sendToHat('AT+CGNSTST=1'):
+                    self.__state = 55
+                    self.__logger.debug('GPS start sending')
+                    self.__GPSstartSending = False
+
+            elif self.__state == 53:
+                if self.__sendToHat('AT+CGNSTST=0'):
+                    self.__state = 55
+                    self.__GPSstopSending = False
+
+            elif self.__state == 54:
+                if self.__sendToHat('AT+CGNSINF'):
+                    self.__state = 55
+                    self.__GPScollectData = False
+
+            elif self.__state == 55:
+                if self.__waitForUnlock():
+                    self.__state = 97
+            
+            elif self.__state == 60:
+                if self.__sendToHat('AT+SAPBR=2,1'):
+                    self.__state = 61
+
+            elif self.__state == 61:
+                if self.__waitForUnlock():
+                    tempState = 97
+                    if self.__GPRSready == True:
+                        pass
+                    else:
+                        if self.__GPRSuserAPN != None and self.__GPRSuserUSER != None and self.__GPRSuserPWD != None:
+                            # try to connect
+                            tempState = 62
+
+                    self.__state = tempState
+
+            elif self.__state == 62:
+                if self.__sendToHat('AT+SAPBR=3,1,"Contype","GPRS"'):
+                    self.__state = self.__state + 1
+
+            elif self.__state == 63:
+                if self.__waitForUnlock():
+                    if self.__sendToHat('AT+SAPBR=3,1,"APN","' + self.__GPRSuserAPN + '"'):
+                        self.__state = self.__state + 1
+            
+            elif self.__state == 64:
+                if self.__waitForUnlock():
+                    if self.__sendToHat('AT+SAPBR=3,1,"USER","' + self.__GPRSuserUSER + '"'):
+                        self.__state = self.__state + 1
+            
+            elif self.__state == 65:
+                if self.__waitForUnlock():
+                    if self.__sendToHat('AT+SAPBR=3,1,"PWD","' + self.__GPRSuserPWD + '"'):
+                        self.__state = self.__state + 1
+            
+            elif self.__state == 66:
+                if self.__waitForUnlock():
+                    if self.__sendToHat('AT+SAPBR=1,1'):
+                        self.__state = self.__state + 1
+            
+            elif self.__state == 67:
+                if self.__waitForUnlock():
+                    self.__state = 97
+
+            elif self.__state == 70:
+                # Call the first URL in List
+                if self.__sendToHat('AT+HTTPINIT'):
+                    self.__state = self.__state + 1
+
+            elif self.__state == 71:
+                if self.__waitForUnlock():
+                    if self.__sendToHat('AT+HTTPPARA="CID",1'):
+                        self.__state = self.__state + 1
+
+            elif self.__state == 72:
+                if self.__waitForUnlock():
+                    job = self.__startJob(self.__GPRScallUrlList, 'URL')
+                    if job == None:
+                        # All calls were cancelled
+                        self.__state = 75
+                    elif self.__sendToHat('AT+HTTPPARA="URL","' + job[0].Url + '"'):
+                        self.__GPRScallUrlList.Get()
+                        self.__GPRSactiveJob = job
+                        self.__GPRSwaitForData = True
+                        self.__GPRSnewDataReceived = False
+                        self.__GPRSgotHttpResponse = False
+                        self.__GPRShttpStatus = 0
+                        self.__GPRShttpLength = 0
+                        self.__GPRSbody = None
+                        self.__state = self.__state + 1
+            
+            elif self.__state == 73:
+                if self.__waitForUnlock():
+                    if self.__commandError != None:
+                        self.__failUrlJob(self.__commandError)
+                        self.__state = 75
+                    elif self.__GPRSactiveJob[0].ContentType != None:
+                        if self.__sendToHat('AT+HTTPPARA="CONTENT","' + self.__GPRSactiveJob[0].ContentType + '"'):
+                            self.__state = 78
+                    else:
+                        self.__state = 78
+            
+            elif self.__state == 74:
+                # Read the next window of the response
+                if self.__waitForUnlock() and self.__pauseGPSstream():
+                    self.__GPRSreadOffset = self.__GPRSbody.Offset
+                    if self.__sendToHat('AT+HTTPREAD=%d,%d' % (self.__GPRSreadOffset,
+                                                                min(self.cHTTPreadWindow, self.__GPRSbody.Remaining()))):
+                        self.__state = 77
+            
+            elif self.__state == 75:
+                # Close HTTP Request
+                if self.__waitForUnlock():
+                    self.__finishUrlJob()
+                    if (self.__commandError == None and self.__GPRSgotHttpResponse and self.__GPRShttpStatus < 600
+                            and len(self.__GPRScallUrlList) > 0):
+                        # Keep the HTTP service initialized, the next URL call only needs a new URL parameter
+                        self.__GPRShttpSession = True
+                        self.__state = 97
+                        self.__GPRSwaitForData = False
+                        self.__GPRSnewDataReceived = False
+                    elif self.__sendToHat('AT+HTTPTERM'):
+                        self.__GPRShttpSession = False
+                        self.__state = 97
+                        self.__GPRSwaitForData = False
+                        self.__GPRSnewDataReceived = False
+
+            elif self.__state == 76:
+                # Wait until the request was accepted, the result comes later with +HTTPACTION
+                if self.__waitForUnlock():
+                    if self.__commandError != None:
+                        self.__failUrlJob(self.__commandError)
+                        self.__state = 75
+                    else:
+                        self.__state = 97
+
+            elif self.__state == 77:
+                if self.__waitForUnlock():
+                    self.__GPRSbytesToRead = 0
+                    if self.__commandError != None:
+                        self.__failUrlJob(self.__commandError)
+                        self.__state = 75
+                    elif self.__GPRSbody == None or self.__GPRSbody.Remaining() == 0 or self.__GPRSbody.Offset == self.__GPRSreadOffset:
+                        # Complete, failed or the server sent less than announced
+                        self.__state = 75
+                    else:
+                        # Other jobs may run between two windows
+                        self.__state = 97
+
+            elif self.__state == 78:
+                # Upload the request body
+                if self.__waitForUnlock():
+                    request = self.__GPRSactiveJob[0]
+                    if self.__commandError != None:
+                        self.__failUrlJob(self.__commandError)
+                        self.__state = 75
+                    elif request.Data != None:
+                        # The hat waits up to 120 seconds for the data
+                        waitMs = min(120000, 1000 * (self.__transferSeconds(len(request.Data)) + self.timeoutSerial))
+                        if self.__sendToHat('AT+HTTPDATA=%d,%d' % (len(request.Data), waitMs)):
+                            self.__state = 79
+                    else:
+                        self.__sendHttpAction()
+
+            elif self.__state == 79:
+                # The body was sent after DOWNLOAD
+                if self.__waitForUnlock():
+                    if self.__commandError != None:
+                        self.__failUrlJob(self.__commandError)
+                        self.__state = 75
+                    else:
+                        self.__sendHttpAction()
+
+            elif self.__state == 90:
+                # Recovery after a timeout, see __recover()
+                if self.__sendToHat('AT'):
+                    self.__recoveryProbes += 1
+                    self.__stats.Count('Resyncs')
+                    self.__state = 91
+
+            elif self.__state == 91:
+                if self.__waitForUnlock():
+                    if self.__sendToHat('ATE0'):
+                        self.__state = 92
+
+            elif self.__state == 92:
+                if self.__waitForUnlock():
+                    seconds = time.monotonic() - self.__recoveryStartedAt
+                    step = ('AT', 'AT+CFUN', 'Power key')[self.__recoveryStep - 1]
+                    self.__logger.info('Gsm module answers again after %.1f s (%s)', seconds, step)
+                    self.__stats.AddRecovery(step, seconds)
+                    # The module keeps its settings after AT/ATE0, it starts from scratch after a reset
+                    self.__state = 97 if self.__recoveryStep == 1 else 1
+                    self.__recoveryStep = 0
+
+            elif self.__state == 93:
+                # Soft reset, the OK might get lost
+                if self.__sendToHat('AT+CFUN=1,1'):
+                    self.__stats.Count('SoftResets')
+                    self.__resetModuleState('Soft reset')
+                    self.__recoveryWaittime = actTime + self.cSoftResetTime
+                    self.__state = 94
+
+            elif self.__state == 94:
+                # Wait until the module is up again, then AT/ATE0
+                if actTime > self.__recoveryWaittime:
+                    self.__recoveryWaittime = 0
+                    self.__recoveryProbes = 0
+                    self.__state = 90
+
+            elif self.__state == 95:
+                self.__stats.Count('Restarts')
+                self.__resetModuleState('Restart with the power key')
+                self.__pressPowerKey()
+                self.__recoveryWaittime = actTime + self.cPowerKeyTime
+                self.__state = 96
+
+            elif self.__state == 96:
+                if actTime > self.__recoveryWaittime:
+                    self.__releasePowerKey()
+                    self.__recoveryWaittime = actTime + self.cPowerOnTime
+                    self.__state = 94
+
+            elif self.__state == 97:
+                # Idle: the scheduler picks the next job class (see SetSchedule())
+                jobClass, waited = self.__scheduler.Next(time.monotonic())
+                if jobClass != None:
+                    self.__stats.AddClassWait(jobClass.Name, waited)
+                    self.__state = jobClass.Start()
+
+                # Wait x Seconds
+                elif actTime > self.__waitTime:
+                    if self.__nextState > 0:
+                        self.__state = self.__nextState
+                        self.__nextState = 0
+            elif self.__state == 100:
+                # Start the TCP/IP stack with multiple links
+                if self.__waitForUnlock():
+                    if self.__sendToHat('AT+CIPMUX=1'):
+                        self.__state = self.__state + 1
+
+            elif self.__state == 101:
+                # Errors of AT+CIPMUX, AT+CSTT and AT+CIICR are ignored, they come when the stack is running already
+                if self.__waitForUnlock():
+                    if self.__GPRSuserAPN == None or self.__GPRSuserUSER == None or self.__GPRSuserPWD == None:
+                        self.__failOpeningSockets(CommandError('AT+CSTT', 'No GPRS connection'))
+                        self.__state = 97
+                    elif self.__sendToHat('AT+CSTT="%s","%s","%s"' % (self.__GPRSuserAPN, self.__GPRSuserUSER, self.__GPRSuserPWD)):
+                        self.__state = self.__state + 1
+
+            elif self.__state == 102:
+                if self.__waitForUnlock():
+                    if self.__sendToHat('AT+CIICR'):
+                        self.__state = self.__state + 1
+
+            elif self.__state == 103:
+                if self.__waitForUnlock():
+                    if self.__sendToHat('AT+CIFSR'):
+                        self.__state = self.__state + 1
+
+            elif self.__state == 104:
+                if self.__waitForUnlock():
+                    if self.__commandError != None:
+                        self.__failOpeningSockets(self.__commandError)
+                    else:
+                        self.__logger.info('TCP/IP stack is up, IP address %s', self.__CIPaddress)
+                        self.__CIPready = True
+                    self.__state = 97
+
+            elif self.__state == 105:
+                # Connect a link, '<link>, CONNECT OK' comes later
+                if self.__waitForUnlock() and self.__pauseGPSstream():
+                    sock = self.__socketActive
+                    if self.__sendToHat('AT+CIPSTART=%d,"%s","%s",%d' % (sock.Link, sock.Protocol, sock.Host, sock.Port)):
+                        sock.State = 'CONNECTING'
+                        self.__state = self.__state + 1
+
+            elif self.__state == 106:
+                if self.__waitForUnlock():
+                    sock = self.__socketActive
+                    if self.__commandError != None and sock.State == 'CONNECTING':
+                        self.__releaseSocket(sock, self.__commandError)
+                    self.__state = 97
+
+            elif self.__state == 107:
+                # Send queued data, it is written after the prompt
+                if self.__waitForUnlock():
+                    sock = self.__socketActive
+                    data, jobs = self.__buildSocketData(sock)
+                    if not data:
+                        # All messages were cancelled
+                        self.__state = 97
+                    elif self.__sendToHat('AT+CIPSEND=%d,%d' % (sock.Link, len(data))):
+                        self.__socketSending = (sock, data, jobs)
+                        self.__socketPrompt = True
+                        self.__stats.Count('SocketSends')
+                        self.__state = self.__state + 1
+
+            elif self.__state == 108:
+                if self.__waitForUnlock():
+                    self.__socketPrompt = False
+                    if self.__commandError != None and self.__socketSending != None:
+                        # ERROR instead of the prompt
+                        for future, length in self.__socketSending[2]:
+                            future.set_exception(self.__commandError)
+                        self.__socketSending[0].CloseRequested = True
+                        self.__socketSending = None
+                    self.__state = 97
+
+            elif self.__state == 109:
+                # Close a link, the answer is '<link>, CLOSE OK'
+                if self.__waitForUnlock():
+                    sock = self.__socketActive
+                    if self.__sendToHat('AT+CIPCLOSE=%d' % sock.Link):
+                        sock.State = 'CLOSING'
+                        self.__state = self.__state + 1
+
+            elif self.__state == 110:
+                if self.__waitForUnlock():
+                    sock = self.__socketActive
+                    if sock.State == 'CLOSING':
+                        # ERROR, the link is not connected anymore
+                        self.__releaseSocket(sock, ConnectionError('Link %d was closed' % sock.Link))
+                    self.__state = 97
+
+            elif self.__state == 98:
+                #Check if alive
+                if self.__sendToHat('AT'):
+                    self.__state = 99
+            elif self.__state == 99:
+                #Check if alive
+                if self.__waitForUnlock():
+                    self.__state = 97
+                    self.__nextState = 98
+                    self.__waitTime = actTime + 5000
+
+            # Nothing more to do for now, so sleep until the hat answers, a new job comes in or a timer expires
+            if self.__state == lastState:
+                self.__waitForEvent(self.__getIdleTimeout(actTime))
+            elif self.__trace.Enabled:
+                self.__trace.Record('STATE', TraceCommands, '-', 'State %d -> %d', (lastState, self.__state))
+        self.__logger.info('Worker ended')
@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+# Filename: journal.py
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+class Journal:
+    """Append-only file of the jobs submitted to the hat, one JSON record per line:
+    {"Add": id, "Kind": ..., "Payload": ...} when a job is queued, {"Done": id} when it got its result.
+    Append() and Complete() only queue the record. A writer thread writes all records that came
+    in since its last write with one write() and one fsync() (group commit), so a record is on
+    the disk CommitInterval seconds (plus one fsync) later, Flush() waits for it.
+    After CompactAfter completed jobs the file is rewritten in the background with the pending
+    jobs only. Pending() returns the jobs that were not completed before the last shutdown."""
+
+    def __init__(self, Path, CommitInterval=0.05, CompactAfter=1000):
+        self.Path = Path
+        self.CommitInterval = CommitInterval    # seconds records are collected before they are written
+        self.CompactAfter = CompactAfter        # completed jobs until the file is rewritten
+        self.Counters = dict.fromkeys(('Appended', 'Completed', 'Replayed', 'Commits', 'Compactions', 'Failed'), 0)
+        self.__logger = logging.getLogger(__name__)
+        self.__pending = collections.OrderedDict()     # id -> record line of the jobs not done yet
+        self.__records = []         # lines not written yet
+        self.__queued = 0           # records queued since the start
+        self.__committed = 0        # records of them that are on the disk
+        self.__completed = 0        # completed jobs since the last rewrite
+        self.__condition = threading.Condition()
+        self.__closed = False
+        self.__flushing = False     # Flush() is waiting, the records are written right away
+        self.__file = None
+        self.__nextId = self.__load() + 1
+        self.__replay = [(jobId,) + self.__decode(line)[1:] for jobId, line in self.__pending.items()]
+        self.Counters['Replayed'] = len(self.__replay)
+        # Drops the completed jobs and a record torn by a crash
+        self.__rewrite(list(self.__pending.values()))
+        self.__thread = threading.Thread(target=self.__writerThread, daemon=True)
+        self.__thread.start()
+
+    def __len__(self):
+        return len(self.__pending)
+
+    def __load(self):
+        # Reads the file into __pending, returns the highest id
+        lastId = 0
+        try:
+            with open(self.Path, 'r', encoding='utf-8', newline='\n') as journalFile:
+                for line in journalFile:
+                    if not line.endswith('\n'):
+                        # The last write was interrupted
+                        break
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        self.__logger.warning('Journal %s is damaged, ignoring the rest', self.Path)
+                        break
+                    if 'Add' in record:
+                        self.__pending[record['Add']] = line
+                        lastId = max(lastId, record['Add'])
+                    else:
+                        self.__pending.pop(record.get('Done'), None)
+        except FileNotFoundError:
+            pass
+        return lastId
+
+    @staticmethod
+    def __decode(line):
+        record = json.loads(line)
+        return record['Add'], record['Kind'], record['Payload']
+
+    def Pending(self):
+        # [(id, Kind, Payload), ...] of the jobs that were pending when the journal was opened
+        return list(self.__replay)
+
+    def Append(self, Kind, Payload):
+        # Payload has to be JSON serializable, returns the id of the job for Complete()
+        with self.__condition:
+            if self.__closed:
+                raise ValueError('Journal %s is closed' % self.Path)
+            jobId = self.__nextId
+            self.__nextId += 1
+            line = json.dumps({'Add': jobId, 'Kind': Kind, 'Payload': Payload}, separators=(',', ':')) + '\n'
+            self.__pending[jobId] = line
+            self.__queue(line)
+            self.Counters['Appended'] += 1
+        return jobId
+
+    def Complete(self, JobId):
+        # The job is not returned by Pending() after the next start anymore
+        with self.__condition:
+            if self.__closed or self.__pending.pop(JobId, None) == None:
+                return
+            self.__queue('{"Done":%d}\n' % JobId)
+            self.__completed += 1
+            self.Counters['Completed'] += 1
+
+    def __queue(self, line):
+        self.__records.append(line)
+        self.__queued += 1
+        if len(self.__records) == 1:
+            self.__condition.notify_all()
+
+    def Flush(self, Timeout=None):
+        # Waits until all records queued so far are on the disk, returns False after Timeout seconds
+        with self.__condition:
+            target = self.__queued
+            self.__flushing = True
+            self.__condition.notify_all()
+            return self.__condition.wait_for(lambda: self.__committed >= target or self.__closed, Timeout) \
+                and self.__committed >= target
+
+    def Close(self):
+        # Writes the remaining records and closes the file
+        with self.__condition:
+            if self.__closed:
+                return
+            self.__closed = True
+            self.__condition.notify_all()
+        self.__thread.join()
+        self.__file.close()
+
+    def __writerThread(self):
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__records or self.__closed)
+                if self.__closed and not self.__records:
+                    return
+                # Records of other jobs, that come in meanwhile, share the fsync
+                self.__condition.wait_for(lambda: self.__flushing or self.__closed, self.CommitInterval)
+                self.__flushing = False
+                records = self.__records
+                self.__records = []
+                target = self.__queued
+                compact = self.__completed >= self.CompactAfter
+                if compact:
+                    # The pending jobs include everything of records
+                    lines = list(self.__pending.values())
+                    self.__completed = 0
+            try:
+                if compact:
+                    self.__rewrite(lines)
+                    self.Counters['Compactions'] += 1
+                else:
+                    self.__file.write(''.join(records))
+                    self.__file.flush()
+                    os.fsync(self.__file.fileno())
+                self.Counters['Commits'] += 1
+            except OSError:
+                self.__logger.exception('Writing the journal %s failed', self.Path)
+                self.Counters['Failed'] += 1
+                with self.__condition:
+                    # A part of the records might be written, so the file is rewritten next time
+                    self.__records[0:0] = records
+                    self.__completed = max(self.__completed, self.CompactAfter)
+                    if self.__closed:
+                        return
+                time.sleep(1.0)
+                continue
+            with self.__condition:
+                self.__committed = target
+                self.__condition.notify_all()
+
+    def __rewrite(self, lines):
+        # Writes the lines to a new file and replaces the journal with it
+        tempPath = self.Path + '.tmp'
+        with open(tempPath, 'w', encoding='utf-8', newline='\n') as tempFile:
+            tempFile.write(''.join(lines))
+            tempFile.flush()
+            os.fsync(tempFile.fileno())
+        if self.__file != None:
+            self.__file.close()
+        os.replace(tempPath, self.Path)
+        try:
+            directory = os.open(os.path.dirname(os.path.abspath(self.Path)), os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+        except OSError:
+            # Not possible on every platform
+            pass
+        self.__file = open(self.Path, 'a', encoding='utf-8', newline='\n')
@@ -0,0 +1,331 @@
+#!/usr/bin/python3
+# Filename: pdu.py
+# SMS in PDU mode (3GPP TS 23.040): SMS-SUBMIT and SMS-DELIVER with the GSM 7 bit default alphabet
+# or UCS2, long messages as concatenated parts (user data header with IEI 0x00 or 0x08).
+import time
+from datetime import datetime
+
+# GSM 03.38 default alphabet, index = septet (27 is the escape to the extension table)
+GSM7 = ('@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞ\x1bÆæßÉ !"#¤%&\'()*+,-./0123456789:;<=>?'
+        '¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà')
+GSM7extension = {0x0a: '\f', 0x14: '^', 0x28: '{', 0x29: '}', 0x2f: '\\', 0x3c: '[', 0x3d: '~', 0x3e: ']',
+                 0x40: '|', 0x65: '€'}
+GSM7septets = dict((char, septet) for septet, char in enumerate(GSM7) if septet != 27)
+GSM7extensionSeptets = dict((char, septet) for septet, char in GSM7extension.items())
+Escape = 27
+
+DCSgsm7 = 0x00
+DCS8bit = 0x04
+DCSucs2 = 0x08
+
+# Characters (septets or UCS2 bytes) of one SMS, alone and as part of a long one (6 bytes of header)
+MaxSeptets = 160
+MaxPartSeptets = 153
+MaxOctets = 140
+MaxPartOctets = 134
+MaxParts = 255
+
+class SMSPart:
+    """Decoded SMS-DELIVER (Number is the sender) or SMS-SUBMIT (Number is the receiver).
+    Part and Parts are 1 for a message of its own, Reference tells which parts belong together.
+    A message joined by the Reassembler has the number of parts that arrived in Part."""
+    __slots__ = ('Number', 'Date', 'Message', 'Reference', 'Part', 'Parts')
+
+    def __init__(self):
+        self.Number = ''
+        self.Date = ''          # datetime of the service centre time stamp (SMS-DELIVER only)
+        self.Message = ''
+        self.Reference = 0
+        self.Part = 1
+        self.Parts = 1
+
+def encodeGSM7(Text):
+    # List of septets or None, if a character is not in the alphabet
+    septets = []
+    for char in Text:
+        septet = GSM7septets.get(char)
+        if septet != None:
+            septets.append(septet)
+            continue
+        septet = GSM7extensionSeptets.get(char)
+        if septet == None:
+            return None
+        septets.append(Escape)
+        septets.append(septet)
+    return septets
+
+def decodeGSM7(Septets):
+    chars = []
+    escaped = False
+    for septet in Septets:
+        if escaped:
+            # Unknown extensions are shown as the character of the default alphabet
+            chars.append(GSM7extension.get(septet, GSM7[septet]))
+            escaped = False
+        elif septet == Escape:
+            escaped = True
+        else:
+            chars.append(GSM7[septet])
+    return ''.join(chars)
+
+def packSeptets(Septets, FillBits=0):
+    # 8 septets in 7 octets, the first bit of a septet is the lowest one; FillBits align the
+    # septets behind a user data header
+    packed = bytearray()
+    value = 0
+    bits = FillBits
+    for septet in Septets:
+        value |= septet << bits
+        bits += 7
+        while bits >= 8:
+            packed.append(value & 0xff)
+            value >>= 8
+            bits -= 8
+    if bits > 0:
+        packed.append(value & 0xff)
+    return bytes(packed)
+
+def unpackSeptets(Data, Count, FillBits=0):
+    septets = []
+    value = 0
+    bits = -FillBits
+    for byte in Data:
+        if bits < 0:
+            value = byte >> FillBits
+            bits = 8 - FillBits
+        else:
+            value |= byte << bits
+            bits += 8
+        while bits >= 7 and len(septets) < Count:
+            septets.append(value & 0x7f)
+            value >>= 7
+            bits -= 7
+    return septets
+
+def splitText(Text):
+    """Returns (data coding scheme, [part, ...]): septet lists for GSM 7 bit, UTF-16 bytes for UCS2.
+    A part never ends between an escape and its character or in a surrogate pair."""
+    septets = encodeGSM7(Text)
+    if septets != None:
+        if len(septets) <= MaxSeptets:
+            return DCSgsm7, [septets]
+        parts = []
+        while septets:
+            end = min(MaxPartSeptets, len(septets))
+            if end < len(septets) and septets[end - 1] == Escape:
+                end -= 1
+            parts.append(septets[:end])
+            septets = septets[end:]
+        return DCSgsm7, parts
+
+    data = Text.encode('utf-16-be')
+    if len(data) <= MaxOctets:
+        return DCSucs2, [data]
+    parts = []
+    while data:
+        end = min(MaxPartOctets, len(data))
+        if end < len(data) and 0xd8 <= data[end - 2] <= 0xdb:
+            end -= 2
+        parts.append(data[:end])
+        data = data[end:]
+    return DCSucs2, parts
+
+def CountParts(Text):
+    # Number of SMS the text needs
+    return len(splitText(Text)[1])
+
+def encodeSemiOctets(Digits):
+    if len(Digits) % 2:
+        Digits += 'F'
+    return bytes(int(Digits[i + 1] + Digits[i], 16) for i in range(0, len(Digits), 2))
+
+def decodeSemiOctets(Data):
+    return ''.join('%x%x' % (byte & 0x0f, byte >> 4) for byte in Data).upper().rstrip('F')
+
+def encodeAddress(Number):
+    # Length in digits, type of address (0x91 international, 0x81 unknown, 0xd0 alphanumeric), digits
+    digits = Number[1:] if Number.startswith('+') else Number
+    if digits.isdigit():
+        return bytes([len(digits), 0x91 if Number.startswith('+') else 0x81]) + encodeSemiOctets(digits)
+    septets = encodeGSM7(Number)
+    if septets == None or len(septets) > 11:
+        raise ValueError('%s is no phone number' % Number)
+    packed = packSeptets(septets)
+    return bytes([(len(septets) * 7 + 3) // 4, 0xd0]) + packed
+
+def decodeAddress(Data, Offset):
+    # Returns (number, offset behind the address)
+    length = Data[Offset]
+    addressType = Data[Offset + 1]
+    end = Offset + 2 + (length + 1) // 2
+    value = Data[Offset + 2:end]
+    if addressType & 0x70 == 0x50:
+        return decodeGSM7(unpackSeptets(value, length * 4 // 7)), end
+    number = decodeSemiOctets(value)[:length]
+    if addressType & 0x70 == 0x10:
+        number = '+' + number
+    return number, end
+
+def encodeTimestamp(Date):
+    # Service centre time stamp, the time zone is left at UTC+0
+    return encodeSemiOctets(Date.strftime('%y%m%d%H%M%S') + '00')
+
+def decodeTimestamp(Data):
+    digits = decodeSemiOctets(Data).ljust(14, '0')
+    # The time zone of the network is ignored, like in text mode
+    return datetime(2000 + int(digits[0:2]), int(digits[2:4]), int(digits[4:6]),
+                    int(digits[6:8]), int(digits[8:10]), int(digits[10:12]))
+
+def alphabetOf(DCS):
+    # DCSgsm7, DCS8bit or DCSucs2 (TS 23.038)
+    if DCS & 0x80 == 0:
+        alphabet = DCS & 0x0c
+        return DCS8bit if alphabet == 0x0c else alphabet
+    if DCS & 0xf0 == 0xf0:
+        return DCS8bit if DCS & 0x04 else DCSgsm7
+    if DCS & 0xf0 == 0xe0:
+        return DCSucs2
+    return DCSgsm7
+
+def encodeUserData(DCS, Part, Header):
+    # User data length (septets or octets) and the user data
+    if DCS == DCSgsm7:
+        fillBits = (7 - len(Header) * 8 % 7) % 7
+        length = (len(Header) * 8 + fillBits) // 7 + len(Part)
+        return bytes([length]) + Header + packSeptets(Part, fillBits)
+    return bytes([len(Header) + len(Part)]) + Header + bytes(Part)
+
+def decodeUserData(Data, Offset, DCS, HasHeader, Part):
+    # Fills Message, Reference, Part and Parts of Part
+    length = Data[Offset]
+    userData = Data[Offset + 1:]
+    headerLength = 0
+    if HasHeader:
+        headerLength = userData[0] + 1
+        decodeHeader(userData[1:headerLength], Part)
+    alphabet = alphabetOf(DCS)
+    if alphabet == DCSgsm7:
+        headerSeptets = (headerLength * 8 + 6) // 7
+        fillBits = headerSeptets * 7 - headerLength * 8
+        Part.Message = decodeGSM7(unpackSeptets(userData[headerLength:], length - headerSeptets, fillBits))
+    elif alphabet == DCSucs2:
+        # A part of a long message might end in the middle of a surrogate pair, Reassembler joins it
+        Part.Message = userData[headerLength:length].decode('utf-16-be', 'surrogatepass' if Part.Parts > 1 else 'replace')
+    else:
+        Part.Message = userData[headerLength:length].decode('iso-8859-1')
+
+def decodeHeader(Header, Part):
+    # Information elements of the user data header, only the concatenation ones are used
+    offset = 0
+    while offset + 2 <= len(Header):
+        element = Header[offset]
+        length = Header[offset + 1]
+        value = Header[offset + 2:offset + 2 + length]
+        if element == 0x00 and length == 3:
+            Part.Reference, Part.Parts, Part.Part = value[0], value[1], value[2]
+        elif element == 0x08 and length == 4:
+            Part.Reference, Part.Parts, Part.Part = (value[0] << 8) | value[1], value[2], value[3]
+        offset += 2 + length
+
+def concatHeader(Reference, Parts, Part):
+    return bytes([5, 0x00, 3, Reference & 0xff, Parts, Part])
+
+def EncodeSubmit(Receiver, Text, Reference=0):
+    """SMS-SUBMIT PDUs of a message, one per part: [(length for AT+CMGS=<length>, hex), ...].
+    Reference (0-255) tells the receiver, which parts belong together.
+    Raises ValueError, if Receiver is no number or Text needs more than 255 parts."""
+    dcs, parts = splitText(Text)
+    if len(parts) > MaxParts:
+        raise ValueError('Message needs %d SMS, at most %d are possible' % (len(parts), MaxParts))
+    address = encodeAddress(Receiver)
+    pdus = []
+    for number, part in enumerate(parts, 1):
+        header = concatHeader(Reference, len(parts), number) if len(parts) > 1 else b''
+        # SMS-SUBMIT, user data header indicator, no validity period, message reference set by the module
+        tpdu = bytes([0x41 if header else 0x01, 0x00]) + address + bytes([0x00, dcs]) + encodeUserData(dcs, part, header)
+        # No service centre address, the one of the SIM card is used
+        pdus.append((len(tpdu), '00' + tpdu.hex().upper()))
+    return pdus
+
+def EncodeDeliver(Sender, Text, Date=None, Reference=0):
+    # SMS-DELIVER PDUs of a message as the module gets them from the network: [(length, hex), ...]
+    dcs, parts = splitText(Text)
+    address = encodeAddress(Sender)
+    timestamp = encodeTimestamp(Date or datetime.now())
+    pdus = []
+    for number, part in enumerate(parts, 1):
+        header = concatHeader(Reference, len(parts), number) if len(parts) > 1 else b''
+        tpdu = (bytes([0x44 if header else 0x04]) + address + bytes([0x00, dcs]) + timestamp +
+                encodeUserData(dcs, part, header))
+        pdus.append((len(tpdu), '00' + tpdu.hex().upper()))
+    return pdus
+
+def DecodePDU(Hex):
+    """SMSPart of a SMS-DELIVER (+CMGL/+CMGR) or SMS-SUBMIT PDU in hex, with service centre address.
+    Raises ValueError or IndexError, if the PDU is broken."""
+    data = bytes.fromhex(Hex)
+    offset = data[0] + 1
+    firstOctet = data[offset]
+    messageType = firstOctet & 0x03
+    part = SMSPart()
+    if messageType == 0x00:
+        part.Number, offset = decodeAddress(data, offset + 1)
+        dcs = data[offset + 1]
+        part.Date = decodeTimestamp(data[offset + 2:offset + 9])
+        offset += 9
+    elif messageType == 0x01:
+        part.Number, offset = decodeAddress(data, offset + 2)
+        dcs = data[offset + 1]
+        offset += 2
+        # Validity period: none, relative (1 octet), enhanced or absolute (7 octets)
+        offset += (0, 7, 1, 7)[(firstOctet >> 3) & 0x03]
+    else:
+        raise ValueError('PDU of type %d is no SMS-DELIVER or SMS-SUBMIT' % messageType)
+    decodeUserData(data, offset, dcs, firstOctet & 0x40, part)
+    return part
+
+class Reassembler:
+    """Collects the parts of long messages, until all of them are there. The parts of a message,
+    that is not complete after MaxAge seconds, are joined anyway (see Expire)."""
+
+    def __init__(self, MaxAge=3600.0):
+        self.MaxAge = MaxAge
+        self.__messages = {}        # (number, reference, parts) -> [monotonic time of the first part, {part: SMSPart}]
+
+    def __len__(self):
+        return len(self.__messages)
+
+    def Add(self, Part, Now=None):
+        # Returns the whole message, when Part completes it, a message of its own right away, else None
+        if Part.Parts <= 1:
+            return Part
+        key = (Part.Number, Part.Reference, Part.Parts)
+        entry = self.__messages.get(key)
+        if entry == None:
+            entry = self.__messages[key] = [time.monotonic() if Now == None else Now, {}]
+        entry[1][Part.Part] = Part
+        if len(entry[1]) < Part.Parts:
+            return None
+        del self.__messages[key]
+        return joinParts(entry[1])
+
+    def Expire(self, Now=None):
+        # Returns the incomplete messages, whose first part came MaxAge seconds ago
+        if Now == None:
+            Now = time.monotonic()
+        expired = [key for key, entry in self.__messages.items() if Now - entry[0] >= self.MaxAge]
+        return [joinParts(self.__messages.pop(key)[1]) for key in expired]
+
+def joinParts(Parts):
+    # Parts is {part number: SMSPart}, missing ones are left out
+    ordered = [Parts[number] for number in sorted(Parts)]
+    message = SMSPart()
+    message.Number = ordered[0].Number
+    message.Date = ordered[0].Date
+    message.Reference = ordered[0].Reference
+    message.Parts = ordered[0].Parts
+    message.Part = len(ordered)
+    text = ''.join(part.Message for part in ordered)
+    # Surrogate pairs split between two UCS2 parts
+    message.Message = text.encode('utf-16-be', 'surrogatepass').decode('utf-16-be', 'replace')
+    return message
@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+# Filename: pool.py
+import concurrent.futures
+import functools
+import queue
+import threading
+import time
+from .gsmHat import MessageQueue
+from .stats import MergeStats
+
+class PoolJob:
+    """SMS or URL call of a GSMHatPool. Future is the one of the application, Inner the one
+    of the hat the job is queued on at the moment."""
+    __slots__ = ('Kind', 'Args', 'Future', 'Hat', 'Inner', 'QueuedAt')
+
+    def __init__(self, Kind, Args):
+        self.Kind = Kind                # 'SMS' or 'URL'
+        self.Args = Args
+        self.Future = concurrent.futures.Future()
+        self.Hat = None                 # index of the hat
+        self.Inner = None
+        self.QueuedAt = 0.0             # monotonic time it was queued on the hat
+
+class GSMHatPool:
+    """Several hats or modems (each a GSMHat with its own serial port) behind the interface of
+    one: SMS_write() and CallUrl() go to the hat with the least work ahead of the job, that is
+    its unfinished jobs of the kind times the time it needs per job (learned from the jobs it
+    finished). Jobs, that did not start on a hat, which is in recovery (see GSMHat.IsRecovering),
+    move to another hat, and from busy hats to idle ones. The received SMS of all hats come out of one inbox.
+    close() closes the hats as well."""
+
+    cCheckInterval = 0.2            # seconds between the checks for hats in recovery
+    cServiceAlpha = 0.2             # weight of a new job in the time per job
+
+    def __init__(self, Hats, InboxSize=0):
+        self.__hats = list(Hats)
+        if not self.__hats:
+            raise ValueError('A pool needs at least one hat')
+        self.Counters = dict.fromkeys(('SMS', 'URL', 'Failovers', 'Rebalanced', 'Rejected'), 0)
+        self.__lock = threading.RLock()
+        self.__jobs = set()
+        self.__outstanding = [{'SMS': 0, 'URL': 0} for hat in self.__hats]
+        self.__serviceTimes = [{'SMS': None, 'URL': None} for hat in self.__hats]
+        self.__lastDone = [{'SMS': 0.0, 'URL': 0.0} for hat in self.__hats]
+        self.__next = 0                 # first hat, if several have the same work ahead
+        self.__inbox = MessageQueue(InboxSize)
+        self.__closed = threading.Event()
+
+        self.__threads = [threading.Thread(target=self.__forwardSMS, args=(hat,), daemon=True) for hat in self.__hats]
+        self.__threads.append(threading.Thread(target=self.__checkHats, daemon=True))
+        for thread in self.__threads:
+            thread.start()
+
+    def GetHats(self):
+        return list(self.__hats)
+
+    def SMS_available(self):
+        return len(self.__inbox)
+
+    def SMS_read(self, Timeout=0):
+        # Timeout in seconds, None waits until a SMS arrives on any of the hats
+        return self.__inbox.Get(Timeout)
+
+    def SMS_iter(self, Timeout=None):
+        return self.__inbox.Iterate(Timeout)
+
+    def SMS_write(self, NumberReceiver, Message):
+        # Like GSMHat.SMS_write(), fails with queue.Full only if the queues of all hats are full
+        return self.__submit(PoolJob('SMS', (NumberReceiver, Message)))
+
+    def CallUrl(self, url, Method='GET', Data=None, ContentType=None, Sink=None):
+        # Like GSMHat.CallUrl(), every hat needs SetGPRSconnection()
+        return self.__submit(PoolJob('URL', (url, Method, Data, ContentType, Sink)))
+
+    def SetGPRSconnection(self, APN, Username, Password):
+        for hat in self.__hats:
+            hat.SetGPRSconnection(APN, Username, Password)
+
+    def GetStats(self):
+        """GSMHat.GetStats() of all hats merged into one (see gsmHat.stats.MergeStats), the single
+        ones in 'Hats' and the state of the load balancing per hat in 'Balance'."""
+        hatStats = [hat.GetStats() for hat in self.__hats]
+        stats = MergeStats(hatStats)
+        stats['Hats'] = hatStats
+        with self.__lock:
+            stats['Counters']['Failovers'] = self.Counters['Failovers']
+            stats['Balance'] = [{'Recovering': hat.IsRecovering(), 'Outstanding': dict(outstanding),
+                                 'ServiceTimes': dict(serviceTimes)}
+                                for hat, outstanding, serviceTimes
+                                in zip(self.__hats, self.__outstanding, self.__serviceTimes)]
+        return stats
+
+    def close(self):
+        self.__closed.set()
+        for hat in self.__hats:
+            hat.close()
+        for thread in self.__threads:
+            thread.join(10.0)
+        self.__inbox.Close()
+
+    def __submit(self, job):
+        job.Future.add_done_callback(functools.partial(self.__onCancelled, job))
+        with self.__lock:
+            self.Counters[job.Kind] += 1
+            self.__next = (self.__next + 1) % len(self.__hats)
+            if self.__queue(job, self.__ranking(job.Kind)):
+                return job.Future
+            self.Counters['Rejected'] += 1
+        job.Future.set_exception(queue.Full('The %s queues of all hats are full' % job.Kind))
+        return job.Future
+
+    def __serviceTime(self, index, kind):
+        # Hats without finished jobs count with the mean of the others
+        serviceTime = self.__serviceTimes[index][kind]
+        if serviceTime != None:
+            return serviceTime
+        known = [serviceTimes[kind] for serviceTimes in self.__serviceTimes if serviceTimes[kind] != None]
+        return sum(known) / len(known) if known else 1.0
+
+    def __ranking(self, kind, exclude=()):
+        # Hats by the seconds of work ahead of a new job, the ones in recovery last
+        count = len(self.__hats)
+        ranking = []
+        for index, hat in enumerate(self.__hats):
+            if index in exclude:
+                continue
+            ahead = (self.__outstanding[index][kind] + 1) * self.__serviceTime(index, kind)
+            ranking.append((hat.IsRecovering(), ahead, (index - self.__next) % count, index))
+        ranking.sort()
+        return [index for recovering, ahead, order, index in ranking]
+
+    def __queue(self, job, ranking):
+        # Queues the job on the first hat of the ranking, that accepts it
+        for index in ranking:
+            hat = self.__hats[index]
+            if job.Kind == 'SMS':
+                inner = hat.SMS_write(*job.Args)
+            else:
+                inner = hat.CallUrl(*job.Args)
+            if inner.done() and not inner.cancelled() and isinstance(inner.exception(), queue.Full):
+                continue
+            job.Hat = index
+            job.Inner = inner
+            job.QueuedAt = time.monotonic()
+            self.__jobs.add(job)
+            self.__outstanding[index][job.Kind] += 1
+            inner.add_done_callback(functools.partial(self.__onDone, job, inner))
+            return True
+        return False
+
+    def __onDone(self, job, inner, future):
+        with self.__lock:
+            if job.Inner is not inner:
+                # Moved to another hat
+                return
+            self.__outstanding[job.Hat][job.Kind] -= 1
+            self.__jobs.discard(job)
+            job.Inner = None
+            if not inner.cancelled():
+                # The hat works on its jobs one after the other: this one started, when it was
+                # queued or when the one before was done
+                now = time.monotonic()
+                serviceTime = now - max(job.QueuedAt, self.__lastDone[job.Hat][job.Kind])
+                self.__lastDone[job.Hat][job.Kind] = now
+                estimate = self.__serviceTimes[job.Hat][job.Kind]
+                if estimate == None:
+                    self.__serviceTimes[job.Hat][job.Kind] = serviceTime
+                else:
+                    # A job, that waited for a recovery of the hat, does not count in full
+                    serviceTime = min(serviceTime, 4 * estimate)
+                    self.__serviceTimes[job.Hat][job.Kind] = estimate + self.cServiceAlpha * (serviceTime - estimate)
+
+        if inner.cancelled():
+            # The hat was closed
+            job.Future.cancel()
+        elif job.Future.set_running_or_notify_cancel():
+            if inner.exception() != None:
+                job.Future.set_exception(inner.exception())
+            else:
+                job.Future.set_result(inner.result())
+
+    def __onCancelled(self, job, future):
+        # The application cancelled the job, the hat only drops it, if it did not start yet
+        if future.cancelled():
+            with self.__lock:
+                if job.Inner != None:
+                    job.Inner.cancel()
+
+    def __checkHats(self):
+        while not self.__closed.wait(self.cCheckInterval):
+            recovering = set(index for index, hat in enumerate(self.__hats) if hat.IsRecovering())
+            if len(recovering) == len(self.__hats):
+                continue
+            with self.__lock:
+                for job in [job for job in self.__jobs if job.Hat in recovering]:
+                    if self.__move(job, self.__ranking(job.Kind, recovering)):
+                        self.Counters['Failovers'] += 1
+                for kind in ('SMS', 'URL'):
+                    self.__rebalance(kind, recovering)
+
+    def __rebalance(self, kind, recovering):
+        # Moves jobs, that did not start yet, from the hat with the most work ahead to the one with
+        # the least, as long as they are done earlier there (e.g. a hat is back from its recovery)
+        healthy = [index for index in range(len(self.__hats)) if index not in recovering]
+        while len(healthy) > 1:
+            ahead = dict((index, self.__outstanding[index][kind] * self.__serviceTime(index, kind)) for index in healthy)
+            busiest = max(healthy, key=ahead.get)
+            idlest = min(healthy, key=ahead.get)
+            if ahead[idlest] + self.__serviceTime(idlest, kind) >= ahead[busiest]:
+                return
+            # The last one queued on the busiest hat
+            jobs = sorted([job for job in self.__jobs if job.Hat == busiest and job.Kind == kind],
+                          key=lambda job: job.QueuedAt, reverse=True)
+            for job in jobs:
+                if not job.Inner.running() and self.__move(job, [idlest]):
+                    self.Counters['Rebalanced'] += 1
+                    break
+            else:
+                return
+
+    def __move(self, job, ranking):
+        # Takes the job back from its hat, if the hat did not start it yet, and queues it on the
+        # first hat of ranking that accepts it, or its own hat again. Returns True if it moved.
+        inner = job.Inner
+        index = job.Hat
+        job.Inner = None
+        if not inner.cancel():
+            job.Inner = inner
+            return False
+        self.__outstanding[index][job.Kind] -= 1
+        self.__jobs.discard(job)
+        if self.__queue(job, [other for other in ranking if other != index] + [index]):
+            return job.Hat != index
+        if job.Future.set_running_or_notify_cancel():
+            job.Future.set_exception(queue.Full('The %s queues of all hats are full' % job.Kind))
+        return False
+
+    def __forwardSMS(self, hat):
+        # Ends when the hat is closed
+        for newSMS in hat.SMS_iter(None):
+            self.__inbox.Put(newSMS)
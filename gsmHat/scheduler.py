@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+# Filename: scheduler.py
+
+class JobClass:
+    """One kind of work of the worker, e.g. sending SMS or polling the GPS position.
+    Ready() tells if there is work, Start() begins it and returns the next state."""
+    __slots__ = ('Name', 'Ready', 'Start', 'Priority', 'Weight', 'Deadline', 'Since', 'ReadySince', 'Pass', 'Started')
+
+    def __init__(self, Name, Ready, Start, Priority=1, Weight=1.0, Deadline=None, Since=None):
+        self.Name = Name
+        self.Ready = Ready
+        self.Start = Start
+        self.Priority = Priority        # lower numbers first
+        self.Weight = Weight            # share among the classes of the same priority
+        self.Deadline = Deadline        # seconds a ready class waits at most, None = no limit
+        self.Since = Since              # returns the monotonic time the deadline counts from, None = since ready
+        self.ReadySince = None          # monotonic time the class was seen ready first
+        self.Pass = 0.0                 # grows by 1 / Weight with every start
+        self.Started = 0
+
+    def DeadlineStart(self):
+        return self.Since() if self.Since != None else self.ReadySince
+
+class Scheduler:
+    """Picks the job class the worker starts next, whenever it is idle (state 97).
+    A class that is ready longer than its Deadline goes first (the earliest deadline, if several
+    are overdue). The Deadline counts from Since(), if the class has it. Otherwise the ready classes with the lowest Priority number share the worker
+    in proportion to their Weight (stride scheduling), so a burst of one class does not starve
+    the others of the same priority. Ties go to the class registered first."""
+
+    def __init__(self):
+        self.__classes = []
+        self.__globalPass = 0.0
+
+    def Register(self, Name, Ready, Start, Priority=1, Weight=1.0, Deadline=None, Since=None):
+        jobClass = JobClass(Name, Ready, Start, Priority, Weight, Deadline, Since)
+        self.__classes.append(jobClass)
+        return jobClass
+
+    def Configure(self, Name, Priority=None, Weight=None, Deadline=-1):
+        # Changes a registered class, Deadline=None removes its deadline
+        jobClass = self.Get(Name)
+        if Weight != None and Weight <= 0:
+            raise ValueError('Weight of %s has to be positive' % Name)
+        if Priority != None:
+            jobClass.Priority = Priority
+        if Weight != None:
+            jobClass.Weight = Weight
+        if Deadline != -1:
+            jobClass.Deadline = Deadline
+
+    def Get(self, Name):
+        for jobClass in self.__classes:
+            if jobClass.Name == Name:
+                return jobClass
+        raise KeyError('Unknown job class %s' % Name)
+
+    def Classes(self):
+        return list(self.__classes)
+
+    def Next(self, Now):
+        """Returns (job class, seconds it was ready) of the class to start or (None, 0.0).
+        Now is time.monotonic()."""
+        ready = []
+        for jobClass in self.__classes:
+            if jobClass.Ready():
+                if jobClass.ReadySince == None:
+                    jobClass.ReadySince = Now
+                    # No credit for the time it was not ready
+                    jobClass.Pass = max(jobClass.Pass, self.__globalPass)
+                ready.append(jobClass)
+            else:
+                jobClass.ReadySince = None
+        if not ready:
+            return None, 0.0
+
+        overdue = [jobClass for jobClass in ready
+                   if jobClass.Deadline != None and Now - jobClass.DeadlineStart() >= jobClass.Deadline]
+        if overdue:
+            chosen = min(overdue, key=lambda jobClass: jobClass.DeadlineStart() + jobClass.Deadline)
+        else:
+            priority = min(jobClass.Priority for jobClass in ready)
+            chosen = min((jobClass for jobClass in ready if jobClass.Priority == priority),
+                         key=lambda jobClass: jobClass.Pass)
+
+        waited = Now - chosen.ReadySince
+        self.__globalPass = chosen.Pass
+        chosen.Pass += 1.0 / chosen.Weight
+        chosen.ReadySince = None
+        chosen.Started += 1
+        return chosen, waited
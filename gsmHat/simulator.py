@@ -0,0 +1,641 @@
+#!/usr/bin/python3
+# Filename: simulator.py
+import os
+import pty
+import random
+import select
+import socket
+import threading
+import time
+import tty
+from datetime import datetime, timezone
+from .stats import commandVerb
+from .pdu import EncodeDeliver, DecodePDU
+
+def splitCommands(Command):
+    # 'AT+CMGF?;+CPMS="SM"' -> ['AT+CMGF?', 'AT+CPMS="SM"'], 'ATD123;' and ';' in quotes stay
+    parts = []
+    start = 0
+    quoted = False
+    for index, char in enumerate(Command):
+        if char == '"':
+            quoted = not quoted
+        elif char == ';' and not quoted and Command[index + 1:index + 2] == '+':
+            parts.append(Command[start:index])
+            start = index + 1
+    parts.append(Command[start:])
+    return parts[:1] + ['AT' + part for part in parts[1:]]
+
+class ModemSimulator:
+    """SIM868 on a pseudo terminal, so GSMHat and AsyncGSMHat can run without the hat:
+
+        modem = ModemSimulator(Latency=0.05)
+        gsm = GSMHat(modem.Port, 115200)
+
+    It answers the AT commands of the state machine (text mode SMS, GNSS, bearer, HTTP and
+    the TCP/IP stack) and can delay answers, inject errors and send unsolicited +CMTI.
+    AT+CFUN=1,1 resets it: no answers for RebootTime seconds, then echo is on again.
+    AT+CIPSTART opens a real socket, e.g. to an echo server on localhost. Answers can come in
+    chunks (ChunkSize, ChunkDelay) and with NMEA sentences between their lines (InterleaveNMEA),
+    like the serial line of the real hat."""
+
+    cStorageSize = 30               # SMS slots of the SIM card
+
+    def __init__(self, Latency=0.0, HttpLatency=0.0, Seed=None):
+        self.Latency = Latency              # seconds before every answer
+        self.Latencies = {}                 # seconds per verb, e.g. {'AT+CMGS': 3.0}
+        self.HttpLatency = HttpLatency      # seconds from AT+HTTPACTION until +HTTPACTION
+        self.NMEAInterval = 1.0             # seconds between NMEA blocks after AT+CGNSTST=1
+        self.InterleaveNMEA = False         # NMEA blocks go between the lines of the next answer
+        self.ChunkSize = 0                  # bytes per write of an answer, 0 = the whole answer at once
+        self.ChunkDelay = 0.0               # seconds between the chunks of an answer
+        self.BearerIP = '10.0.0.2'          # IP address after AT+SAPBR=1,1
+        self.RebootTime = 2.0               # seconds without answers after AT+CFUN=1,1
+        self.Resets = 0                     # AT+CFUN=1,1 received
+        self.HttpResponses = {}             # URL -> (status, body as str or bytes), all others get DefaultHttpResponse
+        self.DefaultHttpResponse = (200, 'Hello from the simulator')
+        self.Echo = False
+        self.Commands = []                  # (time.perf_counter(), command) of every received command
+        self.SentSMS = []                   # (receiver, message) of every AT+CMGS
+        self.SentPDUs = []                  # PDU (hex) of every AT+CMGS in PDU mode
+        self.Uploads = []                   # (url, content type, data) of every POST
+        self.Inbox = {}                     # slot -> [status (see Statuses), sender, date, message, PDU]
+        self.Position = None                # (latitude, longitude, altitude, speed, course) or None for no fix
+        self.CPUTime = 0.0                  # CPU seconds used by the simulator threads, to subtract it in benchmarks
+        self.__readerCPUTime = 0.0
+        self.__streamCPUTime = 0.0
+        self.__linkCPUTimes = {}
+
+        self.__random = random.Random(Seed)
+        self.__errors = {}
+        self.__handlers = {}
+        self.__textModeReceiver = None
+        self.__textModeError = None
+        self.__messageReference = 0
+        self.__concatReference = 0
+        self.__bearerOpen = False
+        self.__gpsPower = False
+        self.__nmeaStreaming = False
+        self.__nmeaPending = ''
+        self.__nmeaLock = threading.Lock()
+        self.__httpUrl = ''
+        self.__httpResponse = None
+        self.__httpContentType = 'text/plain'
+        self.__httpData = b''
+        self.__data = b''
+        self.__dataRemaining = 0
+        self.__dataReceiver = None
+        self.__ipStack = False
+        self.__links = {}
+        self.__rebootUntil = 0.0
+        self.__textMode = False
+        self.__writeLock = threading.Lock()
+        self.__registerCommands()
+
+        self.__master, self.__slave = pty.openpty()
+        tty.setraw(self.__slave)
+        self.Port = os.ttyname(self.__slave)
+        self.__wakeupRead, self.__wakeupWrite = os.pipe()
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def close(self):
+        self.__running = False
+        self.__nmeaStreaming = False
+        for link in list(self.__links):
+            self.__closeLink(link)
+        os.write(self.__wakeupWrite, b'\0')
+        self.__thread.join(1.0)
+        with self.__writeLock:
+            for fd in (self.__master, self.__slave, self.__wakeupRead, self.__wakeupWrite):
+                os.close(fd)
+            self.__master = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def RegisterCommand(self, Verb, Handler):
+        """Handler(Arguments) answers every command with Verb (e.g. 'AT+CSQ'). Arguments is the
+        text behind '=' (or '?'), the return value is sent back (None = no answer)"""
+        self.__handlers[Verb] = Handler
+
+    def InjectError(self, Verb, Response='ERROR', Count=1, Probability=1.0):
+        """The next Count commands with Verb (None = every verb) are answered with Response,
+        e.g. '+CMS ERROR: 500'. Count None is unlimited, Response None is no answer (timeout)."""
+        self.__errors[Verb] = [Response, Count, Probability]
+
+    def ClearErrors(self):
+        self.__errors = {}
+
+    def ReceiveSMS(self, Sender, Message, Date=None):
+        """Stores a new message on the SIM card and tells the host with +CMTI, returns the slot.
+        A long message comes in parts like from the network, one slot each (the first one is returned)."""
+        Date = Date or datetime.now()
+        pdus = EncodeDeliver(Sender, Message, Date, self.__concatReference)
+        if len(pdus) > 1:
+            self.__concatReference = (self.__concatReference + 1) % 256
+        slots = []
+        for length, pdu in pdus:
+            slot = 1
+            while slot in self.Inbox:
+                slot += 1
+            if slot > self.cStorageSize:
+                break
+            # Text mode shows the text of the part
+            text = DecodePDU(pdu).Message if len(pdus) > 1 else Message
+            self.Inbox[slot] = ['REC UNREAD', Sender, Date.strftime('%y/%m/%d,%H:%M:%S') + '+08', text, pdu]
+            self.Unsolicited('+CMTI: "SM",%d' % slot)
+            slots.append(slot)
+        return slots[0] if slots else 0
+
+    def Unsolicited(self, Line):
+        # Sends an unsolicited line like 'RING'
+        self.__write('\r\n' + Line + '\r\n')
+
+    def SetPosition(self, Latitude, Longitude, Altitude=0.0, Speed=0.0, Course=0.0):
+        self.Position = (Latitude, Longitude, Altitude, Speed, Course)
+
+    def __write(self, text, chunkSize=0, chunkDelay=0.0):
+        if isinstance(text, str):
+            text = text.encode('iso-8859-1')
+        chunkSize = chunkSize or len(text)
+        with self.__writeLock:
+            for start in range(0, len(text), chunkSize):
+                if self.__master == None:
+                    break
+                if start > 0 and chunkDelay > 0:
+                    time.sleep(chunkDelay)
+                os.write(self.__master, text[start:start + chunkSize])
+
+    def __respond(self, text):
+        # Answer of a command or data announced by its length
+        if isinstance(text, str):
+            text = text.encode('iso-8859-1')
+        if self.InterleaveNMEA:
+            with self.__nmeaLock:
+                pending = self.__nmeaPending
+                self.__nmeaPending = ''
+            if pending:
+                # After the line in the middle of the answer
+                ends = [index for index, byte in enumerate(text) if byte == 10]
+                middle = ends[len(ends) // 2] + 1 if ends else 0
+                text = text[:middle] + pending.encode('ascii') + text[middle:]
+        self.__write(text, self.ChunkSize, self.ChunkDelay)
+
+    def __run(self):
+        buffer = b''
+        while self.__running:
+            readable = select.select([self.__master, self.__wakeupRead], [], [])[0]
+            if self.__wakeupRead in readable:
+                break
+            buffer = self.__parse(buffer + os.read(self.__master, 4096))
+            self.__readerCPUTime = time.thread_time()
+            self.__updateCPUTime()
+
+    def __updateCPUTime(self):
+        self.CPUTime = self.__readerCPUTime + self.__streamCPUTime + sum(self.__linkCPUTimes.values())
+
+    def __parse(self, buffer):
+        # Splits the input into commands (ended by '\r' or '\n') and SMS texts (ended by Ctrl+Z)
+        while buffer:
+            if self.__dataRemaining > 0:
+                # Data after DOWNLOAD or the '> ' prompt
+                data = buffer[:self.__dataRemaining]
+                self.__data += data
+                self.__dataRemaining -= len(data)
+                buffer = buffer[len(data):]
+                if self.__dataRemaining == 0:
+                    self.__dataReceiver(self.__data)
+                continue
+
+            if self.__textModeReceiver != None:
+                end = buffer.find(b'\x1a')
+                if end < 0:
+                    return buffer
+                self.__sendSMS(buffer[:end].decode('iso-8859-1'))
+                buffer = buffer[end + 1:]
+                continue
+
+            end = min([pos for pos in (buffer.find(b'\r'), buffer.find(b'\n')) if pos >= 0] or [-1])
+            if end < 0:
+                return buffer
+            command = buffer[:end].decode('iso-8859-1').strip()
+            buffer = buffer[end + 1:]
+            if command != '':
+                self.__command(command)
+        return buffer
+
+    def __command(self, command):
+        self.Commands.append((time.perf_counter(), command))
+        verb = commandVerb(command)
+        if time.monotonic() < self.__rebootUntil:
+            return
+        if self.Echo:
+            self.__write(command + '\r\r\n')
+
+        latency = self.Latencies.get(verb, self.Latency)
+        if latency > 0:
+            time.sleep(latency)
+
+        commands = splitCommands(command)
+        if len(commands) == 1:
+            response = self.__answer(command, verb)
+            if response != None:
+                self.__respond(response)
+            return
+        # Concatenated commands: the answers of all of them with one final result
+        answers = []
+        for part in commands:
+            response = self.__answer(part, commandVerb(part)) or ''
+            if not response.endswith('\r\nOK\r\n'):
+                self.__respond(''.join(answers) + response)
+                return
+            answers.append(response[:-len('\r\nOK\r\n')])
+        self.__respond(''.join(answers) + '\r\nOK\r\n')
+
+    def __answer(self, command, verb):
+        # Returns the answer of one command or None
+        arguments = command[len(verb):].lstrip('=?')
+        error = self.__errors.get(verb) or self.__errors.get(None)
+        if error != None and (error[1] == None or error[1] > 0) and self.__random.random() < error[2]:
+            if error[1] != None:
+                error[1] -= 1
+            if verb == 'AT+CMGS':
+                # The hat takes the text anyway and answers after Ctrl+Z
+                self.__textModeReceiver = arguments
+                self.__textModeError = (error[0],)
+            elif error[0] != None:
+                return '\r\n' + error[0] + '\r\n'
+            return None
+
+        handler = self.__handlers.get(verb)
+        if handler == None:
+            return '\r\nERROR\r\n'
+        return handler(arguments)
+
+    def __registerCommands(self):
+        for verb in ('AT', 'ATD', 'AT+CHUP', 'ATH', 'AT+HTTPINIT', 'AT+HTTPTERM'):
+            self.__handlers[verb] = self.__onOK
+        self.__handlers['ATE'] = self.__onATE
+        self.__handlers['AT+CFUN'] = self.__onCFUN
+        self.__handlers['AT+CMGF'] = self.__onCMGF
+        self.__handlers['AT+CPMS'] = self.__onCPMS
+        self.__handlers['AT+CMGR'] = self.__onCMGR
+        self.__handlers['AT+CMGL'] = self.__onCMGL
+        self.__handlers['AT+CMGD'] = self.__onCMGD
+        self.__handlers['AT+CMGS'] = self.__onCMGS
+        self.__handlers['AT+CGNSPWR'] = self.__onCGNSPWR
+        self.__handlers['AT+CGNSTST'] = self.__onCGNSTST
+        self.__handlers['AT+CGNSINF'] = self.__onCGNSINF
+        self.__handlers['AT+SAPBR'] = self.__onSAPBR
+        self.__handlers['AT+HTTPPARA'] = self.__onHTTPPARA
+        self.__handlers['AT+HTTPDATA'] = self.__onHTTPDATA
+        self.__handlers['AT+HTTPACTION'] = self.__onHTTPACTION
+        self.__handlers['AT+HTTPREAD'] = self.__onHTTPREAD
+        self.__handlers['AT+CIPMUX'] = self.__onOK
+        self.__handlers['AT+CSTT'] = self.__onOK
+        self.__handlers['AT+CIICR'] = self.__onCIICR
+        self.__handlers['AT+CIFSR'] = self.__onCIFSR
+        self.__handlers['AT+CIPSTART'] = self.__onCIPSTART
+        self.__handlers['AT+CIPSEND'] = self.__onCIPSEND
+        self.__handlers['AT+CIPCLOSE'] = self.__onCIPCLOSE
+
+    def __onOK(self, arguments):
+        return '\r\nOK\r\n'
+
+    def __onATE(self, arguments):
+        self.Echo = arguments != '0'
+        return '\r\nOK\r\n'
+
+    def __onCFUN(self, arguments):
+        if arguments == '':
+            return '\r\n+CFUN: 1\r\n\r\nOK\r\n'
+        if arguments == '1,1':
+            # Reset, the module comes back with its power on defaults
+            self.Resets += 1
+            self.__rebootUntil = time.monotonic() + self.RebootTime
+            threading.Timer(self.RebootTime, self.__rebooted).start()
+        return '\r\nOK\r\n'
+
+    def __rebooted(self):
+        if not self.__running:
+            return
+        self.Echo = True
+        self.__textMode = False
+        self.__gpsPower = False
+        self.__nmeaStreaming = False
+        self.__bearerOpen = False
+        self.__httpUrl = ''
+        self.__httpResponse = None
+        self.__ipStack = False
+        for link in list(self.__links):
+            self.__closeLink(link)
+        for line in ('RDY', '+CFUN: 1', '+CPIN: READY', 'Call Ready', 'SMS Ready'):
+            self.Unsolicited(line)
+
+    # SMS
+    def __onCMGF(self, arguments):
+        if arguments == '':
+            return '\r\n+CMGF: %d\r\n\r\nOK\r\n' % self.__textMode
+        self.__textMode = arguments == '1'
+        return '\r\nOK\r\n'
+
+    def __onCPMS(self, arguments):
+        used = len(self.Inbox)
+        return '\r\n+CPMS: %d,%d,%d,%d,%d,%d\r\n\r\nOK\r\n' % ((used, self.cStorageSize) * 3)
+
+    Statuses = ('REC UNREAD', 'REC READ', 'STO UNSENT', 'STO SENT')   # numbers of the PDU mode
+
+    def __entry(self, slot):
+        # Reading a received message marks it as read. PDU mode: status, no name, length of the PDU
+        entry = self.Inbox[slot]
+        if self.__textMode:
+            header, message = '"%s","%s","","%s"' % (entry[0], entry[1], entry[2]), entry[3]
+        else:
+            header, message = '%d,"",%d' % (self.Statuses.index(entry[0]), len(entry[4]) // 2 - 1), entry[4]
+        if entry[0] == 'REC UNREAD':
+            entry[0] = 'REC READ'
+        return header, message
+
+    def __onCMGR(self, arguments):
+        slot = int(arguments.split(',')[0])
+        if slot not in self.Inbox:
+            return '\r\nOK\r\n'
+        header, message = self.__entry(slot)
+        return '\r\n+CMGR: %s\r\n%s\r\n\r\nOK\r\n' % (header, message)
+
+    def __onCMGL(self, arguments):
+        response = '\r\n'
+        for slot in sorted(self.Inbox):
+            header, message = self.__entry(slot)
+            response += '+CMGL: %d,%s\r\n%s\r\n' % (slot, header, message)
+        return response + '\r\nOK\r\n'
+
+    def __onCMGD(self, arguments):
+        # AT+CMGD=slot or AT+CMGD=slot,flag (1: all read, 4: all)
+        values = arguments.split(',')
+        flag = int(values[1]) if len(values) > 1 else 0
+        if flag == 0:
+            self.Inbox.pop(int(values[0]), None)
+        else:
+            for slot in list(self.Inbox):
+                if flag == 4 or self.Inbox[slot][0] == 'REC READ':
+                    del self.Inbox[slot]
+        return '\r\nOK\r\n'
+
+    def __onCMGS(self, arguments):
+        # The text (PDU mode: the PDU in hex) follows until Ctrl+Z
+        self.__textModeReceiver = arguments.strip('"')
+        if self.Echo:
+            return '\r\n> '
+        return None
+
+    def __sendSMS(self, message):
+        receiver = self.__textModeReceiver
+        error = self.__textModeError
+        self.__textModeReceiver = None
+        self.__textModeError = None
+        if error != None:
+            if error[0] != None:
+                self.__write('\r\n' + error[0] + '\r\n')
+            return
+        if not self.__textMode:
+            # receiver is the length of the PDU without the service centre address
+            try:
+                message = message.strip()
+                part = DecodePDU(message)
+                if len(message) // 2 - 1 - int(message[:2], 16) != int(receiver):
+                    raise ValueError('Length %s does not fit' % receiver)
+            except (ValueError, IndexError):
+                self.__write('\r\n+CMS ERROR: 304\r\n')
+                return
+            self.SentPDUs.append(message)
+            receiver, message = part.Number, part.Message
+        self.SentSMS.append((receiver, message))
+        self.__messageReference = (self.__messageReference + 1) % 256
+        self.__respond('\r\n+CMGS: %d\r\n\r\nOK\r\n' % self.__messageReference)
+
+    # GNSS
+    def __onCGNSPWR(self, arguments):
+        if arguments == '':
+            return '\r\n+CGNSPWR: %d\r\n\r\nOK\r\n' % self.__gpsPower
+        self.__gpsPower = arguments == '1'
+        return '\r\nOK\r\n'
+
+    def __onCGNSINF(self, arguments):
+        utc = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S.000')
+        if not self.__gpsPower:
+            values = '0,0,,,,,,,0,,,,,,0,0,,,,,'
+        elif self.Position == None:
+            values = '1,0,%s,,,,0.00,0.0,0,,,,,,11,0,,,,,' % utc
+        else:
+            values = '1,1,%s,%.6f,%.6f,%.3f,%.2f,%.1f,1,,0.9,1.2,0.8,,11,8,,,42,,' % ((utc,) + self.Position)
+        return '\r\n+CGNSINF: %s\r\n\r\nOK\r\n' % values
+
+    def __onCGNSTST(self, arguments):
+        streaming = arguments == '1'
+        if streaming and not self.__nmeaStreaming:
+            self.__nmeaStreaming = True
+            threading.Thread(target=self.__streamNMEA, daemon=True).start()
+        self.__nmeaStreaming = streaming
+        if not streaming:
+            with self.__nmeaLock:
+                self.__nmeaPending = ''
+        return '\r\nOK\r\n'
+
+    def __streamNMEA(self):
+        while self.__nmeaStreaming:
+            if self.__gpsPower and self.Position != None:
+                sentences = ''.join(self.NMEASentences(self.Position, datetime.now(timezone.utc)))
+                if self.InterleaveNMEA:
+                    with self.__nmeaLock:
+                        # Sent alone, if no answer took the last block
+                        pending = self.__nmeaPending
+                        self.__nmeaPending = sentences if self.__nmeaStreaming else ''
+                    if pending:
+                        self.__write(pending)
+                else:
+                    self.__write(sentences)
+                self.__streamCPUTime = time.thread_time()
+                self.__updateCPUTime()
+            time.sleep(self.NMEAInterval)
+
+    @staticmethod
+    def NMEASentences(Position, UTC):
+        # GGA and RMC sentences (with checksum and line ending) for one position
+        latitude, longitude, altitude, speed, course = Position
+
+        def coordinate(value, width, hemispheres):
+            minutes = abs(value) * 60.0
+            return '%0*d%07.4f,%s' % (width, int(minutes // 60), minutes % 60, hemispheres[value < 0])
+
+        def sentence(body):
+            checksum = 0
+            for char in body.encode('ascii'):
+                checksum ^= char
+            return '$%s*%02X\r\n' % (body, checksum)
+
+        utc = UTC.strftime('%H%M%S') + '.000'
+        position = coordinate(latitude, 2, 'NS') + ',' + coordinate(longitude, 3, 'EW')
+        return [sentence('GNGGA,%s,%s,1,8,0.9,%.1f,M,0.0,M,,' % (utc, position, altitude)),
+                sentence('GNRMC,%s,A,%s,%.2f,%.1f,%s,,,A' % (utc, position, speed / 1.852, course, UTC.strftime('%d%m%y')))]
+
+    # GPRS and HTTP
+    def __onSAPBR(self, arguments):
+        values = arguments.split(',')
+        if values[0] == '1':
+            self.__bearerOpen = True
+        elif values[0] == '0':
+            self.__bearerOpen = False
+        elif values[0] == '2':
+            if self.__bearerOpen:
+                return '\r\n+SAPBR: 1,1,"%s"\r\n\r\nOK\r\n' % self.BearerIP
+            return '\r\n+SAPBR: 1,3,"0.0.0.0"\r\n\r\nOK\r\n'
+        return '\r\nOK\r\n'
+
+    def __onHTTPPARA(self, arguments):
+        name, value = arguments.split(',', 1)
+        value = value[1:-1] if value[:1] == '"' else value
+        if name == '"URL"':
+            self.__httpUrl = value
+        elif name == '"CONTENT"':
+            self.__httpContentType = value
+        return '\r\nOK\r\n'
+
+    def __onHTTPDATA(self, arguments):
+        # AT+HTTPDATA=<size>,<time>, the data follows DOWNLOAD
+        size = int(arguments.split(',')[0])
+        self.__httpData = b''
+        if size == 0:
+            return '\r\nDOWNLOAD\r\n\r\nOK\r\n'
+        self.__receiveData(size, self.__onHTTPDATAreceived)
+        return '\r\nDOWNLOAD\r\n'
+
+    def __onHTTPDATAreceived(self, data):
+        self.__httpData = data
+        self.__write('\r\nOK\r\n')
+
+    def __receiveData(self, size, receiver):
+        # The next size bytes are passed to receiver instead of being parsed as commands
+        self.__data = b''
+        self.__dataRemaining = size
+        self.__dataReceiver = receiver
+
+    def __onHTTPACTION(self, arguments):
+        if arguments not in ('0', '1', '2'):
+            return '\r\nERROR\r\n'
+        if not self.__bearerOpen:
+            self.__httpResponse = (601, b'')
+        else:
+            status, body = self.HttpResponses.get(self.__httpUrl, self.DefaultHttpResponse)
+            if isinstance(body, str):
+                body = body.encode('iso-8859-1')
+            self.__httpResponse = (status, body)
+            if arguments == '1':
+                self.Uploads.append((self.__httpUrl, self.__httpContentType, self.__httpData))
+        status, body = self.__httpResponse
+        action = '\r\n+HTTPACTION: %s,%d,%d\r\n' % (arguments, status, len(body))
+        if self.HttpLatency > 0:
+            threading.Timer(self.HttpLatency, self.__write, (action,)).start()
+            return '\r\nOK\r\n'
+        return '\r\nOK\r\n' + action
+
+    def __onHTTPREAD(self, arguments):
+        if self.__httpResponse == None:
+            return '\r\nERROR\r\n'
+        body = self.__httpResponse[1]
+        if arguments != '':
+            # AT+HTTPREAD=<start>,<size>
+            start, size = [int(value) for value in arguments.split(',')]
+            body = body[start:start + size]
+        return b'\r\n+HTTPREAD: %d\r\n%s\r\nOK\r\n' % (len(body), body)
+
+    # TCP/IP stack, AT+CIPMUX=1 is expected
+    def __onCIICR(self, arguments):
+        if self.__ipStack:
+            return '\r\nERROR\r\n'
+        self.__ipStack = True
+        return '\r\nOK\r\n'
+
+    def __onCIFSR(self, arguments):
+        # The address is the whole answer, there is no OK
+        if not self.__ipStack:
+            return '\r\nERROR\r\n'
+        return '\r\n%s\r\n' % self.BearerIP
+
+    def __onCIPSTART(self, arguments):
+        # AT+CIPSTART=<link>,"TCP","host",port
+        values = arguments.split(',')
+        link = int(values[0])
+        if not self.__ipStack or len(values) != 4:
+            return '\r\nERROR\r\n'
+        if link in self.__links:
+            return '\r\n%d, ALREADY CONNECT\r\n' % link
+        protocol = values[1].strip('"')
+        connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM if protocol == 'TCP' else socket.SOCK_DGRAM)
+        try:
+            connection.connect((values[2].strip('"'), int(values[3])))
+        except OSError:
+            connection.close()
+            return '\r\nOK\r\n\r\n%d, CONNECT FAIL\r\n' % link
+        self.__links[link] = connection
+        threading.Thread(target=self.__receiveLink, args=(link, connection), daemon=True).start()
+        return '\r\nOK\r\n\r\n%d, CONNECT OK\r\n' % link
+
+    def __receiveLink(self, link, connection):
+        # Data of the server is passed on with +RECEIVE
+        ident = threading.get_ident()
+        while True:
+            try:
+                data = connection.recv(1460)
+            except OSError:
+                data = b''
+            self.__linkCPUTimes[ident] = time.thread_time()
+            self.__updateCPUTime()
+            if not data:
+                break
+            self.__respond(b'\r\n+RECEIVE,%d,%d:\r\n%s' % (link, len(data), data))
+        if self.__links.get(link) is connection:
+            # Closed by the server
+            del self.__links[link]
+            connection.close()
+            self.__write('\r\n%d, CLOSED\r\n' % link)
+
+    def __onCIPSEND(self, arguments):
+        # AT+CIPSEND=<link>,<length>, the data follows the prompt
+        link, size = [int(value) for value in arguments.split(',')]
+        if link not in self.__links or not 0 < size <= 1460:
+            return '\r\nERROR\r\n'
+        self.__receiveData(size, lambda data: self.__sendLink(link, data))
+        return '\r\n> '
+
+    def __sendLink(self, link, data):
+        connection = self.__links.get(link)
+        if connection == None:
+            self.__write('\r\n%d, SEND FAIL\r\n' % link)
+            return
+        # Like the hat, SEND OK comes before a CLOSED caused by this data
+        self.__write('\r\n%d, SEND OK\r\n' % link)
+        try:
+            connection.sendall(data)
+        except OSError:
+            pass
+
+    def __onCIPCLOSE(self, arguments):
+        link = int(arguments.split(',')[0])
+        if link not in self.__links:
+            return '\r\nERROR\r\n'
+        self.__closeLink(link)
+        return '\r\n%d, CLOSE OK\r\n' % link
+
+    def __closeLink(self, link):
+        connection = self.__links.pop(link)
+        try:
+            connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        connection.close()
@@ -0,0 +1,267 @@
+#!/usr/bin/python3
+# Filename: stats.py
+import bisect
+import re
+import threading
+import time
+
+regexCommandVerb = re.compile(r'AT[+#]?[A-Z]*')
+
+# Name, Prometheus name and help of every counter
+Counters = (('BytesIn', 'received_bytes_total', 'Bytes received from the hat'),
+            ('BytesOut', 'sent_bytes_total', 'Bytes sent to the hat'),
+            ('Errors', 'errors_total', 'Commands answered with ERROR'),
+            ('CMEErrors', 'cme_errors_total', 'Commands answered with +CME ERROR'),
+            ('CMSErrors', 'cms_errors_total', 'Commands answered with +CMS ERROR'),
+            ('Timeouts', 'timeouts_total', 'Commands without answer'),
+            ('Resyncs', 'resyncs_total', 'AT/ATE0 sent to get the module answering again after a timeout'),
+            ('SoftResets', 'soft_resets_total', 'Resets of the module with AT+CFUN=1,1'),
+            ('Restarts', 'restarts_total', 'Power cycles of the module'),
+            ('SMSsent', 'sms_sent_total', 'SMS sent'),
+            ('SMSfailed', 'sms_failed_total', 'SMS that could not be sent'),
+            ('SMSparts', 'sms_parts_total', 'Parts of long SMS sent in PDU mode'),
+            ('SMSreceived', 'sms_received_total', 'SMS received'),
+            ('UrlCalls', 'url_calls_total', 'URL calls with a HTTP status'),
+            ('UrlFailed', 'url_failed_total', 'URL calls that failed'),
+            ('HttpReuses', 'http_session_reuses_total', 'URL calls that reused the initialized HTTP service'),
+            ('SavedRoundTrips', 'saved_round_trips_total', 'AT round trips saved by reusing the HTTP service'),
+            ('SocketSends', 'socket_sends_total', 'AT+CIPSEND commands, one can carry several TCP messages'),
+            ('SocketReceives', 'socket_receives_total', 'Data blocks received on links (+RECEIVE)'),
+            ('JournalCommits', 'journal_commits_total', 'Writes of the job journal, each with one fsync'),
+            ('JournalCompactions', 'journal_compactions_total', 'Rewrites of the job journal with the pending jobs only'),
+            ('JournalFailed', 'journal_failed_total', 'Writes of the job journal that failed'),
+            ('JournalReplayed', 'journal_replayed_total', 'Jobs of the journal queued again at the start'),
+            ('Failovers', 'failovers_total', 'Jobs a GSMHatPool moved to another modem, because theirs did not answer'))
+
+def commandVerb(Command):
+    # 'AT+CMGS="+49..."\nText' -> 'AT+CMGS', 'ATD123;' -> 'ATD'
+    match = regexCommandVerb.match(Command)
+    return match.group(0) if match else Command.split('\n')[0]
+
+class Histogram:
+    """Counts values (seconds) in fixed buckets, like a Prometheus histogram"""
+
+    Bounds = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+    def __init__(self):
+        self.Counts = [0] * (len(self.Bounds) + 1)     # the last bucket is +Inf
+        self.Count = 0
+        self.Sum = 0.0
+        self.Max = 0.0
+
+    def Add(self, Value):
+        self.Counts[bisect.bisect_left(self.Bounds, Value)] += 1
+        self.Count += 1
+        self.Sum += Value
+        if Value > self.Max:
+            self.Max = Value
+
+    def Snapshot(self):
+        # Buckets is a list of (upper bound, cumulative count), like Prometheus
+        buckets = []
+        count = 0
+        for bound, bucketCount in zip(self.Bounds + (float('inf'),), self.Counts):
+            count += bucketCount
+            buckets.append((bound, count))
+        return {'Count': self.Count, 'Sum': self.Sum, 'Max': self.Max,
+                'Mean': self.Sum / self.Count if self.Count > 0 else 0.0, 'Buckets': buckets}
+
+class TimeoutEstimator:
+    """Timeout per AT command verb, learned from its round trips like the retransmission timeout
+    of TCP: smoothed round trip plus 4 times its mean deviation, at least twice the smoothed round
+    trip and Minimum, at most Maximum (seconds). Until Samples round trips are known, Defaults
+    (verb -> seconds) or Default is used. Every timeout doubles the budget of the verb until the
+    next round trip, so a slow module does not run into timeouts again and again. The verbs in
+    Floors never get less than their default: they wait for the network, fast round trips say
+    nothing about the next one."""
+
+    Alpha = 0.125       # weight of a new round trip
+    Beta = 0.25         # weight of a new deviation
+
+    def __init__(self, Default=5.0, Defaults=None, Minimum=0.5, Maximum=120.0, Samples=3, Floors=()):
+        self.Default = Default
+        self.Defaults = dict(Defaults or {})
+        self.Floors = frozenset(Floors)
+        self.Minimum = Minimum
+        self.Maximum = Maximum
+        self.Samples = Samples
+        self.__lock = threading.Lock()
+        self.__estimates = {}       # verb -> [smoothed round trip, deviation, round trips, backoff factor]
+
+    def Add(self, Verb, Seconds):
+        with self.__lock:
+            estimate = self.__estimates.get(Verb)
+            if estimate == None:
+                self.__estimates[Verb] = [Seconds, Seconds / 2.0, 1, 1]
+                return
+            estimate[1] += self.Beta * (abs(Seconds - estimate[0]) - estimate[1])
+            estimate[0] += self.Alpha * (Seconds - estimate[0])
+            estimate[2] += 1
+            estimate[3] = 1
+
+    def Backoff(self, Verb):
+        # The command timed out
+        with self.__lock:
+            estimate = self.__estimates.get(Verb)
+            if estimate != None:
+                estimate[3] = min(estimate[3] * 2, 64)
+
+    def Get(self, Verb):
+        # Seconds the command Verb (e.g. 'AT+CGNSINF') may take
+        with self.__lock:
+            estimate = self.__estimates.get(Verb)
+            default = self.Defaults.get(Verb, self.Default)
+            if estimate == None or estimate[2] < self.Samples:
+                return default * (estimate[3] if estimate != None else 1)
+            budget = max(estimate[0] + 4 * estimate[1], 2 * estimate[0], self.Minimum)
+            if Verb in self.Floors:
+                budget = max(budget, default)
+            return min(budget * estimate[3], self.Maximum)
+
+    def Snapshot(self):
+        with self.__lock:
+            verbs = list(self.__estimates)
+        return dict((verb, self.Get(verb)) for verb in verbs)
+
+class Statistics:
+    """Collected by the worker thread, read with Snapshot() from any thread"""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__started = time.monotonic()
+        self.__commands = {}
+        self.__waits = {}
+        self.__classWaits = {}
+        self.__recoveries = {}
+        self.__counters = dict.fromkeys([counter[0] for counter in Counters], 0)
+
+    def AddCommand(self, Verb, Seconds):
+        # Round trip of a command, from sending until the final answer
+        with self.__lock:
+            histogram = self.__commands.get(Verb)
+            if histogram == None:
+                histogram = self.__commands[Verb] = Histogram()
+            histogram.Add(Seconds)
+
+    def AddWait(self, Queue, Seconds):
+        # Time a job waited in a queue, until the worker started it
+        with self.__lock:
+            histogram = self.__waits.get(Queue)
+            if histogram == None:
+                histogram = self.__waits[Queue] = Histogram()
+            histogram.Add(Seconds)
+
+    def AddClassWait(self, Name, Seconds):
+        # Time a job class of the scheduler was ready, until the worker started it
+        with self.__lock:
+            histogram = self.__classWaits.get(Name)
+            if histogram == None:
+                histogram = self.__classWaits[Name] = Histogram()
+            histogram.Add(Seconds)
+
+    def AddRecovery(self, Step, Seconds):
+        # Time from a timeout until the module answered again, Step is the one that helped
+        with self.__lock:
+            histogram = self.__recoveries.get(Step)
+            if histogram == None:
+                histogram = self.__recoveries[Step] = Histogram()
+            histogram.Add(Seconds)
+
+    def Count(self, Name, Value=1):
+        with self.__lock:
+            self.__counters[Name] += Value
+
+    def Snapshot(self):
+        with self.__lock:
+            return {'Uptime': time.monotonic() - self.__started,
+                    'Commands': dict((verb, histogram.Snapshot()) for verb, histogram in self.__commands.items()),
+                    'QueueWaits': dict((name, histogram.Snapshot()) for name, histogram in self.__waits.items()),
+                    'ClassWaits': dict((name, histogram.Snapshot()) for name, histogram in self.__classWaits.items()),
+                    'Recoveries': dict((step, histogram.Snapshot()) for step, histogram in self.__recoveries.items()),
+                    'Counters': dict(self.__counters)}
+
+def mergeHistograms(Histograms):
+    # Snapshots of the same Histogram.Bounds
+    merged = {'Count': 0, 'Sum': 0.0, 'Max': 0.0, 'Buckets': None}
+    for histogram in Histograms:
+        merged['Count'] += histogram['Count']
+        merged['Sum'] += histogram['Sum']
+        merged['Max'] = max(merged['Max'], histogram['Max'])
+        if merged['Buckets'] == None:
+            merged['Buckets'] = list(histogram['Buckets'])
+        else:
+            merged['Buckets'] = [(bound, count + other) for (bound, count), (_, other)
+                                 in zip(merged['Buckets'], histogram['Buckets'])]
+    merged['Mean'] = merged['Sum'] / merged['Count'] if merged['Count'] > 0 else 0.0
+    return merged
+
+def MergeStats(StatsList):
+    """Combines the dicts of several GSMHat.GetStats() into one of the same form: histograms,
+    counters and queue lengths are added up, the learned timeouts are the longest ones."""
+    merged = {'Uptime': max([stats['Uptime'] for stats in StatsList] or [0.0])}
+    for key in ('Commands', 'QueueWaits', 'ClassWaits', 'Recoveries'):
+        names = set()
+        for stats in StatsList:
+            names.update(stats.get(key, {}))
+        merged[key] = dict((name, mergeHistograms([stats[key][name] for stats in StatsList if name in stats.get(key, {})]))
+                           for name in names)
+    for key in ('Counters', 'Queues', 'Dropped'):
+        merged[key] = {}
+        for stats in StatsList:
+            for name, value in stats.get(key, {}).items():
+                merged[key][name] = merged[key].get(name, 0) + value
+    merged['CommandTimeouts'] = {}
+    for stats in StatsList:
+        for verb, timeout in stats.get('CommandTimeouts', {}).items():
+            merged['CommandTimeouts'][verb] = max(merged['CommandTimeouts'].get(verb, 0.0), timeout)
+    return merged
+
+def ToPrometheus(Stats, Prefix='gsmhat', Labels=None):
+    """Formats the dict of GSMHat.GetStats() in the Prometheus text format.
+    Labels (e.g. {'device': 'hat1'}) are added to every sample."""
+    constLabels = ''.join('%s="%s",' % (name, escapeLabel(value)) for name, value in sorted((Labels or {}).items()))
+    lines = []
+
+    def sample(name, value, labels=''):
+        labels = (constLabels + labels).rstrip(',')
+        lines.append('%s_%s%s %s' % (Prefix, name, '{' + labels + '}' if labels else '', formatValue(value)))
+
+    def header(name, kind, text):
+        lines.append('# HELP %s_%s %s' % (Prefix, name, text))
+        lines.append('# TYPE %s_%s %s' % (Prefix, name, kind))
+
+    def histograms(name, label, values, text):
+        header(name, 'histogram', text)
+        for key in sorted(values):
+            histogram = values[key]
+            keyLabel = '%s="%s",' % (label, escapeLabel(key))
+            for bound, count in histogram['Buckets']:
+                sample(name + '_bucket', count, keyLabel + 'le="%s",' % formatValue(bound))
+            sample(name + '_sum', histogram['Sum'], keyLabel)
+            sample(name + '_count', histogram['Count'], keyLabel)
+
+    header('uptime_seconds', 'gauge', 'Seconds since the hat object was created')
+    sample('uptime_seconds', Stats['Uptime'])
+    histograms('command_duration_seconds', 'command', Stats['Commands'], 'Round trip of AT commands')
+    histograms('queue_wait_seconds', 'queue', Stats['QueueWaits'], 'Time jobs waited until they were started')
+    histograms('class_wait_seconds', 'class', Stats.get('ClassWaits', {}), 'Time job classes were ready until they were started')
+    histograms('recovery_seconds', 'step', Stats.get('Recoveries', {}), 'Time from a timeout until the module answered again')
+    header('queue_length', 'gauge', 'Items in the queues')
+    for name in sorted(Stats.get('Queues', {})):
+        sample('queue_length', Stats['Queues'][name], 'queue="%s",' % escapeLabel(name))
+    header('queue_dropped_total', 'counter', 'Items dropped or rejected because a queue was full')
+    for name in sorted(Stats.get('Dropped', {})):
+        sample('queue_dropped_total', Stats['Dropped'][name], 'queue="%s",' % escapeLabel(name))
+    for name, metric, text in Counters:
+        if name in Stats['Counters']:
+            header(metric, 'counter', text)
+            sample(metric, Stats['Counters'][name])
+    return '\n'.join(lines) + '\n'
+
+def escapeLabel(Value):
+    return str(Value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def formatValue(Value):
+    if Value == float('inf'):
+        return '+Inf'
+    return repr(Value)
@@ -0,0 +1,222 @@
+#!/usr/bin/python3
+# Filename: telemetry.py
+import collections
+import itertools
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+from .gsmHat import GPS
+from .track import toTimestamp
+
+# Batch format (zlib compressed): header, then one record of varints per fix.
+# Time, latitude, longitude and altitude are deltas to the previous fix (the first fix to 0),
+# speed and course are absolute.
+Magic = b'GT'
+Version = 1
+Header = struct.Struct('<2sBIH')    # magic, version, seconds of the first fix, number of fixes
+TimeScale = 10                      # 0.1 seconds
+DegreeScale = 1000000               # 0.000001 degrees (about 0.1 m)
+AltitudeScale = 10                  # 0.1 meters
+SpeedScale = 10                     # 0.1 km/h
+
+def appendVarint(Buffer, Value):
+    # Unsigned LEB128, 1 byte for values < 128
+    while Value > 0x7f:
+        Buffer.append((Value & 0x7f) | 0x80)
+        Value >>= 7
+    Buffer.append(Value)
+
+def appendSigned(Buffer, Value):
+    # Zigzag: 0, -1, 1, -2, ... -> 0, 1, 2, 3, ...
+    appendVarint(Buffer, Value * 2 if Value >= 0 else -Value * 2 - 1)
+
+def readVarint(Data, Offset):
+    value = 0
+    shift = 0
+    while True:
+        byte = Data[Offset]
+        Offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, Offset
+        shift += 7
+
+def readSigned(Data, Offset):
+    value, Offset = readVarint(Data, Offset)
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1), Offset
+
+def EncodeBatch(Fixes):
+    """Fixes is a list of (Time, Latitude, Longitude, Altitude, Speed, Course), Time in
+    seconds since epoch. Returns the compressed batch."""
+    base = int(Fixes[0][0]) if Fixes else 0
+    buffer = bytearray(Header.pack(Magic, Version, base, len(Fixes)))
+    last = (base * TimeScale, 0, 0, 0)
+    for fix in Fixes:
+        values = (int(round(fix[0] * TimeScale)), int(round(fix[1] * DegreeScale)),
+                  int(round(fix[2] * DegreeScale)), int(round(fix[3] * AltitudeScale)))
+        for value, previous in zip(values, last):
+            appendSigned(buffer, value - previous)
+        appendVarint(buffer, max(int(round(fix[4] * SpeedScale)), 0))
+        appendVarint(buffer, int(round(fix[5])) % 360)
+        last = values
+    return zlib.compress(bytes(buffer), 9)
+
+def DecodeBatch(Payload):
+    # Counterpart of EncodeBatch() for the server, returns the list of fixes
+    data = zlib.decompress(Payload)
+    magic, version, base, count = Header.unpack_from(data)
+    if magic != Magic or version != Version:
+        raise ValueError('No telemetry batch of version %d' % Version)
+    offset = Header.size
+    values = [base * TimeScale, 0, 0, 0]
+    fixes = []
+    for i in range(count):
+        for index in range(4):
+            delta, offset = readSigned(data, offset)
+            values[index] += delta
+        speed, offset = readVarint(data, offset)
+        course, offset = readVarint(data, offset)
+        fixes.append((values[0] / float(TimeScale), values[1] / float(DegreeScale), values[2] / float(DegreeScale),
+                      values[3] / float(AltitudeScale), speed / float(SpeedScale), float(course)))
+    return fixes
+
+def positionOf(Values):
+    position = GPS()
+    position.Latitude = Values[1]
+    position.Longitude = Values[2]
+    return position
+
+class TelemetryUploader:
+    """Collects the GPS fixes of the hat and POSTs them as compressed batches (see EncodeBatch)
+    to Url, instead of one URL call per fix. A batch is sent when MaxFixes fixes are collected,
+    the oldest one is MaxAge seconds old or the position moved MaxDistance meters. A timer sends
+    the batch at MaxAge and tries a failed upload again, also when no new fixes come in.
+    Only one batch is on the way at a time. Fixes stay in the buffer until their batch was
+    accepted (HTTP status 200), a full buffer (MaxPending) drops the oldest fix."""
+
+    def __init__(self, Hat, Url, MaxFixes=60, MaxAge=60.0, MaxDistance=1000.0, MaxPending=36000, MaxBatch=3600,
+                 RetryInterval=30.0, ContentType='application/octet-stream'):
+        self.Url = Url
+        self.MaxFixes = MaxFixes
+        self.MaxAge = MaxAge                # seconds
+        self.MaxDistance = MaxDistance      # meters
+        self.MaxBatch = MaxBatch            # fixes per POST
+        self.RetryInterval = RetryInterval  # seconds after a failed upload
+        self.ContentType = ContentType
+        self.Counters = dict.fromkeys(('Fixes', 'Sent', 'Dropped', 'Batches', 'Failed', 'PayloadBytes'), 0)
+        self.__hat = Hat
+        self.__pending = collections.deque(maxlen=MaxPending)    # (sequence, values)
+        self.__sequence = 0
+        self.__firstAt = 0.0                # monotonic time of the oldest unsent fix
+        self.__firstPosition = None
+        self.__upload = None                # (future, last sequence of the batch)
+        self.__retryAt = 0.0                # monotonic time of the next attempt after a failed upload, 0 = none
+        self.__timer = None
+        self.__closed = False
+        self.__lock = threading.Lock()
+        Hat.AddGPSListener(self.Add)
+
+    def __len__(self):
+        return len(self.__pending)
+
+    def Add(self, Position):
+        # GPS listener, fixes without valid UTC are ignored
+        if not isinstance(Position.UTC, datetime):
+            return
+        values = (toTimestamp(Position.UTC), Position.Latitude, Position.Longitude,
+                  Position.Altitude, Position.Speed, Position.Course)
+        with self.__lock:
+            if len(self.__pending) == self.__pending.maxlen:
+                self.Counters['Dropped'] += 1
+            self.__sequence += 1
+            self.__pending.append((self.__sequence, values))
+            self.Counters['Fixes'] += 1
+            if self.__firstPosition == None:
+                self.__firstAt = time.monotonic()
+                self.__firstPosition = Position
+                self.__schedule(self.__firstAt + self.MaxAge)
+            due = self.__due(Position)
+        if due:
+            self.Flush()
+
+    def __due(self, position):
+        if len(self.__pending) >= self.MaxFixes or time.monotonic() - self.__firstAt >= self.MaxAge:
+            return True
+        return GPS.CalculateDeltaP(self.__firstPosition, position) >= self.MaxDistance
+
+    def __schedule(self, at):
+        # Replaces the timer, called with the lock held
+        if self.__timer != None:
+            self.__timer.cancel()
+        if self.__closed:
+            self.__timer = None
+            return
+        self.__timer = threading.Timer(max(at - time.monotonic(), 0.0), self.__onTimer)
+        self.__timer.daemon = True
+        self.__timer.start()
+
+    def __onTimer(self):
+        with self.__lock:
+            now = time.monotonic()
+            due = len(self.__pending) > 0 and (now - self.__firstAt >= self.MaxAge or 0 < self.__retryAt <= now)
+        if due:
+            self.Flush()
+
+    def Flush(self, Force=False):
+        """Sends the collected fixes, returns the Future of the URL call or None.
+        Without Force nothing is sent during the retry interval after a failed upload."""
+        with self.__lock:
+            if self.__upload != None or not self.__pending:
+                return None
+            if not Force and time.monotonic() < self.__retryAt:
+                return None
+            batch = list(itertools.islice(self.__pending, self.MaxBatch))
+            payload = EncodeBatch([values for sequence, values in batch])
+            future = self.__hat.CallUrl(self.Url, 'POST', payload, self.ContentType)
+            self.__upload = (future, batch[-1][0])
+            self.Counters['PayloadBytes'] += len(payload)
+        future.add_done_callback(self.__onUploaded)
+        return future
+
+    def __onUploaded(self, future):
+        with self.__lock:
+            last = self.__upload[1]
+            self.__upload = None
+            try:
+                success = not future.cancelled() and future.result().Status == 200
+            except Exception:
+                success = False
+            if success:
+                # Fixes dropped in the meantime are gone already
+                while self.__pending and self.__pending[0][0] <= last:
+                    self.__pending.popleft()
+                    self.Counters['Sent'] += 1
+                self.Counters['Batches'] += 1
+                self.__firstPosition = None
+                self.__retryAt = 0.0
+                if self.__pending:
+                    # Fixes that came in during the upload start the next batch
+                    self.__firstAt = time.monotonic()
+                    self.__firstPosition = positionOf(self.__pending[0][1])
+                    self.__schedule(self.__firstAt + self.MaxAge)
+            else:
+                self.Counters['Failed'] += 1
+                self.__retryAt = time.monotonic() + self.RetryInterval
+                self.__schedule(self.__retryAt)
+            more = success and len(self.__pending) >= self.MaxFixes
+        if more:
+            self.Flush()
+
+    def Close(self, Flush=True):
+        # Stops collecting, the remaining fixes are sent (Flush) or kept
+        self.__hat.RemoveGPSListener(self.Add)
+        with self.__lock:
+            self.__closed = True
+            if self.__timer != None:
+                self.__timer.cancel()
+                self.__timer = None
+        if Flush:
+            return self.Flush(Force=True)
+        return None
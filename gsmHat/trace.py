@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# Filename: trace.py
+import collections
+import threading
+import time
+
+# Verbosity per category
+TraceOff = 0
+TraceCommands = 1       # sent commands and state changes
+TraceResponses = 2      # ... and received lines
+TraceData = 3           # ... and raw data like SMS texts and HTTP bodies
+
+Categories = ('SMS', 'GPS', 'GPRS', 'CALL', 'STATE')
+
+# Commands and unsolicited lines that belong to a category, all other lines
+# belong to the category of the last command
+commandCategories = (('AT+CMG', 'SMS'), ('AT+CPMS', 'SMS'), ('AT+CGNS', 'GPS'), ('AT+SAPBR', 'GPRS'),
+                     ('AT+HTTP', 'GPRS'), ('AT+CIP', 'GPRS'), ('ATD', 'CALL'), ('AT+CHUP', 'CALL'))
+responseCategories = {'+CMTI': 'SMS', '+CMGR': 'SMS', '+CMGL': 'SMS', '+CMGS': 'SMS', '+CPMS': 'SMS', '+CMGF': 'SMS',
+                      '+CMS ERROR': 'SMS', '+CGNSINF': 'GPS', '+CGNSPWR': 'GPS', '$': 'GPS', '+SAPBR': 'GPRS',
+                      '+HTTPACTION': 'GPRS', '+HTTPREAD': 'GPRS', '+RECEIVE': 'GPRS', '+PDP': 'GPRS',
+                      'RING': 'CALL', 'NO CARRIER': 'CALL'}
+
+def commandCategory(Command):
+    for prefix, category in commandCategories:
+        if Command.startswith(prefix):
+            return category
+    return 'STATE'
+
+class WireTrace:
+    """In-memory ring buffer of the last Size AT exchanges. Nothing is formatted or written
+    until Dump() is called, and while all categories are off (the default) Enabled is False,
+    so callers can skip the trace with a single attribute check."""
+
+    def __init__(self, Size=1000, Path='gsmHatTrace.log'):
+        self.Path = Path
+        self.Enabled = False
+        self.__levels = dict.fromkeys(Categories, TraceOff)
+        self.__entries = collections.deque(maxlen=Size)
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def SetLevel(self, Category, Level):
+        # Category is one of Categories or None for all of them
+        for category in (Categories if Category == None else (Category,)):
+            if category not in self.__levels:
+                raise ValueError('Unknown trace category: %s' % category)
+            self.__levels[category] = Level
+        self.Enabled = max(self.__levels.values()) > TraceOff
+
+    def GetLevel(self, Category):
+        return self.__levels[Category]
+
+    def Record(self, Category, Level, Direction, Text, Args=None):
+        """Direction is '>' (sent), '<' (received) or '-' (internal event).
+        Text % Args is only formatted by Dump()."""
+        if self.__levels[Category] >= Level:
+            self.__entries.append((time.monotonic(), Category, Direction, Text, Args))
+
+    def Clear(self):
+        self.__entries.clear()
+
+    def Entries(self):
+        # List of (Monotonic time, Category, Direction, Text)
+        return self.__format(list(self.__entries))
+
+    def __format(self, entries):
+        return [(stamp, category, direction, text % args if args != None else text)
+                for stamp, category, direction, text, args in entries]
+
+    def Dump(self, Reason='request', Path=None):
+        """Appends the buffer to the trace file and clears it, returns the number of entries"""
+        with self.__lock:
+            # popleft() instead of clear(), so entries recorded in the meantime are kept
+            entries = [self.__entries.popleft() for i in range(len(self.__entries))]
+            if not entries:
+                return 0
+            offset = time.time() - time.monotonic()
+            with open(Path or self.Path, 'a', encoding='utf-8') as file:
+                file.write('--- %s: %d entries, dumped at %s ---\n' % (Reason, len(entries), formatTime(time.time())))
+                for stamp, category, direction, text in self.__format(entries):
+                    file.write('%s %-5s %s %s\n' % (formatTime(stamp + offset), category, direction, escape(text)))
+        return len(entries)
+
+def escape(Text):
+    # One line per entry: line breaks, Ctrl+Z and non-ASCII characters inside the text are escaped
+    return Text.rstrip('\r\n').encode('unicode_escape').decode('ascii')
+
+def formatTime(Timestamp):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(Timestamp)) + ('%.3f' % (Timestamp % 1.0))[1:]
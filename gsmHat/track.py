@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+# Filename: track.py
+import threading
+from array import array
+from datetime import datetime, timezone
+
+def toTimestamp(Time):
+    # datetime (UTC, like GPS.UTC) or seconds since epoch -> seconds since epoch
+    if isinstance(Time, datetime):
+        if Time.tzinfo is None:
+            Time = Time.replace(tzinfo=timezone.utc)
+        return Time.timestamp()
+    return float(Time)
+
+class GPSTrack:
+    """Ring buffer of the last Capacity positions. Every value is stored in its own
+    array column (8 bytes per value), so there is no Python object per position.
+    A Capacity of 0 keeps no positions."""
+
+    Columns = ('Time', 'Latitude', 'Longitude', 'Altitude', 'Speed', 'Course', 'HDOP')
+
+    def __init__(self, Capacity=36000):
+        self.Capacity = Capacity
+        self.__columns = [array('d') for name in self.Columns]
+        self.__start = 0        # physical index of the oldest position
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__columns[0])
+
+    def Append(self, Position):
+        # Position is a GPS object, positions without valid UTC are ignored
+        if not isinstance(Position.UTC, datetime):
+            return False
+        return self.AppendValues(toTimestamp(Position.UTC), Position.Latitude, Position.Longitude,
+                                 Position.Altitude, Position.Speed, Position.Course, Position.HDOP)
+
+    def AppendValues(self, Time, Latitude, Longitude, Altitude=0.0, Speed=0.0, Course=0.0, HDOP=0.0):
+        if self.Capacity <= 0:
+            return False
+        values = (toTimestamp(Time), Latitude, Longitude, Altitude, Speed, Course, HDOP)
+        with self.__lock:
+            count = len(self)
+            # Keep the track sorted by time, older positions come too late
+            if count > 0 and values[0] <= self.__columns[0][self.__physical(count - 1)]:
+                return False
+
+            if count < self.Capacity:
+                for column, value in zip(self.__columns, values):
+                    column.append(value)
+            else:
+                for column, value in zip(self.__columns, values):
+                    column[self.__start] = value
+                self.__start = (self.__start + 1) % self.Capacity
+        return True
+
+    def Clear(self):
+        with self.__lock:
+            self.__columns = [array('d') for name in self.Columns]
+            self.__start = 0
+
+    def __physical(self, index):
+        return (self.__start + index) % len(self.__columns[0])
+
+    def __bisect(self, time):
+        # First logical index with a time >= time
+        times = self.__columns[0]
+        low = 0
+        high = len(times)
+        while low < high:
+            middle = (low + high) // 2
+            if times[self.__physical(middle)] < time:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def PositionAt(self, Time):
+        """Returns (Latitude, Longitude, Altitude) at Time, interpolated between the two
+        neighbouring positions, or None if Time is outside of the track"""
+        time = toTimestamp(Time)
+        with self.__lock:
+            count = len(self)
+            index = self.__bisect(time)
+            if count == 0 or index == count or (index == 0 and self.__columns[0][self.__physical(0)] != time):
+                return None
+
+            after = self.__physical(index)
+            times, latitudes, longitudes, altitudes = self.__columns[:4]
+            if times[after] == time:
+                return (latitudes[after], longitudes[after], altitudes[after])
+
+            before = self.__physical(index - 1)
+            factor = (time - times[before]) / (times[after] - times[before])
+            deltaLongitude = longitudes[after] - longitudes[before]
+            if deltaLongitude > 180.0:
+                deltaLongitude -= 360.0
+            elif deltaLongitude < -180.0:
+                deltaLongitude += 360.0
+            longitude = longitudes[before] + factor * deltaLongitude
+            if longitude > 180.0:
+                longitude -= 360.0
+            elif longitude < -180.0:
+                longitude += 360.0
+
+            return (latitudes[before] + factor * (latitudes[after] - latitudes[before]),
+                    longitude,
+                    altitudes[before] + factor * (altitudes[after] - altitudes[before]))
+
+    def FixesBetween(self, Start, End):
+        """Returns a dict with one array per column for all positions with Start <= time <= End"""
+        start = toTimestamp(Start)
+        end = toTimestamp(End)
+        with self.__lock:
+            first = self.__bisect(start)
+            last = self.__bisect(end)
+            count = len(self)
+            if last < count and self.__columns[0][self.__physical(last)] == end:
+                last += 1
+            return self.__slice(first, last)
+
+    def Export(self):
+        """Returns a dict with one array per column for the whole track, oldest position first"""
+        with self.__lock:
+            return self.__slice(0, len(self))
+
+    def __slice(self, first, last):
+        result = {}
+        if first >= last:
+            for name in self.Columns:
+                result[name] = array('d')
+            return result
+
+        begin = self.__physical(first)
+        end = self.__physical(last - 1) + 1
+        for name, column in zip(self.Columns, self.__columns):
+            if begin < end:
+                result[name] = column[begin:end]
+            else:
+                result[name] = column[begin:] + column[:end]
+        return result
+
+    def ToNumpy(self):
+        """Returns the whole track as numpy array with one row per position (needs numpy)"""
+        import numpy
+        columns = self.Export()
+        return numpy.column_stack([numpy.frombuffer(columns[name], dtype=numpy.float64) for name in self.Columns])
+
+    def WriteCSV(self, File):
+        # File is an open text file
+        columns = self.Export()
+        File.write(','.join(self.Columns) + '\n')
+        for row in zip(*[columns[name] for name in self.Columns]):
+            File.write(','.join(repr(value) for value in row) + '\n')